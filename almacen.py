@@ -0,0 +1,382 @@
+# almacen.py
+"""Almacén persistente de pedidos confirmados sobre SQLite (modo WAL).
+
+Las escrituras se encolan y un hilo en segundo plano las confirma en lotes,
+así el turno del chat que confirma un pedido nunca espera al disco.
+
+En la misma transacción que los pedidos se actualiza la tabla `agregados`
+(ventas por tipo, material, color, dimensión y día de confirmación, y el
+embudo de conversación), así la analítica lee unas pocas filas sin importar cuántos
+pedidos haya guardados.
+
+Los conteos del embudo se escriben en su propia transacción, aparte de los
+pedidos. Un pedido que no pasa la validación se descarta (con un log); si la
+base falla (bloqueada, disco lleno), el lote se reintenta con espera
+exponencial y, si sigue fallando, sus eventos se agregan como JSONL a
+`ruta_fallidos` para recuperarlos con `recuperar_fallidos()`.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+logger = logging.getLogger(__name__)
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS pedidos (
+    id INTEGER PRIMARY KEY,
+    cliente TEXT,
+    email TEXT,
+    fecha TEXT NOT NULL,
+    confirmado TEXT,
+    estado TEXT NOT NULL,
+    total REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items_pedido (
+    id INTEGER PRIMARY KEY,
+    pedido_id INTEGER NOT NULL REFERENCES pedidos(id),
+    tipo_mueble TEXT NOT NULL,
+    material TEXT NOT NULL,
+    color TEXT NOT NULL,
+    dimensiones TEXT NOT NULL,
+    cantidad INTEGER NOT NULL,
+    precio_unitario REAL NOT NULL,
+    precio_total REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pedidos_email ON pedidos(email);
+CREATE INDEX IF NOT EXISTS idx_pedidos_fecha ON pedidos(fecha);
+CREATE INDEX IF NOT EXISTS idx_pedidos_estado ON pedidos(estado);
+CREATE INDEX IF NOT EXISTS idx_items_pedido ON items_pedido(pedido_id);
+-- cuenta: líneas de item por valor del catálogo, pedidos por día de confirmación, conversaciones por etapa del embudo
+CREATE TABLE IF NOT EXISTS agregados (
+    dimension TEXT NOT NULL,
+    clave TEXT NOT NULL,
+    cuenta INTEGER NOT NULL DEFAULT 0,
+    unidades INTEGER NOT NULL DEFAULT 0,
+    ingresos REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, clave)
+);
+"""
+
+COLUMNAS_ITEM = ('tipo_mueble', 'material', 'color', 'dimensiones', 'cantidad', 'precio_unitario', 'precio_total')
+# Columnas de items_pedido que se agregan, cada una como su propia dimensión
+DIMENSIONES_ITEM = ('tipo_mueble', 'material', 'color', 'dimensiones')
+
+SQL_ACUMULAR = """
+INSERT INTO agregados (dimension, clave, cuenta, unidades, ingresos) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (dimension, clave) DO UPDATE SET
+    cuenta = cuenta + excluded.cuenta,
+    unidades = unidades + excluded.unidades,
+    ingresos = ingresos + excluded.ingresos
+"""
+
+# Reconstrucción completa desde las tablas de pedidos (el embudo no se puede reconstruir).
+# Los pedidos guardados antes de registrar la confirmación cuentan por su fecha de creación
+SQL_RECONSTRUIR = [
+    *(f"INSERT INTO agregados SELECT '{d}', {d}, COUNT(*), SUM(cantidad), SUM(precio_total) FROM items_pedido GROUP BY {d}"
+      for d in DIMENSIONES_ITEM),
+    """INSERT INTO agregados
+       SELECT 'dia', substr(COALESCE(p.confirmado, p.fecha), 1, 10), COUNT(*), COALESCE(SUM(u.unidades), 0), SUM(p.total)
+       FROM pedidos p LEFT JOIN (
+           SELECT pedido_id, SUM(cantidad) AS unidades FROM items_pedido GROUP BY pedido_id
+       ) u ON u.pedido_id = p.id
+       GROUP BY substr(COALESCE(p.confirmado, p.fecha), 1, 10)""",
+]
+
+Delta = Dict[Tuple[str, str], List[float]]
+
+class AlmacenPedidos:
+    """Guarda los payloads de `PedidoManager.exportar_pedido()` en SQLite"""
+
+    def __init__(self, ruta: str, tamano_lote: int = 500, intervalo: float = 0.5, max_pendientes: int = 50_000,
+                 max_intentos: int = 5, espera_inicial: float = 0.1, ruta_fallidos: Optional[str] = None):
+        self.ruta = ruta
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.max_intentos = max_intentos
+        self.espera_inicial = espera_inicial
+        self.ruta_fallidos = ruta_fallidos or f"{ruta}.fallidos.jsonl"
+        # Eventos ("pedido", payload) o ("embudo", etapas); None detiene el hilo
+        self._cola: "queue.Queue[Optional[Tuple[str, Any]]]" = queue.Queue(max_pendientes)
+
+        conexion = self._conectar()
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.executescript(ESQUEMA)
+        # Bases creadas antes de guardar la fecha de confirmación
+        if "confirmado" not in {fila[1] for fila in conexion.execute("PRAGMA table_info(pedidos)")}:
+            conexion.execute("ALTER TABLE pedidos ADD COLUMN confirmado TEXT")
+        # Bases creadas antes de existir los agregados: se calculan una vez desde los pedidos
+        if conexion.execute("SELECT 1 FROM pedidos LIMIT 1").fetchone() and \
+                not conexion.execute("SELECT 1 FROM agregados WHERE dimension = 'dia' LIMIT 1").fetchone():
+            self._reconstruir(conexion)
+        conexion.close()
+
+        self._hilo = threading.Thread(target=self._escribir_en_lotes, name="almacen-pedidos", daemon=True)
+        self._hilo.start()
+
+    def _conectar(self) -> sqlite3.Connection:
+        conexion = sqlite3.connect(self.ruta, timeout=30)
+        conexion.execute("PRAGMA synchronous=NORMAL")
+        return conexion
+
+    # --- ESCRITURA ---
+    def guardar(self, pedido: Dict):
+        """Encola un pedido para guardarlo; solo bloquea si la cola está llena"""
+        self._cola.put(("pedido", pedido))
+
+    def registrar_embudo(self, etapas: Iterable[str]):
+        """Encola las etapas del embudo que una conversación alcanzó por primera vez"""
+        self._cola.put(("embudo", tuple(etapas)))
+
+    def esperar(self):
+        """Bloquea hasta que todos los pedidos encolados estén en disco"""
+        self._cola.join()
+
+    def cerrar(self):
+        if self._hilo.is_alive():
+            self._cola.put(None)
+            self._hilo.join()
+
+    def _escribir_en_lotes(self):
+        conexion = self._conectar()
+        activo = True
+        while activo:
+            lote = [self._cola.get()]
+            # Se agrupa lo que llegue durante el intervalo, hasta completar el lote
+            try:
+                while len(lote) < self.tamano_lote:
+                    lote.append(self._cola.get(timeout=self.intervalo))
+            except queue.Empty:
+                pass
+
+            eventos = [e for e in lote if e is not None]
+            activo = len(eventos) == len(lote)
+            try:
+                self._escribir_lote(conexion, eventos)
+            except Exception:
+                # Nada de lo anterior debería fallar, pero el hilo no puede morir: los siguientes lotes se perderían
+                logger.exception("Error inesperado al escribir un lote de %d eventos", len(eventos))
+            finally:
+                for _ in lote:
+                    self._cola.task_done()
+        conexion.close()
+
+    def _escribir_lote(self, conexion: sqlite3.Connection, eventos: List[Tuple[str, Any]]):
+        embudo = Counter(etapa for tipo, datos in eventos if tipo == "embudo" for etapa in datos)
+        pedidos = []
+        for tipo, datos in eventos:
+            if tipo != "pedido":
+                continue
+            try:
+                validar_pedido(datos)
+                pedidos.append(datos)
+            except ValueError as error:
+                logger.error("Pedido descartado por inválido (%s): %r", error, datos)
+
+        # El embudo no depende de que los pedidos del lote se guarden
+        if embudo and not self._con_reintentos(lambda: self._insertar(conexion, [], embudo), "el embudo"):
+            self._guardar_fallidos([("embudo", dict(embudo))])
+        if pedidos and not self._con_reintentos(lambda: self._insertar(conexion, pedidos), f"{len(pedidos)} pedidos"):
+            self._guardar_fallidos([("pedido", pedido) for pedido in pedidos])
+
+    def _con_reintentos(self, operacion, descripcion: str) -> bool:
+        """Ejecuta `operacion`; reintenta los fallos operativos de SQLite (bloqueo, disco lleno)"""
+        espera = self.espera_inicial
+        for intento in range(1, self.max_intentos + 1):
+            try:
+                operacion()
+                return True
+            except sqlite3.OperationalError as error:
+                if intento == self.max_intentos:
+                    logger.error("No se pudo guardar %s tras %d intentos: %s", descripcion, intento, error)
+                    return False
+                logger.warning("Fallo al guardar %s (%s); intento %d de %d en %.1fs",
+                               descripcion, error, intento + 1, self.max_intentos, espera)
+                time.sleep(espera)
+                espera *= 2
+            except Exception:
+                logger.exception("No se pudo guardar %s", descripcion)
+                return False
+        return False
+
+    def _guardar_fallidos(self, eventos: List[Tuple[str, Any]]):
+        try:
+            with open(self.ruta_fallidos, "a", encoding="utf-8") as f:
+                for tipo, datos in eventos:
+                    f.write(json.dumps({'tipo': tipo, 'datos': datos}, ensure_ascii=False) + "\n")
+        except (OSError, TypeError, ValueError):
+            logger.exception("Tampoco se pudieron guardar %d eventos en %s", len(eventos), self.ruta_fallidos)
+
+    def recuperar_fallidos(self) -> int:
+        """Vuelve a encolar los eventos de `ruta_fallidos` (p. ej. tras liberar disco); devuelve cuántos"""
+        try:
+            # Se renombra antes de leer: lo que falle de nuevo va a un archivo nuevo
+            pendiente = f"{self.ruta_fallidos}.{time.time_ns()}"
+            os.replace(self.ruta_fallidos, pendiente)
+        except FileNotFoundError:
+            return 0
+        total = 0
+        with open(pendiente, encoding="utf-8") as f:
+            for linea in f:
+                if linea.strip():
+                    evento = json.loads(linea)
+                    datos = evento['datos']
+                    if evento['tipo'] == "embudo":
+                        self._cola.put(("embudo", tuple(etapa for etapa, n in datos.items() for _ in range(n))))
+                    else:
+                        self._cola.put(("pedido", datos))
+                    total += 1
+        os.remove(pendiente)
+        return total
+
+    @staticmethod
+    def _insertar(conexion: sqlite3.Connection, pedidos: List[Dict], embudo: Optional[Counter] = None):
+        # Los agregados del lote se suman en memoria y se aplican con un upsert por clave
+        delta: Delta = {}
+        for pedido in pedidos:
+            unidades = 0
+            for item in pedido['items']:
+                unidades += item['cantidad']
+                for dimension in DIMENSIONES_ITEM:
+                    _acumular(delta, dimension, item[dimension], 1, item['cantidad'], item['precio_total'])
+            # Un pedido cuenta el día en que se confirmó, no el día en que empezó la conversación
+            _acumular(delta, 'dia', (pedido.get('confirmado') or pedido['fecha'])[:10], 1, unidades, pedido['total'])
+        for etapa, conversaciones in (embudo or {}).items():
+            _acumular(delta, 'embudo', etapa, conversaciones, 0, 0.0)
+
+        with conexion:
+            for pedido in pedidos:
+                cursor = conexion.execute(
+                    "INSERT INTO pedidos (cliente, email, fecha, confirmado, estado, total) VALUES (?, ?, ?, ?, ?, ?)",
+                    (pedido['cliente'], pedido['email'], pedido['fecha'], pedido.get('confirmado'),
+                     pedido['estado'], pedido['total'])
+                )
+                conexion.executemany(
+                    f"INSERT INTO items_pedido (pedido_id, {', '.join(COLUMNAS_ITEM)}) VALUES (?, {', '.join('?' * len(COLUMNAS_ITEM))})",
+                    [(cursor.lastrowid, *(item[c] for c in COLUMNAS_ITEM)) for item in pedido['items']]
+                )
+            conexion.executemany(SQL_ACUMULAR, [(*clave, *valores) for clave, valores in delta.items()])
+
+    def reconstruir_agregados(self):
+        """Recalcula los agregados de ventas desde los pedidos guardados (p. ej. tras editar la base a mano)"""
+        conexion = self._conectar()
+        try:
+            self._reconstruir(conexion)
+        finally:
+            conexion.close()
+
+    @staticmethod
+    def _reconstruir(conexion: sqlite3.Connection):
+        # BEGIN IMMEDIATE: ningún otro proceso puede insertar pedidos entre el borrado y el recálculo
+        conexion.isolation_level = None
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            conexion.execute("DELETE FROM agregados WHERE dimension != 'embudo'")
+            for sql in SQL_RECONSTRUIR:
+                conexion.execute(sql)
+            conexion.execute("COMMIT")
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+        finally:
+            conexion.isolation_level = ""
+
+    # --- CONSULTA ---
+    def agregados(self) -> List[Dict]:
+        """Filas de la tabla `agregados`; su tamaño depende del catálogo y de los días, no de los pedidos"""
+        conexion = self._conectar()
+        conexion.row_factory = sqlite3.Row
+        try:
+            return [dict(fila) for fila in conexion.execute("SELECT * FROM agregados ORDER BY dimension, clave")]
+        finally:
+            conexion.close()
+
+    def buscar(self, email: Optional[str] = None, estado: Optional[str] = None,
+               desde: Optional[str] = None, hasta: Optional[str] = None,
+               limite: Optional[int] = None) -> List[Dict]:
+        """Pedidos filtrados por email, estado y rango de fechas ISO (usa los índices)"""
+        return list(self._consultar(email, estado, desde, hasta, limite))
+
+    def exportar_jsonl(self, salida: TextIO, **filtros: Any) -> int:
+        """Exporta en bloque los pedidos (con sus items) como JSONL; devuelve cuántos"""
+        total = 0
+        for pedido in self._consultar(**filtros):
+            salida.write(json.dumps(pedido, ensure_ascii=False) + "\n")
+            total += 1
+        return total
+
+    def _consultar(self, email: Optional[str] = None, estado: Optional[str] = None,
+                   desde: Optional[str] = None, hasta: Optional[str] = None,
+                   limite: Optional[int] = None) -> Iterator[Dict]:
+        condiciones, parametros = [], []
+        if email is not None:
+            # El chat guarda las direcciones en minúsculas
+            email = email.strip().lower()
+        for sql, valor in (("email = ?", email), ("estado = ?", estado), ("fecha >= ?", desde), ("fecha < ?", hasta)):
+            if valor is not None:
+                condiciones.append(sql)
+                parametros.append(valor)
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        limit = f"LIMIT {int(limite)}" if limite else ""
+
+        conexion = self._conectar()
+        conexion.row_factory = sqlite3.Row
+        try:
+            pedidos = conexion.execute(
+                f"SELECT * FROM pedidos {where} ORDER BY id {limit}", parametros
+            )
+            # Los items se leen por bloques de pedidos para no hacer una consulta por pedido
+            while filas := pedidos.fetchmany(500):
+                ids = [fila['id'] for fila in filas]
+                items: Dict[int, List[Dict]] = {i: [] for i in ids}
+                for item in conexion.execute(
+                    f"SELECT * FROM items_pedido WHERE pedido_id IN ({', '.join('?' * len(ids))}) ORDER BY id", ids
+                ):
+                    items[item['pedido_id']].append({c: item[c] for c in COLUMNAS_ITEM})
+                for fila in filas:
+                    yield {
+                        'id': fila['id'],
+                        'cliente': fila['cliente'],
+                        'email': fila['email'],
+                        'fecha': fila['fecha'],
+                        'confirmado': fila['confirmado'],
+                        'items': items[fila['id']],
+                        'total': fila['total'],
+                        'estado': fila['estado']
+                    }
+        finally:
+            conexion.close()
+
+def validar_pedido(pedido: Any):
+    """Lanza ValueError si `pedido` no tiene la forma de `PedidoManager.exportar_pedido()`"""
+    if not isinstance(pedido, dict):
+        raise ValueError("el pedido no es un objeto")
+    for campo, tipos, obligatorio in (("fecha", str, True), ("estado", str, True), ("total", (int, float), True),
+                                      ("cliente", str, False), ("email", str, False), ("confirmado", str, False)):
+        valor = pedido.get(campo)
+        if (valor is not None or obligatorio) and (isinstance(valor, bool) or not isinstance(valor, tipos)):
+            raise ValueError(f"'{campo}' inválido")
+    if not isinstance(pedido.get('items'), list):
+        raise ValueError("'items' debe ser una lista")
+    for item in pedido['items']:
+        if not isinstance(item, dict):
+            raise ValueError("item inválido")
+        for campo in COLUMNAS_ITEM:
+            valor = item.get(campo)
+            tipos = str if campo in DIMENSIONES_ITEM else int if campo == 'cantidad' else (int, float)
+            if isinstance(valor, bool) or not isinstance(valor, tipos):
+                raise ValueError(f"'{campo}' inválido en un item")
+
+def _acumular(delta: Delta, dimension: str, clave: str, cuenta: int, unidades: int, ingresos: float):
+    valores = delta.get((dimension, clave))
+    if valores is None:
+        delta[(dimension, clave)] = [cuenta, unidades, ingresos]
+    else:
+        valores[0] += cuenta
+        valores[1] += unidades
+        valores[2] += ingresos
@@ -1,50 +1,100 @@
 # app.py
 import streamlit as st
-import pandas as pd
+import numpy as np
 from datetime import datetime
 import re
-from typing import List, Dict, Any, Optional
+import sys
+import heapq
+from typing import TYPE_CHECKING, List, Dict, Any, NamedTuple, Optional, Tuple
 import json
+import os
+import unicodedata
+import zlib
+import threading
+import time
+import logging
+import sqlite3
+import uuid
+
+from almacen import AlmacenPedidos
+from despacho import DespachoConfirmaciones, DestinoSpool, crear_destino, extraer_email
+from catalogo import CAMPO_PRECIO, leer_catalogo
+from intenciones import obtener_clasificador
+from metricas import METRICAS
+from respaldo_nlp import obtener_parser_respaldo
+
+# pandas se importa solo donde se usa (planillas, tablas del panel, analítica): el chat no lo necesita
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
 
 # --- CONFIGURACIÓN MEJORADA ---
 class Configuracion:
-    CATALOGO = {
-        "tipos_mueble": {
-            "SILLA": {"precio_base": 150.00, "descripcion": "Silla ergonómica personalizada"},
-            "MESA": {"precio_base": 300.00, "descripcion": "Mesa de centro o comedor"},
-            "SOFÁ": {"precio_base": 800.00, "descripcion": "Sofá de 3 plazas personalizado"},
-            "ESTANTERÍA": {"precio_base": 250.00, "descripcion": "Estantería modular"},
-            "ESCRITORIO": {"precio_base": 400.00, "descripcion": "Escritorio de trabajo"}
-        },
-        "materiales": {
-            "MADERA_NOBLE": {"precio_extra": 200.00, "descripcion": "Roble o nogal macizo"},
-            "MADERA_MDF": {"precio_extra": 50.00, "descripcion": "MDF lacado"},
-            "METAL": {"precio_extra": 100.00, "descripcion": "Acero inoxidable"},
-            "VIDRIO": {"precio_extra": 120.00, "descripcion": "Vidrio templado"},
-            "BAMBÚ": {"precio_extra": 80.00, "descripcion": "Bambú sostenible"},
-            "MADERA_RECICLADA": {"precio_extra": 90.00, "descripcion": "Madera reciclada tratada"}
-        },
-        "colores": {
-            "NATURAL": {"precio_extra": 0.00, "descripcion": "Acabado natural"},
-            "BLANCO": {"precio_extra": 30.00, "descripcion": "Acabado blanco mate"},
-            "NEGRO": {"precio_extra": 40.00, "descripcion": "Acabado negro brillante"},
-            "MADERA_OSCURA": {"precio_extra": 60.00, "descripcion": "Tono caoba o wengué"},
-            "GRIS": {"precio_extra": 35.00, "descripcion": "Gris moderno"}
-        },
-        "dimensiones": {
-            "PEQUEÑO": {"factor": 0.8, "descripcion": "Dimensiones reducidas"},
-            "ESTÁNDAR": {"factor": 1.0, "descripcion": "Dimensiones estándar"},
-            "GRANDE": {"factor": 1.3, "descripcion": "Dimensiones ampliadas"}
-        }
-    }
-    
+    # Catálogo de muebles (JSON o CSV, ver catalogo.py); se recarga al cambiar el archivo
+    RUTA_CATALOGO = os.environ.get("DESIGNBOT_CATALOGO", os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalogo.json"))
+    # Segundos entre comprobaciones de la fecha de modificación del catálogo
+    INTERVALO_CATALOGO = 2.0
+    # Opciones listadas como máximo en cada menú
+    MAX_OPCIONES_MENU = 12
+
+    # Base de datos SQLite donde se guardan los pedidos confirmados
+    RUTA_BD_PEDIDOS = os.environ.get("DESIGNBOT_BD_PEDIDOS", "pedidos.db")
+
+    # Correos de confirmación (ver despacho.py): servidor SMTP "host[:puerto]"; sin él, se dejan en el spool
+    SMTP_CORREO = os.environ.get("DESIGNBOT_SMTP")
+    SPOOL_CORREO = os.environ.get("DESIGNBOT_SPOOL_CORREO", "correo_saliente")
+    REMITENTE_CORREO = os.environ.get("DESIGNBOT_REMITENTE", "pedidos@designbot.local")
+    # Destinatario de las órdenes de trabajo; sin configurar no se envían (un buzón inventado rebotaría)
+    CORREO_TALLER = os.environ.get("DESIGNBOT_CORREO_TALLER") or None
+
+    # Base SQLite con los mensajes antiguos del chat, fuera de la sesión; se borran tras TTL_HISTORIAL_CHAT segundos
+    RUTA_HISTORIAL_CHAT = os.environ.get("DESIGNBOT_HISTORIAL_CHAT", "historial_chat.db")
+    TTL_HISTORIAL_CHAT = 7 * 24 * 3600
+    INTERVALO_PURGA_CHAT = 3600
+
+    # Mensajes del chat mostrados por defecto y cuántos más carga "ver anteriores"
+    VENTANA_CHAT = 30
+    PAGINA_CHAT = 30
+
+    # Confianza mínima (1 - distancia de edición relativa) para aceptar una corrección de escritura
+    UMBRAL_DIFUSO = 0.66
+
+    # Modelo de spaCy para los mensajes que las reglas no reconocen (vacío lo desactiva)
+    MODELO_NLP = os.environ.get("DESIGNBOT_MODELO_NLP", "es_core_news_sm")
+
+    # Modelo de intenciones generado con entrenar_intenciones.py (si no existe, no se usa)
+    RUTA_MODELO_INTENCIONES = os.environ.get("DESIGNBOT_MODELO_INTENCIONES", "modelo_intenciones")
+
+    # Cargar catálogo, modelo de intenciones y respaldo NLP en segundo plano al arrancar el proceso
+    PRECARGA = os.environ.get("DESIGNBOT_PRECARGA", "1") not in ("", "0")
+
+    # Métricas de latencia y flujo (ver metricas.py); desactivadas no tienen coste apreciable
+    METRICAS_ACTIVAS = os.environ.get("DESIGNBOT_METRICAS", "") not in ("", "0")
+    # Archivo donde volcar las métricas en formato Prometheus, como mucho cada INTERVALO_METRICAS segundos
+    RUTA_METRICAS = os.environ.get("DESIGNBOT_RUTA_METRICAS")
+    INTERVALO_METRICAS = 10.0
+
+    # Página de analítica de ventas para administración (ver pagina_analitica)
+    ANALITICA_ACTIVA = os.environ.get("DESIGNBOT_ANALITICA", "") not in ("", "0")
+    # Segundos que se reutilizan los agregados leídos antes de volver a consultar la base
+    TTL_ANALITICA = 30
+
     PATRONES_ENTRADA = {
         "saludos": ["hola", "hi", "hello", "buenos días", "buenas tardes", "buenas"],
         "afirmaciones": ["sí", "si", "por favor", "ok", "vale", "correcto", "confirmar"],
         "negaciones": ["no", "n", "cancelar", "reiniciar"],
-        "acciones": ["modificar", "cambiar", "eliminar", "quitar", "borrar"]
+        "acciones": ["modificar", "cambiar", "eliminar", "quitar", "quita", "borrar"],
+        "presentacion": ["me llamo", "soy", "nombre"],
+        "inicio": ["sí", "si", "por favor", "quiero", "diseñar", "mueble", "muebles", "personalizar", "empezar", "comenzar"],
+        "agregar_mas": ["sí", "si", "s", "quiero", "agregar", "otro", "más", "mas", "otra"],
+        "terminar": ["no", "n", "listo", "terminar", "finalizar", "eso es todo"],
+        "resumen": ["resumen", "pedido", "carrito", "qué tengo", "ver pedido"],
+        "cancelar": ["cancelar", "reiniciar", "empezar de nuevo"]
     }
 
+METRICAS.activo = Configuracion.METRICAS_ACTIVAS
+
 # --- ESTADOS DEL PEDIDO ---
 class EstadoPedido:
     INICIO = "inicio"
@@ -59,147 +109,997 @@ class EstadoPedido:
     ESPERANDO_CONTACTO = "esperando_contacto"
     COMPLETADO = "completado"
 
+# Etapas del embudo de conversión, en orden; cada pedido cuenta una vez en cada etapa que alcanza
+ETAPAS_EMBUDO = (
+    EstadoPedido.INICIO, EstadoPedido.ESPERANDO_TIPO, EstadoPedido.ESPERANDO_MATERIAL,
+    EstadoPedido.ESPERANDO_COLOR, EstadoPedido.ESPERANDO_DIMENSION, EstadoPedido.AGREGANDO_MAS,
+    EstadoPedido.FINALIZANDO, EstadoPedido.ESPERANDO_CONTACTO, EstadoPedido.COMPLETADO
+)
+POSICION_EMBUDO = {estado: posicion for posicion, estado in enumerate(ETAPAS_EMBUDO)}
+
+# --- RECONOCIMIENTO DE ENTRADA ---
+class Acierto(NamedTuple):
+    valor: str
+    frase: str
+    inicio: int
+    # False si el valor se hereda de una frase más corta contenida en `frase`
+    directo: bool
+
+class Correccion(NamedTuple):
+    """Palabra escrita con errores (texto[inicio:fin]) y el valor del catálogo que parece ser"""
+    valor: str
+    frase: str
+    inicio: int
+    fin: int
+
+def _patron_trie(frases) -> str:
+    """Alternativa regex con forma de trie: el motor avanza por los prefijos comunes
+    en lugar de probar cada frase, y las opcionales codiciosas prefieren la más larga"""
+    raiz: Dict[str, Dict] = {}
+    for frase in frases:
+        nodo = raiz
+        for caracter in frase:
+            nodo = nodo.setdefault(caracter, {})
+        nodo[""] = {}
+
+    def compilar(nodo: Dict[str, Dict]) -> str:
+        ramas = [re.escape(caracter) + compilar(hijo) for caracter, hijo in sorted(nodo.items()) if caracter]
+        if not ramas:
+            return ""
+        patron = ramas[0] if len(ramas) == 1 else f"(?:{'|'.join(ramas)})"
+        return f"(?:{patron})?" if "" in nodo else patron
+
+    return compilar(raiz)
+
+class MatcherEntrada:
+    """Detecta intenciones y valores del catálogo en una sola pasada sobre el texto.
+
+    Todas las frases conocidas se compilan en una única expresión regular con
+    límites de palabra, así las claves de una letra ("s", "m", "l", "n") solo
+    coinciden como palabras sueltas. Cada frase hereda además los aciertos de
+    las frases más cortas que contiene ("madera oscura" también es "madera"),
+    de modo que una coincidencia larga no oculta a las que solapa.
+    """
+
+    def __init__(self, catalogo: Dict, sinonimos: Dict[str, Dict[str, str]], patrones: Dict[str, List[str]]):
+        frases: Dict[str, List[Tuple[str, str]]] = {}
+        for categoria, valores in catalogo.items():
+            for valor in valores:
+                frases.setdefault(valor.lower().replace('_', ' '), []).append((categoria, valor))
+        for categoria, tabla in sinonimos.items():
+            for frase, valor in tabla.items():
+                frases.setdefault(frase, []).append((categoria, valor))
+        for intencion, lista in patrones.items():
+            for frase in lista:
+                frases.setdefault(frase, []).append((intencion, frase))
+        # Una clave del catálogo puede repetirse como sinónimo ("mesa")
+        frases = {frase: list(dict.fromkeys(propios)) for frase, propios in frases.items()}
+
+        self._aciertos: Dict[str, List[Tuple[str, str, bool]]] = {}
+        for frase, propios in frases.items():
+            aciertos = [(categoria, valor, True) for categoria, valor in propios]
+            # Las frases contenidas son sus secuencias de palabras, de más larga a más corta
+            palabras = frase.split()
+            for largo in range(len(palabras) - 1, 0, -1):
+                for inicio in range(len(palabras) - largo + 1):
+                    for categoria, valor in frases.get(" ".join(palabras[inicio:inicio + largo]), ()):
+                        if all((c, v) != (categoria, valor) for c, v, _ in aciertos):
+                            aciertos.append((categoria, valor, False))
+            self._aciertos[frase] = aciertos
+
+        self._regex = re.compile(rf"(?<!\w)(?:{_patron_trie(frases)})(?!\w)")
+
+        # Solo los valores del catálogo de una palabra admiten corrección de escritura, con un
+        # índice por categoría: se corrige hacia lo que el bot está preguntando y nada más
+        self._difuso = {
+            categoria: IndiceDifuso({
+                frase: [(c, v) for c, v in propios if c == categoria]
+                for frase, propios in frases.items()
+                if " " not in frase and len(frase) > 2 and any(c == categoria for c, _ in propios)
+            })
+            for categoria in catalogo
+        }
+
+    def analizar(self, texto: str) -> Dict[str, List[Acierto]]:
+        """Devuelve {categoría: [Acierto, ...]} en orden de aparición"""
+        resultado: Dict[str, List[Acierto]] = {}
+        for coincidencia in self._regex.finditer(texto):
+            frase = coincidencia.group(0)
+            for categoria, valor, directo in self._aciertos[frase]:
+                resultado.setdefault(categoria, []).append(
+                    Acierto(valor, frase, coincidencia.start(), directo)
+                )
+        return resultado
+
+    def corregir(self, texto: str, analisis: Dict[str, List[Acierto]], categoria: str,
+                 umbral: float) -> Optional[Correccion]:
+        """Valor de `categoria` más parecido a alguna palabra del texto escrita con errores, o None.
+
+        Solo se consideran las palabras que no forman parte de ninguna coincidencia exacta.
+        """
+        indice = self._difuso.get(categoria)
+        if indice is None:
+            return None
+        cubiertos = [(a.inicio, a.inicio + len(a.frase)) for aciertos in analisis.values() for a in aciertos]
+        mejor, confianza = None, umbral
+        for palabra in re.finditer(r"[^\W\d_]{3,}", texto):
+            if any(inicio <= palabra.start() < fin for inicio, fin in cubiertos):
+                continue
+            encontrado = indice.buscar(palabra.group(0), confianza)
+            if encontrado is not None and (mejor is None or encontrado[2] > confianza):
+                frase, valores, confianza = encontrado
+                mejor = Correccion(valores[0][1], frase, palabra.start(), palabra.end())
+        return mejor
+
+def _sin_acentos(texto: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFD", texto) if unicodedata.category(c) != "Mn")
+
+def _normalizar_valor(texto: str) -> str:
+    return " ".join(_sin_acentos(texto).lower().replace("_", " ").split())
+
+def _distancia_edicion(a: str, b: str) -> int:
+    """Distancia de Damerau-Levenshtein restringida (una transposición cuenta como un error)"""
+    anterior2, anterior = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i]
+        for j, cb in enumerate(b, 1):
+            costo = min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb and anterior2[j - 2] + 1 < costo:
+                costo = anterior2[j - 2] + 1
+            actual.append(costo)
+        anterior2, anterior = anterior, actual
+    return anterior[-1]
+
+class IndiceDifuso:
+    """Índice invertido de trigramas para corregir errores de escritura ("siila", "gri").
+
+    Los trigramas solo preseleccionan `max_candidatos` frases; la distancia de
+    edición se calcula sobre esas pocas, así el coste por palabra no depende
+    del tamaño del catálogo.
+    """
+
+    def __init__(self, frases: Dict[str, List[Tuple[str, str]]], max_candidatos: int = 5, max_lista: int = 1000):
+        self.max_candidatos = max_candidatos
+        # Trigramas presentes en más frases que esto no discriminan y se ignoran al buscar
+        self.max_lista = max_lista
+        self._frases = list(frases)
+        self._normalizadas = [_sin_acentos(f) for f in self._frases]
+        self._valores = [frases[f] for f in self._frases]
+        self._indice: Dict[str, List[int]] = {}
+        for posicion, frase in enumerate(self._normalizadas):
+            for trigrama in set(self._trigramas(frase)):
+                self._indice.setdefault(trigrama, []).append(posicion)
+
+    @staticmethod
+    def _trigramas(palabra: str) -> List[str]:
+        relleno = f"  {palabra} "
+        return [relleno[i:i + 3] for i in range(len(relleno) - 2)]
+
+    def buscar(self, palabra: str, umbral: float = 0.0) -> Optional[Tuple[str, List[Tuple[str, str]], float]]:
+        """Mejor frase para `palabra` como (frase, [(categoría, valor)], confianza), o None"""
+        palabra = _sin_acentos(palabra)
+        votos: Dict[int, int] = {}
+        for trigrama in set(self._trigramas(palabra)):
+            posiciones = self._indice.get(trigrama, ())
+            if len(posiciones) > self.max_lista:
+                continue
+            for posicion in posiciones:
+                votos[posicion] = votos.get(posicion, 0) + 1
+        mejor, confianza = None, umbral
+        for posicion in heapq.nlargest(self.max_candidatos, votos, key=votos.__getitem__):
+            frase = self._normalizadas[posicion]
+            largo = max(len(palabra), len(frase))
+            # La diferencia de longitud ya es una cota inferior de la distancia
+            if 1 - abs(len(palabra) - len(frase)) / largo < confianza:
+                continue
+            similitud = 1 - _distancia_edicion(palabra, frase) / largo
+            if similitud > confianza or mejor is None and similitud >= confianza:
+                mejor, confianza = posicion, similitud
+        if mejor is None:
+            return None
+        return self._frases[mejor], self._valores[mejor], confianza
+
+# --- GRAMÁTICA DE CANTIDADES ---
+# Palabra -> (valor, clase). La clase decide cómo se combina con los tokens vecinos:
+# unidad (1-9), especial (10-29), decena (30-90, admite "y" + unidad), centena (100-900),
+# y los multiplicadores "mil", "docena"/"par" (multiplo) y "media" ("media docena")
+PALABRAS_NUMERO = {
+    **{palabra: (1, "unidad") for palabra in ("un", "una", "uno")},
+    "dos": (2, "unidad"), "tres": (3, "unidad"), "cuatro": (4, "unidad"), "cinco": (5, "unidad"),
+    "seis": (6, "unidad"), "siete": (7, "unidad"), "ocho": (8, "unidad"), "nueve": (9, "unidad"),
+    "diez": (10, "especial"), "once": (11, "especial"), "doce": (12, "especial"), "trece": (13, "especial"),
+    "catorce": (14, "especial"), "quince": (15, "especial"), "dieciséis": (16, "especial"),
+    "dieciseis": (16, "especial"), "diecisiete": (17, "especial"), "dieciocho": (18, "especial"),
+    "diecinueve": (19, "especial"), "veinte": (20, "especial"),
+    **{palabra: (21, "especial") for palabra in ("veintiún", "veintiun", "veintiuno", "veintiuna")},
+    "veintidós": (22, "especial"), "veintidos": (22, "especial"), "veintitrés": (23, "especial"),
+    "veintitres": (23, "especial"), "veinticuatro": (24, "especial"), "veinticinco": (25, "especial"),
+    "veintiséis": (26, "especial"), "veintiseis": (26, "especial"), "veintisiete": (27, "especial"),
+    "veintiocho": (28, "especial"), "veintinueve": (29, "especial"),
+    "treinta": (30, "decena"), "cuarenta": (40, "decena"), "cincuenta": (50, "decena"),
+    "sesenta": (60, "decena"), "setenta": (70, "decena"), "ochenta": (80, "decena"), "noventa": (90, "decena"),
+    "cien": (100, "centena"), "ciento": (100, "centena"),
+    **{f"{prefijo}{genero}": (valor, "centena")
+       for prefijo, valor in (("doscient", 200), ("trescient", 300), ("cuatrocient", 400), ("quinient", 500),
+                              ("seiscient", 600), ("setecient", 700), ("ochocient", 800), ("novecient", 900))
+       for genero in ("os", "as")},
+    "mil": (1000, "mil"),
+    "docena": (12, "multiplo"), "docenas": (12, "multiplo"), "par": (2, "multiplo"),
+    "media": (0.5, "media"), "medio": (0.5, "media"),
+}
+# Mayor valor que puede sumarse tras cada clase dentro del mismo número ("ciento veinte", no "veinte tres")
+HUECO_TRAS = {"unidad": 0, "especial": 0, "decena": 0, "centena": 99, "mil": 999}
+# Solo los dígitos y las palabras numéricas llegan a Python; el resto del texto lo salta el motor de regex
+PATRON_CANTIDAD = re.compile(rf"\b(?:(\d+)|({_patron_trie([*PALABRAS_NUMERO, 'y'])}))\b")
+
+class Cantidad(NamedTuple):
+    valor: int
+    inicio: int
+    fin: int
+
+class _Numero:
+    """Número en construcción a partir de tokens contiguos"""
+    __slots__ = ('inicio', 'fin', 'total', 'actual', 'hueco', 'ultima', 'factor', 'fin_sin_y')
+
+    def __init__(self, inicio: int):
+        self.inicio = inicio
+        self.fin = inicio
+        self.total = 0
+        self.actual = 0
+        self.hueco = 999
+        self.ultima: Optional[str] = None
+        self.factor = 1.0
+        self.fin_sin_y = inicio
+
+    def agregar(self, valor: float, clase: str) -> bool:
+        """Incorpora el token si continúa el número; False si empieza otro"""
+        if clase == "media":
+            if self.ultima is not None:
+                return False
+            self.factor = valor
+        elif clase == "multiplo":
+            if self.ultima in ("multiplo", "y"):
+                return False
+            self.total = (self.total + (self.actual or 1)) * valor
+            self.actual = 0
+            self.hueco = 0
+        elif clase == "mil":
+            if self.ultima in ("mil", "multiplo", "media", "y") or self.total:
+                return False
+            self.total = (self.actual or 1) * 1000
+            self.actual = 0
+            self.hueco = HUECO_TRAS["mil"]
+        elif clase == "digitos":
+            if self.ultima is not None:
+                return False
+            self.actual = valor
+            self.hueco = 0
+        else:
+            if self.ultima == "media" or valor > self.hueco or (self.ultima == "y") != (clase == "unidad" and self.hueco == 9):
+                return False
+            self.actual += valor
+            self.hueco = HUECO_TRAS[clase]
+        self.ultima = clase
+        return True
+
+    def cantidad(self) -> Optional[Cantidad]:
+        if self.ultima == "y":
+            # El "y" no unía nada ("cuarenta y sillas"): queda fuera de la cantidad
+            self.fin, self.ultima = self.fin_sin_y, "decena"
+        valor = int((self.total + self.actual) * self.factor)
+        # "media" sin "docena" no es una cantidad ("tamaño medio")
+        if self.ultima == "media" or valor <= 0:
+            return None
+        return Cantidad(valor, self.inicio, self.fin)
+
+def extraer_cantidades(texto: str) -> List[Cantidad]:
+    """Cantidades del texto (en minúsculas) en orden, con su posición [inicio, fin).
+
+    Lee dígitos ("3", "1.500") y números escritos hasta los miles ("veinte",
+    "treinta y dos", "dos mil quinientas", "una docena", "un par") en una sola
+    pasada. Los tokens contiguos se combinan por magnitud: "ciento veinte" es
+    una cantidad y "dos tres" son dos.
+    """
+    cantidades: List[Cantidad] = []
+    numero: Optional[_Numero] = None
+    for token in PATRON_CANTIDAD.finditer(texto):
+        digitos, palabra = token.groups()
+        if digitos:
+            valor, clase = int(digitos), "digitos"
+        elif palabra != "y":
+            valor, clase = PALABRAS_NUMERO[palabra]
+        elif numero is None:
+            continue
+        else:
+            valor, clase = 0, "y"
+
+        # Solo espacios separan los tokens de un mismo número; un punto separa los miles ("1.500")
+        separacion = texto[numero.fin:token.start()] if numero is not None else None
+        if separacion and separacion.isspace():
+            if clase == "y":
+                # "treinta y dos": el "y" solo une una decena con la unidad que le sigue
+                if numero.ultima == "decena":
+                    numero.fin_sin_y, numero.fin, numero.ultima, numero.hueco = numero.fin, token.end(), "y", 9
+                continue
+            if numero.agregar(valor, clase):
+                numero.fin = token.end()
+                continue
+        elif separacion == "." and clase == "digitos" and len(digitos) == 3 and numero.ultima == "digitos":
+            numero.actual = numero.actual * 1000 + valor
+            numero.fin = token.end()
+            continue
+        if clase == "y":
+            continue
+
+        if numero is not None:
+            cantidad = numero.cantidad()
+            if cantidad:
+                cantidades.append(cantidad)
+        numero = _Numero(token.start())
+        numero.agregar(valor, clase)
+        numero.fin = token.end()
+
+    if numero is not None:
+        cantidad = numero.cantidad()
+        if cantidad:
+            cantidades.append(cantidad)
+    return cantidades
+
+def cantidad_para(cantidades: List[Cantidad], posicion: int, desde: int = 0, hasta: Optional[int] = None) -> Optional[Cantidad]:
+    """Cantidad de la mención en `posicion` dentro del tramo [desde, hasta).
+
+    Prefiere la más cercana antes de la mención ("2 sillas"); si no hay, la primera
+    después ("sillas, 3"). None si el tramo no tiene ninguna.
+    """
+    if hasta is None:
+        hasta = float("inf")
+    elegida = None
+    for cantidad in cantidades:
+        if cantidad.inicio < desde:
+            continue
+        if cantidad.inicio >= hasta:
+            break
+        if cantidad.fin <= posicion:
+            elegida = cantidad
+        elif elegida is None and cantidad.inicio >= posicion:
+            return cantidad
+        elif elegida is not None:
+            break
+    return elegida
+
+# --- TABLA DE PRECIOS ---
+class TablaPrecios:
+    """Precios unitarios del catálogo: (precio_base + extra_material + extra_color) * factor.
+
+    Se guardan los componentes por eje, en el orden de `ejes`, así la memoria
+    crece con la suma y no con el producto de los tamaños de cada eje;
+    `tensor` materializa todas las combinaciones solo si se pide.
+    """
+
+    EJES = ("tipos_mueble", "materiales", "colores", "dimensiones")
+
+    def __init__(self, catalogo: Dict, version: int = 0):
+        self.version = version
+        self.ejes = {eje: tuple(catalogo[eje]) for eje in self.EJES}
+        self.componentes = {
+            eje: np.array([v[CAMPO_PRECIO[eje]] for v in catalogo[eje].values()], dtype=float)
+            for eje in self.EJES
+        }
+        # Búsqueda escalar para ItemPedido: un acceso a dict por eje
+        self._por_eje = tuple(dict(zip(self.ejes[eje], self.componentes[eje].tolist())) for eje in self.EJES)
+        self._tensor: Optional[np.ndarray] = None
+
+        # Claves ordenadas por eje para traducir arrays de texto con searchsorted
+        self._orden = {}
+        for eje in self.EJES:
+            nombres = np.array(self.ejes[eje])
+            permutacion = np.argsort(nombres)
+            self._orden[eje] = (nombres[permutacion], permutacion)
+
+    @property
+    def tensor(self) -> np.ndarray:
+        """`tensor[t, m, c, d]`: precio unitario de cada combinación"""
+        if self._tensor is None:
+            base, material, color, factor = (self.componentes[eje] for eje in self.EJES)
+            subtotal = base[:, None, None] + material[None, :, None] + color[None, None, :]
+            tensor = subtotal[..., None] * factor
+            tensor.setflags(write=False)
+            self._tensor = tensor
+        return self._tensor
+
+    def precio_unitario(self, tipo_mueble: str, material: str, color: str, dimensiones: str) -> float:
+        base, extra_material, extra_color, factor = self._por_eje
+        return (base[tipo_mueble] + extra_material[material] + extra_color[color]) * factor[dimensiones]
+
+    def disponible(self, tipo_mueble: str, material: str, color: str, dimensiones: str) -> bool:
+        """False si algún valor ya no está en el catálogo (p. ej. se quitó al recargarlo)"""
+        return all(valor in precios for valor, precios in zip((tipo_mueble, material, color, dimensiones), self._por_eje))
+
+    def _indices(self, eje: str, valores) -> np.ndarray:
+        ordenados, permutacion = self._orden[eje]
+        valores = np.asarray(valores, dtype=str)
+        posiciones = np.searchsorted(ordenados, valores).clip(max=len(ordenados) - 1)
+        invalidos = ordenados[posiciones] != valores
+        if invalidos.any():
+            desconocidos = sorted(set(valores[invalidos].tolist()))
+            raise ValueError(f"Valores de {eje} fuera del catálogo: {', '.join(desconocidos)}")
+        return permutacion[posiciones]
+
+    def cotizar_lote(self, tipos_mueble, materiales, colores, dimensiones, cantidades=None) -> np.ndarray:
+        """Precio total de muchas configuraciones en una sola llamada vectorizada"""
+        base, extra_material, extra_color, factor = (self.componentes[eje] for eje in self.EJES)
+        unitarios = (
+            base[self._indices("tipos_mueble", tipos_mueble)]
+            + extra_material[self._indices("materiales", materiales)]
+            + extra_color[self._indices("colores", colores)]
+        ) * factor[self._indices("dimensiones", dimensiones)]
+        if cantidades is None:
+            return unitarios
+        return unitarios * np.asarray(cantidades)
+
+    def lista_precios(self) -> "pd.DataFrame":
+        """Lista completa de precios unitarios, una fila por combinación"""
+        import pandas as pd
+        indice = pd.MultiIndex.from_product(
+            [self.ejes[eje] for eje in self.EJES],
+            names=["tipo_mueble", "material", "color", "dimensiones"]
+        )
+        return pd.DataFrame({"precio_unitario": self.tensor.ravel()}, index=indice).reset_index()
+
+# --- CATÁLOGO ---
+class CatalogoCompilado:
+    """Todo lo que se deriva del archivo de catálogo, construido una sola vez por carga:
+    índice de frases, tabla de precios y textos de los menús."""
+
+    def __init__(self, catalogo: Dict, version: int):
+        self.version = version
+        self.catalogo = catalogo
+        self.sinonimos = {
+            categoria: {frase: clave for clave, datos in valores.items() for frase in datos.get("sinonimos", ())}
+            for categoria, valores in catalogo.items()
+        }
+        self.matcher = MatcherEntrada(catalogo, self.sinonimos, Configuracion.PATRONES_ENTRADA)
+        self.tabla = TablaPrecios(catalogo, version)
+
+        self.nombres = {
+            categoria: [datos.get("nombre") or clave.replace("_", " ").capitalize() for clave, datos in valores.items()]
+            for categoria, valores in catalogo.items()
+        }
+        maximo = Configuracion.MAX_OPCIONES_MENU
+        self.menus = {}
+        self.opciones = {}
+        for categoria, nombres in self.nombres.items():
+            visibles, resto = nombres[:maximo], len(nombres) - maximo
+            self.menus[categoria] = "\n".join(f"• {n}" for n in visibles) + (f"\n• … y {resto} más" if resto > 0 else "")
+            self.opciones[categoria] = (", ".join(visibles[:-1]) + f" o {visibles[-1]}" if len(visibles) > 1 else visibles[0]) + \
+                                       (f" (y {resto} más)" if resto > 0 else "")
+
+        # Clave, nombre y sinónimos normalizados -> clave, para importar planillas
+        self.valores_normalizados = {}
+        for categoria, valores in catalogo.items():
+            indice = {}
+            for (clave, datos), nombre in zip(valores.items(), self.nombres[categoria]):
+                for frase in (clave, nombre, *datos.get("sinonimos", ())):
+                    indice.setdefault(_normalizar_valor(frase), clave)
+            self.valores_normalizados[categoria] = indice
+
+class GestorCatalogo:
+    """Mantiene el catálogo vigente y lo recompila cuando cambia la fecha de modificación del archivo.
+
+    La versión nueva se construye aparte y se publica cambiando una sola
+    referencia, así quien ya tiene el catálogo anterior sigue usándolo sin
+    bloqueos. Si el archivo nuevo no es válido se conserva el anterior.
+    """
+
+    def __init__(self, ruta: str, intervalo: float = 2.0):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self._actual: Optional[CatalogoCompilado] = None
+        self._mtime: Optional[int] = None
+        self._proxima_revision = 0.0
+        self._lock = threading.Lock()
+
+    def actual(self) -> CatalogoCompilado:
+        if self._actual is None or time.monotonic() >= self._proxima_revision:
+            self._revisar()
+        return self._actual
+
+    def _revisar(self):
+        # Solo la primera carga espera; mientras se recompila, el resto usa el catálogo anterior
+        if not self._lock.acquire(blocking=self._actual is None):
+            return
+        try:
+            if self._actual is not None and time.monotonic() < self._proxima_revision:
+                return
+            self._proxima_revision = time.monotonic() + self.intervalo
+            try:
+                mtime = os.stat(self.ruta).st_mtime_ns
+                if mtime == self._mtime:
+                    return
+                self._mtime = mtime
+                version = self._actual.version + 1 if self._actual else 1
+                self._actual = CatalogoCompilado(leer_catalogo(self.ruta), version)
+            except Exception:
+                # Cualquier fallo al leer o compilar conserva la versión vigente; sin ella no hay chat
+                if self._actual is None:
+                    raise
+                logger.exception("No se pudo recargar el catálogo %s; se mantiene la versión %d",
+                                 self.ruta, self._actual.version)
+        finally:
+            self._lock.release()
+
+@st.cache_resource(show_spinner=False)
+def obtener_gestor_catalogo() -> GestorCatalogo:
+    """Un único gestor por proceso.
+
+    Streamlit vuelve a ejecutar este archivo en cada rerun; sin la caché, cada
+    ejecución crearía su propio gestor y recompilaría índices, tabla de precios
+    y menús, y cada sesión retendría una copia.
+    """
+    return GestorCatalogo(Configuracion.RUTA_CATALOGO, Configuracion.INTERVALO_CATALOGO)
+
+_GESTOR_CATALOGO = obtener_gestor_catalogo()
+
+def obtener_catalogo() -> CatalogoCompilado:
+    """Catálogo compilado vigente, compartido por todas las sesiones del proceso"""
+    return _GESTOR_CATALOGO.actual()
+
+def obtener_tabla_precios() -> TablaPrecios:
+    return obtener_catalogo().tabla
+
+def cotizar_lote(tipos_mueble, materiales, colores, dimensiones, cantidades=None) -> np.ndarray:
+    """Cotiza en lote con la tabla de precios vigente"""
+    return obtener_tabla_precios().cotizar_lote(tipos_mueble, materiales, colores, dimensiones, cantidades)
+
 # --- CLASES DEL SISTEMA ---
+def _internar(valor: Any) -> Any:
+    """Comparte una única copia de cada clave del catálogo entre todos los items"""
+    return sys.intern(valor) if isinstance(valor, str) else valor
+
 class ItemPedido:
-    def __init__(self, tipo_mueble: str, material: str, color: str, dimensiones: str, cantidad: int = 1):
-        self.tipo_mueble = tipo_mueble
-        self.material = material
-        self.color = color
-        self.dimensiones = dimensiones
+    # Sin __dict__ por instancia: cada sesión activa guarda sus items en memoria
+    __slots__ = ('tipo_mueble', 'material', 'color', 'dimensiones', 'cantidad')
+
+    CAMPOS_CATALOGO = ('tipo_mueble', 'material', 'color', 'dimensiones')
+
+    def __init__(self, tipo_mueble: Optional[str], material: Optional[str] = None, color: Optional[str] = None,
+                 dimensiones: Optional[str] = None, cantidad: int = 1):
+        self.tipo_mueble = _internar(tipo_mueble)
+        self.material = _internar(material)
+        self.color = _internar(color)
+        self.dimensiones = _internar(dimensiones)
         self.cantidad = cantidad
-        self.id = f"{tipo_mueble}_{material}_{color}_{dimensiones}_{cantidad}"
+
+    @property
+    def id(self) -> str:
+        return f"{self.tipo_mueble}_{self.material}_{self.color}_{self.dimensiones}_{self.cantidad}"
+
+    def esta_completo(self) -> bool:
+        return all(getattr(self, campo) for campo in self.CAMPOS_CATALOGO)
+
+    def primer_campo_faltante(self) -> Optional[str]:
+        return next((campo for campo in self.CAMPOS_CATALOGO if not getattr(self, campo)), None)
+
+    def a_tupla(self) -> tuple:
+        return tuple(getattr(self, campo) for campo in self.__slots__)
+
+    @classmethod
+    def desde_tupla(cls, datos) -> "ItemPedido":
+        return cls(*datos)
     
-    def calcular_precio_unitario(self) -> float:
-        precio_base = Configuracion.CATALOGO["tipos_mueble"][self.tipo_mueble]["precio_base"]
-        extra_material = Configuracion.CATALOGO["materiales"][self.material]["precio_extra"]
-        extra_color = Configuracion.CATALOGO["colores"][self.color]["precio_extra"]
-        factor_dimensiones = Configuracion.CATALOGO["dimensiones"][self.dimensiones]["factor"]
-        subtotal = precio_base + extra_material + extra_color
-        return subtotal * factor_dimensiones
+    def esta_disponible(self, tabla: Optional[TablaPrecios] = None) -> bool:
+        return (tabla or obtener_tabla_precios()).disponible(
+            self.tipo_mueble, self.material, self.color, self.dimensiones
+        )
+
+    def calcular_precio_unitario(self, tabla: Optional[TablaPrecios] = None) -> float:
+        return (tabla or obtener_tabla_precios()).precio_unitario(
+            self.tipo_mueble, self.material, self.color, self.dimensiones
+        )
 
-    def calcular_precio_total(self) -> float:
-        return self.calcular_precio_unitario() * self.cantidad
+    def calcular_precio_total(self, tabla: Optional[TablaPrecios] = None) -> float:
+        return self.calcular_precio_unitario(tabla) * self.cantidad
 
     def obtener_descripcion(self) -> str:
         return f"{self.cantidad}x {self.tipo_mueble.title()} {self.dimensiones.title()}"
 
-    def to_dict(self) -> Dict:
+    def to_dict(self, tabla: Optional[TablaPrecios] = None) -> Dict:
+        precio_unitario = self.calcular_precio_unitario(tabla)
         return {
             'tipo_mueble': self.tipo_mueble,
             'material': self.material,
             'color': self.color,
             'dimensiones': self.dimensiones,
             'cantidad': self.cantidad,
-            'precio_unitario': self.calcular_precio_unitario(),
-            'precio_total': self.calcular_precio_total()
+            'precio_unitario': precio_unitario,
+            'precio_total': precio_unitario * self.cantidad
         }
 
 class PedidoManager:
     def __init__(self):
+        # Etapas del embudo alcanzadas y aún no enviadas al almacén (sobreviven a reiniciar_pedido)
+        self.etapas_nuevas = []
         self.reiniciar_pedido()
     
     def reiniciar_pedido(self):
         self.items = []
         self.item_actual = None
-        self.estado = EstadoPedido.INICIO
+        # Muebles mencionados en un mismo mensaje que esperan a completarse
+        self.items_pendientes = []
+        # Items cuyo producto se quitó del catálogo: salen del pedido y del total, y el resumen los avisa
+        self.items_retirados = []
+        self._estado = EstadoPedido.INICIO
+        # Posición más avanzada en ETAPAS_EMBUDO (-1: el pedido aún no empezó)
+        self.avance_embudo = -1
         self.nombre_cliente = None
         self.email = None
         self.fecha_creacion = datetime.now()
+        # Se fija al confirmar; la analítica por día cuenta los pedidos por esta fecha
+        self.fecha_confirmacion: Optional[datetime] = None
+        # Total acumulado y versión: cada cambio en items incrementa la versión
+        self.total = 0.0
+        self.version = 0
+        self.version_catalogo = obtener_catalogo().version
+        self._resumen_cache = None
+    
+    def _registrar_cambio(self, delta_total: float):
+        """Se llama después de modificar los items, con la diferencia de precio que supuso"""
+        catalogo = obtener_catalogo()
+        if catalogo.version != self.version_catalogo:
+            # Cambiaron los precios del catálogo: el total acumulado ya no sirve
+            self._recalcular(catalogo)
+        else:
+            self.total += delta_total
+        self.version += 1
+
+    def _recalcular(self, catalogo: CatalogoCompilado):
+        """Retira los items que ya no están en `catalogo` y recalcula el total con sus precios"""
+        tabla = catalogo.tabla
+        disponibles = [item for item in self.items if item.esta_disponible(tabla)]
+        total = sum(item.calcular_precio_total(tabla) for item in disponibles)
+        if len(disponibles) < len(self.items):
+            self.items_retirados.extend(item for item in self.items if not item.esta_disponible(tabla))
+            self.items = disponibles
+        self.total = total
+        # La versión se anota solo con el total ya recalculado
+        self.version_catalogo = catalogo.version
+
+    def _sincronizar_precios(self) -> TablaPrecios:
+        """Tabla de precios vigente, con los items y el total ya al día con ella"""
+        catalogo = obtener_catalogo()
+        if self.version_catalogo != catalogo.version:
+            self._recalcular(catalogo)
+            self.version += 1
+        return catalogo.tabla
+
+    @staticmethod
+    def _precio_vigente(item: ItemPedido) -> float:
+        """Precio unitario para calcular un delta; 0 si el item ya no está en el catálogo.
+
+        Los items del pedido están todos en el catálogo de `version_catalogo`, así que
+        si falta uno es que la versión cambió y `_registrar_cambio` recalcula el total entero.
+        """
+        try:
+            return item.calcular_precio_unitario()
+        except KeyError:
+            return 0.0
+
+    @property
+    def estado(self) -> str:
+        return self._estado
+
+    @estado.setter
+    def estado(self, estado: str):
+        self._estado = estado
+        self.avanzar_embudo(estado)
+
+    def avanzar_embudo(self, estado: str):
+        """Anota las etapas hasta `estado` que este pedido no había alcanzado (también las saltadas)"""
+        posicion = POSICION_EMBUDO.get(estado, -1)
+        if posicion > self.avance_embudo:
+            self.etapas_nuevas.extend(ETAPAS_EMBUDO[self.avance_embudo + 1:posicion + 1])
+            self.avance_embudo = posicion
     
     def iniciar_nuevo_item(self, tipo_mueble: str, cantidad: int = 1):
-        self.item_actual = {
-            'tipo_mueble': tipo_mueble,
-            'material': None,
-            'color': None,
-            'dimensiones': None,
-            'cantidad': cantidad
-        }
+        self.item_actual = ItemPedido(tipo_mueble, cantidad=cantidad)
 
     def actualizar_item_actual(self, campo: str, valor: Any):
         if self.item_actual:
-            self.item_actual[campo] = valor
+            setattr(self.item_actual, campo, _internar(valor))
+
+    def tomar_siguiente_pendiente(self) -> Optional[ItemPedido]:
+        """Pasa el siguiente mueble pendiente a item_actual"""
+        self.item_actual = self.items_pendientes.pop(0) if self.items_pendientes else None
+        return self.item_actual
 
     def agregar_item_actual_al_pedido(self):
-        if self.item_actual and all([
-            self.item_actual['tipo_mueble'],
-            self.item_actual['material'], 
-            self.item_actual['color'],
-            self.item_actual['dimensiones']
-        ]):
-            item = ItemPedido(
-                self.item_actual['tipo_mueble'],
-                self.item_actual['material'],
-                self.item_actual['color'], 
-                self.item_actual['dimensiones'],
-                self.item_actual['cantidad']
-            )
+        """True si se agregó; False si está incompleto o si su producto ya no está en el catálogo"""
+        if self.item_actual and self.item_actual.esta_completo():
+            item = self.item_actual
+            self.item_actual = None
+            # Pudo empezarse con un catálogo anterior al vigente
+            tabla = obtener_tabla_precios()
+            if not item.esta_disponible(tabla):
+                self.items_retirados.append(item)
+                self.version += 1
+                return False
             self.items.append(item)
+            self._registrar_cambio(item.calcular_precio_total(tabla))
             return True
         return False
 
     def modificar_cantidad_item(self, index: int, nueva_cantidad: int):
         if 0 <= index < len(self.items):
-            self.items[index].cantidad = nueva_cantidad
+            item = self.items[index]
+            delta = self._precio_vigente(item) * (nueva_cantidad - item.cantidad)
+            item.cantidad = nueva_cantidad
+            self._registrar_cambio(delta)
             return True
         return False
 
     def eliminar_item(self, index: int):
         if 0 <= index < len(self.items):
-            self.items.pop(index)
+            item = self.items.pop(index)
+            self._registrar_cambio(-self._precio_vigente(item) * item.cantidad)
             return True
         return False
 
+    def aplicar_cambios(self, cantidades: Dict[int, int], eliminar: List[int]) -> bool:
+        """Aplica en bloque cambios de cantidad y eliminaciones (índices sobre la lista actual)"""
+        eliminar = {i for i in eliminar if 0 <= i < len(self.items)}
+        cantidades = {i: c for i, c in cantidades.items() if 0 <= i < len(self.items) and i not in eliminar}
+        if not eliminar and not cantidades:
+            return False
+
+        delta = 0.0
+        for i, nueva_cantidad in cantidades.items():
+            item = self.items[i]
+            delta += self._precio_vigente(item) * (nueva_cantidad - item.cantidad)
+            item.cantidad = nueva_cantidad
+        if eliminar:
+            delta -= sum(self._precio_vigente(self.items[i]) * self.items[i].cantidad for i in eliminar)
+            self.items = [item for i, item in enumerate(self.items) if i not in eliminar]
+
+        self._registrar_cambio(delta)
+        return True
+
+    def agregar_items(self, items: List[ItemPedido], total: float):
+        """Agrega muchos items completos de una vez; `total` es la suma de sus precios"""
+        if items:
+            self.items.extend(items)
+            self._registrar_cambio(total)
+
     def calcular_total_pedido(self) -> float:
-        return sum(item.calcular_precio_total() for item in self.items)
+        self._sincronizar_precios()
+        # Con el pedido vacío se descarta el error de redondeo acumulado
+        return self.total if self.items else 0.0
 
     def obtener_resumen_detallado(self) -> str:
+        tabla = self._sincronizar_precios()
+        if self._resumen_cache and self._resumen_cache[0] == self.version:
+            return self._resumen_cache[1]
+
         if not self.items:
-            return "🛒 **Tu pedido está vacío**\n\n¡Agrega algunos productos para comenzar!"
-        
-        resumen = "📋 **RESUMEN DE TU PEDIDO**\n\n"
-        for i, item in enumerate(self.items, 1):
-            precio_unitario = item.calcular_precio_unitario()
-            precio_total = item.calcular_precio_total()
-            resumen += f"{i}. **{item.obtener_descripcion()}**\n"
-            resumen += f"   📦 Material: {item.material.replace('_', ' ').title()}\n"
-            resumen += f"   🎨 Color: {item.color.replace('_', ' ').title()}\n"
-            resumen += f"   💰 ${precio_unitario:.2f} c/u → ${precio_total:.2f} total\n\n"
-        
-        resumen += f"🎯 **TOTAL DEL PEDIDO: ${self.calcular_total_pedido():.2f}**"
+            resumen = "🛒 **Tu pedido está vacío**\n\n¡Agrega algunos productos para comenzar!"
+        else:
+            partes = ["📋 **RESUMEN DE TU PEDIDO**\n\n"]
+            for i, item in enumerate(self.items, 1):
+                precio_unitario = item.calcular_precio_unitario(tabla)
+                precio_total = precio_unitario * item.cantidad
+                partes.append(
+                    f"{i}. **{item.obtener_descripcion()}**\n"
+                    f"   📦 Material: {item.material.replace('_', ' ').title()}\n"
+                    f"   🎨 Color: {item.color.replace('_', ' ').title()}\n"
+                    f"   💰 ${precio_unitario:.2f} c/u → ${precio_total:.2f} total\n\n"
+                )
+            partes.append(f"🎯 **TOTAL DEL PEDIDO: ${self.total:.2f}**")
+            resumen = "".join(partes)
+        if self.items_retirados:
+            retirados = ", ".join(item.obtener_descripcion() for item in self.items_retirados)
+            resumen += f"\n\n⚠️ Ya no están disponibles en el catálogo y se quitaron del pedido: {retirados}"
+
+        self._resumen_cache = (self.version, resumen)
         return resumen
 
     def exportar_pedido(self) -> Dict:
+        tabla = self._sincronizar_precios()
         return {
             'cliente': self.nombre_cliente,
             'email': self.email,
             'fecha': self.fecha_creacion.isoformat(),
-            'items': [item.to_dict() for item in self.items],
-            'total': self.calcular_total_pedido(),
+            'confirmado': self.fecha_confirmacion.isoformat() if self.fecha_confirmacion else None,
+            'items': [item.to_dict(tabla) for item in self.items],
+            'total': self.total if self.items else 0.0,
             'estado': self.estado
         }
 
+    def exportar_estado(self) -> list:
+        """Estado completo del pedido como lista de valores simples (ver `restaurar_estado`)"""
+        return [
+            self.estado,
+            self.item_actual.a_tupla() if self.item_actual else None,
+            [item.a_tupla() for item in self.items],
+            [item.a_tupla() for item in self.items_pendientes],
+            self.nombre_cliente,
+            self.email,
+            self.fecha_creacion.isoformat(),
+            self.avance_embudo
+        ]
+
+    def restaurar_estado(self, datos: list):
+        estado, item_actual, items, pendientes, nombre_cliente, email, fecha, avance_embudo = datos
+        self.reiniciar_pedido()
+        # Sin pasar por el setter: esas etapas ya se contaron antes de guardar la sesión
+        self._estado = estado
+        self.avance_embudo = avance_embudo
+        self.item_actual = ItemPedido.desde_tupla(item_actual) if item_actual else None
+        self.items = [ItemPedido.desde_tupla(item) for item in items]
+        self.items_pendientes = [ItemPedido.desde_tupla(item) for item in pendientes]
+        self.nombre_cliente = nombre_cliente
+        self.email = email
+        self.fecha_creacion = datetime.fromisoformat(fecha)
+        # El catálogo pudo cambiar desde que se guardó: se recalcula y se retira lo que ya no exista
+        self._recalcular(obtener_catalogo())
+        self.version += 1
+
+# --- IMPORTACIÓN MASIVA ---
+class ResultadoImportacion(NamedTuple):
+    agregados: int
+    total: float
+    # Una fila por problema: fila del archivo (encabezado = 1), columna, valor y error
+    errores: "pd.DataFrame"
+
+# Campo de ItemPedido -> nombres de columna aceptados (normalizados, sin acentos)
+COLUMNAS_PLANILLA = {
+    "tipo_mueble": ("tipo_mueble", "tipo", "mueble", "tipos_mueble"),
+    "material": ("material", "materiales"),
+    "color": ("color", "colores"),
+    "dimensiones": ("dimensiones", "dimension", "tamano", "medida"),
+    "cantidad": ("cantidad", "unidades", "cant"),
+}
+COMPONENTES_PRECIO = ("precio_base", "extra_material", "extra_color", "factor")
+
+def leer_planilla(archivo, nombre: Optional[str] = None) -> "pd.DataFrame":
+    """Lee un CSV o Excel como texto, con las columnas renombradas a los campos de ItemPedido"""
+    import pandas as pd
+    nombre = nombre or getattr(archivo, "name", None) or str(archivo)
+    if os.path.splitext(nombre)[1].lower() in (".xlsx", ".xls"):
+        try:
+            planilla = pd.read_excel(archivo, dtype=str)
+        except ImportError as error:
+            raise ValueError(f"No se puede leer Excel sin el motor correspondiente (p. ej. openpyxl): {error}")
+    else:
+        planilla = pd.read_csv(archivo, dtype=str, keep_default_na=False, sep=None, engine="python")
+
+    renombres = {}
+    for columna in planilla.columns:
+        normalizada = _normalizar_valor(str(columna)).replace(" ", "_")
+        for campo, alias in COLUMNAS_PLANILLA.items():
+            if normalizada in alias:
+                renombres[columna] = campo
+    planilla = planilla.rename(columns=renombres)
+    faltantes = [campo for campo in COLUMNAS_PLANILLA if campo not in planilla.columns]
+    if faltantes:
+        raise ValueError(f"Faltan columnas en la planilla: {', '.join(faltantes)}")
+    return planilla[list(COLUMNAS_PLANILLA)]
+
+def _claves_catalogo(columna: "pd.Series", indice: Dict[str, str]) -> "pd.Series":
+    """Traduce una columna de texto a claves del catálogo (None si no existe).
+
+    Cada valor distinto se normaliza una sola vez y el resultado se expande
+    con los códigos de `factorize`.
+    """
+    import pandas as pd
+    codigos, unicos = pd.factorize(columna)
+    claves = np.array([indice.get(_normalizar_valor(str(valor))) for valor in unicos] + [None], dtype=object)
+    return pd.Series(claves[codigos], index=columna.index)
+
+def importar_planilla(archivo, pedido_manager: PedidoManager, nombre: Optional[str] = None) -> ResultadoImportacion:
+    """Valida, cotiza y agrega al pedido en una sola operación todas las filas válidas de una planilla.
+
+    Las filas con valores fuera del catálogo o cantidades inválidas no se
+    agregan; todos sus problemas se devuelven juntos en `errores`.
+    """
+    import pandas as pd
+    planilla = leer_planilla(archivo, nombre)
+    catalogo = obtener_catalogo()
+    errores = []
+
+    filas = pd.DataFrame(index=planilla.index)
+    for campo, eje in zip(ItemPedido.CAMPOS_CATALOGO, TablaPrecios.EJES):
+        filas[campo] = _claves_catalogo(planilla[campo], catalogo.valores_normalizados[eje])
+        invalidas = filas[campo].isna()
+        if invalidas.any():
+            errores.append(pd.DataFrame({
+                'fila': planilla.index[invalidas] + 2, 'columna': campo,
+                'valor': planilla.loc[invalidas, campo], 'error': "No existe en el catálogo"
+            }))
+
+    cantidades = pd.to_numeric(planilla["cantidad"], errors="coerce")
+    invalidas = cantidades.isna() | (cantidades < 1) | (cantidades % 1 != 0)
+    if invalidas.any():
+        errores.append(pd.DataFrame({
+            'fila': planilla.index[invalidas] + 2, 'columna': "cantidad",
+            'valor': planilla.loc[invalidas, "cantidad"], 'error': "Debe ser un entero mayor que 0"
+        }))
+    filas["cantidad"] = cantidades
+    filas = filas[filas.notna().all(axis=1) & ~invalidas]
+
+    # Precio de cada fila uniendo las tablas de componentes de precio de cada eje
+    tabla = catalogo.tabla
+    for campo, eje, componente in zip(ItemPedido.CAMPOS_CATALOGO, TablaPrecios.EJES, COMPONENTES_PRECIO):
+        filas = filas.merge(
+            pd.DataFrame({campo: tabla.ejes[eje], componente: tabla.componentes[eje]}),
+            on=campo, how="left", sort=False
+        )
+    precio_total = (filas["precio_base"] + filas["extra_material"] + filas["extra_color"]) * filas["factor"] * filas["cantidad"]
+    total = float(precio_total.sum())
+
+    items = [
+        ItemPedido(*valores)
+        for valores in zip(*(filas[campo].tolist() for campo in ItemPedido.CAMPOS_CATALOGO),
+                           filas["cantidad"].astype(int).tolist())
+    ]
+    pedido_manager.agregar_items(items, total)
+    # Con items cargados, la conversación sigue como tras agregar un mueble
+    if items and pedido_manager.estado in (EstadoPedido.INICIO, EstadoPedido.ESPERANDO_TIPO):
+        pedido_manager.estado = EstadoPedido.AGREGANDO_MAS
+
+    errores = (pd.concat(errores).sort_values("fila", kind="stable").reset_index(drop=True) if errores
+               else pd.DataFrame(columns=["fila", "columna", "valor", "error"]))
+    return ResultadoImportacion(len(items), total, errores)
+
 # --- DESIGNBOT LLM (CON LÓGICA COMPLETA) ---
 class DesignBotLLM:
-    def __init__(self):
+    def __init__(self, almacen: Optional[AlmacenPedidos] = None, despacho: Optional[DespachoConfirmaciones] = None):
         self.pedido_manager = PedidoManager()
+        self.almacen = almacen
+        self.despacho = despacho
+        self.ultima_respuesta = None
+        self.ultimo_pedido_confirmado = None
+        self.respaldo = obtener_parser_respaldo(Configuracion.MODELO_NLP)
+        self._etapa: Optional[str] = None
+        # Mensaje con la corrección de escritura aplicada, a la espera de que el cliente la confirme
+        self.correccion_pendiente: Optional[str] = None
+
+    @property
+    def clasificador(self):
+        # Se resuelve en el primer mensaje y no al crear el bot: el primer render no espera a sklearn
+        return obtener_clasificador(Configuracion.RUTA_MODELO_INTENCIONES)
+
+    def reiniciar(self):
+        """Empieza una conversación nueva conservando los recursos compartidos"""
+        self.pedido_manager.reiniciar_pedido()
         self.ultima_respuesta = None
+        self.ultimo_pedido_confirmado = None
+        self.correccion_pendiente = None
+
+    # Versión del formato de `serializar`; cambiarla invalida las sesiones guardadas
+    VERSION_SERIALIZACION = 4
+
+    def serializar(self) -> bytes:
+        """Instantánea compacta del estado de la conversación (JSON comprimido)"""
+        datos = [self.VERSION_SERIALIZACION, self.pedido_manager.exportar_estado(), self.ultima_respuesta,
+                 self.correccion_pendiente]
+        return zlib.compress(json.dumps(datos, ensure_ascii=False, separators=(',', ':')).encode("utf-8"), 1)
+
+    @classmethod
+    def deserializar(cls, datos: bytes, almacen: Optional[AlmacenPedidos] = None,
+                     despacho: Optional[DespachoConfirmaciones] = None) -> "DesignBotLLM":
+        version, estado_pedido, ultima_respuesta, *resto = json.loads(zlib.decompress(datos))
+        # La versión 3 solo difiere en que no guardaba la corrección pendiente
+        if version not in (3, cls.VERSION_SERIALIZACION):
+            raise ValueError(f"Versión de instantánea no soportada: {version}")
+        bot = cls(almacen, despacho)
+        bot.pedido_manager.restaurar_estado(estado_pedido)
+        bot.ultima_respuesta = ultima_respuesta
+        bot.correccion_pendiente = resto[0] if resto else None
+        return bot
 
     def extraer_cantidad(self, texto: str) -> int:
-        texto = texto.lower()
-        numeros = re.findall(r'\d+', texto)
-        if numeros:
-            return int(numeros[0])
-        
-        palabras_cantidad = {
-            "una": 1, "un": 1, "uno": 1, "dos": 2, "tres": 3,
-            "cuatro": 4, "cinco": 5, "seis": 6, "siete": 7,
-            "ocho": 8, "nueve": 9, "diez": 10
-        }
-        
-        for palabra, cantidad in palabras_cantidad.items():
-            if palabra in texto:
-                return cantidad
-        return 1
+        """Primera cantidad del texto, en dígitos o en palabras (ver extraer_cantidades); 1 si no hay"""
+        cantidades = extraer_cantidades(texto.lower())
+        return cantidades[0].valor if cantidades else 1
 
     def procesar_modificacion_pedido(self, input_clean: str) -> str:
         """Procesa solicitudes de modificación del pedido"""
@@ -211,26 +1111,197 @@ class DesignBotLLM:
                     return f"✅ **Item {index + 1} eliminado del pedido**\n\n{self.pedido_manager.obtener_resumen_detallado()}"
         
         if "modificar" in input_clean or "cambiar" in input_clean:
-            numeros = re.findall(r'\d+', input_clean)
-            if numeros:
-                index = int(numeros[0]) - 1
+            # "cambiar el item 2 a cinco": el primer número es el item y el siguiente la cantidad
+            cantidades = extraer_cantidades(input_clean)
+            if len(cantidades) >= 2:
+                index = cantidades[0].valor - 1
                 if 0 <= index < len(self.pedido_manager.items):
-                    nueva_cantidad = self.extraer_cantidad(input_clean)
-                    if nueva_cantidad > 0:
-                        if self.pedido_manager.modificar_cantidad_item(index, nueva_cantidad):
-                            return f"✅ **Cantidad modificada**\n\n{self.pedido_manager.obtener_resumen_detallado()}"
+                    if self.pedido_manager.modificar_cantidad_item(index, cantidades[1].valor):
+                        return f"✅ **Cantidad modificada**\n\n{self.pedido_manager.obtener_resumen_detallado()}"
         return None
 
+    # --- EXTRACCIÓN DE DATOS DEL MUEBLE ---
+    CAMPOS_POR_CATEGORIA = {"materiales": "material", "colores": "color", "dimensiones": "dimensiones"}
+    CAMPO_POR_ESTADO = {
+        EstadoPedido.ESPERANDO_MATERIAL: "material",
+        EstadoPedido.ESPERANDO_COLOR: "color",
+        EstadoPedido.ESPERANDO_DIMENSION: "dimensiones"
+    }
+    ESTADO_POR_CAMPO = {campo: estado for estado, campo in CAMPO_POR_ESTADO.items()}
+    # Con estas intenciones el mensaje ya tiene otra respuesta: no se buscan errores de escritura
+    INTENCIONES_SIN_CORRECCION = ("saludos", "presentacion", "resumen", "cancelar", "acciones", "terminar")
+    CATEGORIA_POR_ESTADO = {
+        EstadoPedido.INICIO: "tipos_mueble",
+        EstadoPedido.ESPERANDO_TIPO: "tipos_mueble",
+        EstadoPedido.AGREGANDO_MAS: "tipos_mueble",
+        EstadoPedido.ESPERANDO_MATERIAL: "materiales",
+        EstadoPedido.ESPERANDO_COLOR: "colores",
+        EstadoPedido.ESPERANDO_DIMENSION: "dimensiones"
+    }
+    CATEGORIA_POR_CAMPO = {campo: categoria for categoria, campo in CAMPOS_POR_CATEGORIA.items()}
+    PREGUNTAS_CAMPO = {
+        "material": "¿Qué material prefieres?",
+        "color": "¿Qué color prefieres?",
+        "dimensiones": "¿Qué dimensiones prefieres?"
+    }
+    # Separa los muebles de un mismo mensaje: "2 sillas de metal y una mesa de vidrio"
+    SEPARADOR_ITEMS = re.compile(r"[,;\n]|\b(?:y|además|también)\b")
+
+    def _preguntar_campo(self, campo: str) -> str:
+        return f"{self.PREGUNTAS_CAMPO[campo]}\n\n{obtener_catalogo().menus[self.CATEGORIA_POR_CAMPO[campo]]}"
+
+    def _llenar_campos(self, item: ItemPedido, analisis: Dict[str, List[Acierto]], campo_esperado: Optional[str] = None,
+                       desde: int = 0, hasta: Optional[int] = None) -> List[str]:
+        """Llena los campos vacíos del item con los valores del texto entre `desde` y `hasta`.
+
+        El campo que se está preguntando acepta cualquier coincidencia; los demás
+        solo coincidencias directas, para que "madera oscura" (color) no fije
+        también el material "madera". Devuelve una confirmación por cada campo llenado.
+        """
+        if hasta is None:
+            hasta = float("inf")
+        lineas = []
+        for categoria, campo in self.CAMPOS_POR_CATEGORIA.items():
+            if getattr(item, campo) and campo != campo_esperado:
+                continue
+            acierto = next((a for a in analisis.get(categoria, [])
+                            if desde <= a.inicio < hasta and (a.directo or campo == campo_esperado)), None)
+            if acierto is None:
+                continue
+            setattr(item, campo, _internar(acierto.valor))
+            if campo == "material":
+                lineas.append(f"✅ **Material {acierto.valor.replace('_', ' ').title()} seleccionado**")
+            elif campo == "color":
+                lineas.append(f"✅ **Color {acierto.frase.title()} seleccionado**")
+            else:
+                lineas.append(f"✅ **Tamaño {acierto.valor.title()} seleccionado**")
+        return lineas
+
+    def _agregar_items_mencionados(self, input_clean: str, analisis: Dict[str, List[Acierto]]) -> str:
+        """Crea un item por cada mueble mencionado, con los datos que lo acompañan"""
+        tipos = analisis["tipos_mueble"]
+        # Una sola pasada de la gramática de cantidades para todo el mensaje
+        cantidades = extraer_cantidades(input_clean)
+        # Cada mueble abarca desde el último separador anterior a su mención; sin separador,
+        # desde la cantidad que lo precede ("2 sillas 3 mesas")
+        cortes = [0]
+        for anterior, acierto in zip(tipos, tipos[1:]):
+            # El "y" de "treinta y dos" no separa muebles
+            separadores = [s for s in self.SEPARADOR_ITEMS.finditer(input_clean, anterior.inicio, acierto.inicio)
+                           if not any(c.inicio < s.start() < c.fin for c in cantidades)]
+            if separadores:
+                cortes.append(separadores[-1].end())
+            else:
+                previas = [c for c in cantidades if anterior.inicio + len(anterior.frase) <= c.inicio and c.fin <= acierto.inicio]
+                cortes.append(previas[-1].inicio if previas else acierto.inicio)
+        cortes.append(len(input_clean))
+
+        lineas = []
+        nuevos = []
+        for acierto, desde, hasta in zip(tipos, cortes, cortes[1:]):
+            encontrada = cantidad_para(cantidades, acierto.inicio, desde, hasta)
+            cantidad = encontrada.valor if encontrada else 1
+            item = ItemPedido(acierto.valor, cantidad=cantidad)
+            cantidad_texto = f" ({cantidad} unidad{'es' if cantidad > 1 else ''})" if cantidad > 1 else ""
+            lineas.append(f"✅ **{acierto.valor.title()}{cantidad_texto} seleccionado**")
+            lineas.extend(self._llenar_campos(item, analisis, desde=desde, hasta=hasta))
+            nuevos.append(item)
+
+        self.pedido_manager.items_pendientes[:0] = nuevos
+        self.pedido_manager.tomar_siguiente_pendiente()
+        return self._continuar_items(lineas)
+
+    def _continuar_items(self, partes: List[str]) -> str:
+        """Agrega al pedido los items completos y pregunta por el primer dato que falte"""
+        pedido_manager = self.pedido_manager
+        while pedido_manager.item_actual is not None:
+            item = pedido_manager.item_actual
+            faltante = item.primer_campo_faltante()
+            if faltante:
+                pedido_manager.estado = self.ESTADO_POR_CAMPO[faltante]
+                partes.append(self._preguntar_campo(faltante))
+                return "\n\n".join(partes)
+
+            if pedido_manager.agregar_item_actual_al_pedido():
+                partes.append(f"✅ **{item.obtener_descripcion()} agregado al pedido!** 🎉")
+            else:
+                partes.append(f"⚠️ **{item.obtener_descripcion()}** ya no está disponible en el catálogo y no se agregó")
+            siguiente = pedido_manager.tomar_siguiente_pendiente()
+            if siguiente and siguiente.primer_campo_faltante():
+                partes.append(f"Ahora completemos: **{siguiente.cantidad}x {siguiente.tipo_mueble.title()}**")
+
+        pedido_manager.estado = EstadoPedido.AGREGANDO_MAS
+        partes.append(pedido_manager.obtener_resumen_detallado())
+        partes.append("¿Te gustaría agregar otro mueble? (responde 'sí' para agregar más o 'no' para finalizar)")
+        return "\n\n".join(partes)
+
     def procesar_mensaje(self, user_input: str) -> str:
+        # El primer mensaje de cada pedido lo cuenta en la etapa de inicio del embudo
+        self.pedido_manager.avanzar_embudo(self.pedido_manager.estado)
+        if not METRICAS.activo:
+            respuesta = self._procesar_mensaje(user_input)
+        else:
+            estado_anterior = self.pedido_manager.estado
+            inicio = time.perf_counter()
+            respuesta = self._procesar_mensaje(user_input)
+            METRICAS.observar("designbot_turno_segundos", time.perf_counter() - inicio, etapa=self._etapa)
+            METRICAS.contar("designbot_transiciones_total", desde=estado_anterior, hasta=self.pedido_manager.estado)
+
+        if self.pedido_manager.etapas_nuevas:
+            if self.almacen:
+                self.almacen.registrar_embudo(self.pedido_manager.etapas_nuevas)
+            self.pedido_manager.etapas_nuevas = []
+        return respuesta
+
+    def _procesar_mensaje(self, user_input: str, usar_respaldo: bool = True) -> str:
         input_clean = user_input.lower().strip()
+        # Etapa que produjo la respuesta, para las métricas
+        self._etapa = "repetida"
         
         # Evitar procesar si es la misma respuesta
         if self.ultima_respuesta and user_input.strip() == "":
             return self.ultima_respuesta
 
+        # Una sola pasada detecta todas las intenciones y valores del catálogo
+        catalogo = obtener_catalogo()
+        marca = METRICAS.inicio()
+        analisis = catalogo.matcher.analizar(input_clean)
+        METRICAS.fin("analisis", marca)
+        # Con intenciones incompatibles ("no, quiero otro") decide el modelo, no el orden de los pasos
+        if self.clasificador:
+            marca = METRICAS.inicio()
+            analisis = self.clasificador.desambiguar(input_clean, analisis)
+            METRICAS.fin("desambiguacion", marca)
+        # Respuesta a "¿Quisiste decir ...?": "sí" procesa el mensaje corregido, "no" vuelve a
+        # preguntar y cualquier otra cosa se procesa como un mensaje nuevo
+        pendiente, self.correccion_pendiente = self.correccion_pendiente, None
+        if pendiente is not None and not any(c in analisis for c in catalogo.catalogo):
+            if "afirmaciones" in analisis:
+                return self._procesar_mensaje(pendiente, usar_respaldo=False)
+            if "negaciones" in analisis:
+                self._etapa = "correccion"
+                respuesta = self._respuesta_por_estado(catalogo)
+                self.ultima_respuesta = respuesta
+                return respuesta
+
+        # Si falta justo el dato que se espera en este paso, se buscan errores de escritura ("siila"),
+        # solo hacia esa categoría y sin adivinar: el cliente confirma la corrección
+        esperada = self.CATEGORIA_POR_ESTADO.get(self.pedido_manager.estado)
+        if esperada and esperada not in analisis and not any(i in analisis for i in self.INTENCIONES_SIN_CORRECCION):
+            marca = METRICAS.inicio()
+            correccion = catalogo.matcher.corregir(input_clean, analisis, esperada, Configuracion.UMBRAL_DIFUSO)
+            METRICAS.fin("correccion", marca)
+            if correccion:
+                self._etapa = "correccion"
+                self.correccion_pendiente = input_clean[:correccion.inicio] + correccion.frase + input_clean[correccion.fin:]
+                respuesta = f"🤔 ¿Quisiste decir **{correccion.frase.capitalize()}**? (sí/no)"
+                self.ultima_respuesta = respuesta
+                return respuesta
+
         # 1. SALUDOS
-        if any(saludo in input_clean for saludo in ["hola", "hi", "hello", "buenos días", "buenas"]):
-            if "me llamo" in input_clean or "soy" in input_clean or "nombre" in input_clean:
+        if "saludos" in analisis:
+            self._etapa = "saludos"
+            if "presentacion" in analisis:
                 if "me llamo" in input_clean:
                     nombre = input_clean.split("me llamo")[1].strip()
                 elif "soy" in input_clean:
@@ -247,104 +1318,43 @@ class DesignBotLLM:
             return respuesta
 
         # 2. INICIAR PEDIDO
-        if (any(frase in input_clean for frase in ["sí", "si", "por favor", "quiero", "diseñar", "mueble", "personalizar", "empezar", "comenzar"]) 
-            and self.pedido_manager.estado == EstadoPedido.INICIO):
-            
+        if ("inicio" in analisis and "tipos_mueble" not in analisis
+                and self.pedido_manager.estado == EstadoPedido.INICIO):
+            self._etapa = "inicio"
             self.pedido_manager.estado = EstadoPedido.ESPERANDO_TIPO
-            respuesta = "¡Excelente! 🛋️ ¿Qué tipo de mueble te gustaría diseñar?\n\n" + \
-                       "• Silla\n• Mesa\n• Sofá\n• Estantería\n• Escritorio"
+            respuesta = "¡Excelente! 🛋️ ¿Qué tipo de mueble te gustaría diseñar?\n\n" + catalogo.menus["tipos_mueble"]
             self.ultima_respuesta = respuesta
             return respuesta
 
-        # 3. DETECCIÓN DE TIPO DE MUEBLE
-        tipos = {
-            "silla": "SILLA", "sillas": "SILLA",
-            "mesa": "MESA", "mesas": "MESA", 
-            "sofá": "SOFÁ", "sofa": "SOFÁ", "sofas": "SOFÁ",
-            "estantería": "ESTANTERÍA", "estanteria": "ESTANTERÍA", "estanterías": "ESTANTERÍA",
-            "escritorio": "ESCRITORIO", "escritorios": "ESCRITORIO"
-        }
-
-        for tipo_key, tipo_val in tipos.items():
-            if tipo_key in input_clean:
-                if self.pedido_manager.estado in [EstadoPedido.INICIO, EstadoPedido.ESPERANDO_TIPO, EstadoPedido.AGREGANDO_MAS]:
-                    cantidad = self.extraer_cantidad(input_clean)
-                    self.pedido_manager.iniciar_nuevo_item(tipo_val, cantidad)
-                    self.pedido_manager.estado = EstadoPedido.ESPERANDO_MATERIAL
-                    cantidad_texto = f" ({cantidad} unidad{'es' if cantidad > 1 else ''})" if cantidad > 1 else ""
-                    respuesta = f"✅ **{tipo_val.title()}{cantidad_texto} seleccionado**\n\n" + \
-                               "¿Qué material prefieres?\n\n" + \
-                               "• Madera noble\n• Madera MDF\n• Metal\n• Vidrio\n• Bambú\n• Madera reciclada"
-                    self.ultima_respuesta = respuesta
-                    return respuesta
-
-        # 4. DETECCIÓN DE MATERIAL
-        materiales = {
-            "madera noble": "MADERA_NOBLE", "roble": "MADERA_NOBLE", "nogal": "MADERA_NOBLE", 
-            "madera": "MADERA_NOBLE", "noble": "MADERA_NOBLE",
-            "mdf": "MADERA_MDF", "madera mdf": "MADERA_MDF",
-            "metal": "METAL", "acero": "METAL", "metálico": "METAL",
-            "vidrio": "VIDRIO", "cristal": "VIDRIO",
-            "bambú": "BAMBÚ", "bambu": "BAMBÚ",
-            "madera reciclada": "MADERA_RECICLADA", "reciclada": "MADERA_RECICLADA"
-        }
-
-        for material_key, material_val in materiales.items():
-            if material_key in input_clean and self.pedido_manager.estado == EstadoPedido.ESPERANDO_MATERIAL:
-                self.pedido_manager.actualizar_item_actual('material', material_val)
-                self.pedido_manager.estado = EstadoPedido.ESPERANDO_COLOR
-                respuesta = f"✅ **Material {material_val.replace('_', ' ').title()} seleccionado**\n\n" + \
-                           "¿Qué color prefieres?\n\n" + \
-                           "• Natural\n• Blanco\n• Negro\n• Madera oscura\n• Gris"
-                self.ultima_respuesta = respuesta
-                return respuesta
-
-        # 5. DETECCIÓN DE COLOR
-        colores = {
-            "natural": "NATURAL", "color natural": "NATURAL", "sin color": "NATURAL",
-            "blanco": "BLANCO", "color blanco": "BLANCO",
-            "negro": "NEGRO", "color negro": "NEGRO",
-            "madera oscura": "MADERA_OSCURA", "oscuro": "MADERA_OSCURA", "caoba": "MADERA_OSCURA", "wengué": "MADERA_OSCURA",
-            "gris": "GRIS", "color gris": "GRIS"
-        }
+        # 3-6. DATOS DEL MUEBLE
+        # Un mensaje puede traer varios datos ("2 sillas pequeñas de madera noble")
+        # e incluso varios muebles: se llena todo lo detectado y solo se pregunta lo que falte
+        if "tipos_mueble" in analisis and self.pedido_manager.estado in [
+                EstadoPedido.INICIO, EstadoPedido.ESPERANDO_TIPO, EstadoPedido.AGREGANDO_MAS]:
+            self._etapa = "tipo"
+            respuesta = self._agregar_items_mencionados(input_clean, analisis)
+            self.ultima_respuesta = respuesta
+            return respuesta
 
-        for color_key, color_val in colores.items():
-            if color_key in input_clean and self.pedido_manager.estado == EstadoPedido.ESPERANDO_COLOR:
-                self.pedido_manager.actualizar_item_actual('color', color_val)
-                self.pedido_manager.estado = EstadoPedido.ESPERANDO_DIMENSION
-                respuesta = f"✅ **Color {color_key.title()} seleccionado**\n\n" + \
-                           "¿Qué dimensiones prefieres?\n\n" + \
-                           "• Pequeño\n• Estándar\n• Grande"
+        campo_esperado = self.CAMPO_POR_ESTADO.get(self.pedido_manager.estado)
+        if campo_esperado and self.pedido_manager.item_actual:
+            lineas = self._llenar_campos(self.pedido_manager.item_actual, analisis, campo_esperado)
+            if lineas:
+                self._etapa = campo_esperado
+                respuesta = self._continuar_items(lineas)
                 self.ultima_respuesta = respuesta
                 return respuesta
 
-        # 6. DETECCIÓN DE DIMENSIONES
-        dimensiones_map = {
-            "pequeño": "PEQUEÑO", "pequeña": "PEQUEÑO", "pequeno": "PEQUEÑO", "chico": "PEQUEÑO", "s": "PEQUEÑO",
-            "estándar": "ESTÁNDAR", "estandar": "ESTÁNDAR", "normal": "ESTÁNDAR", "mediano": "ESTÁNDAR", "m": "ESTÁNDAR",
-            "grande": "GRANDE", "grand": "GRANDE", "l": "GRANDE"
-        }
-
-        for dim_key, dim_val in dimensiones_map.items():
-            if dim_key in input_clean and self.pedido_manager.estado == EstadoPedido.ESPERANDO_DIMENSION:
-                self.pedido_manager.actualizar_item_actual('dimensiones', dim_val)
-                if self.pedido_manager.agregar_item_actual_al_pedido():
-                    self.pedido_manager.estado = EstadoPedido.AGREGANDO_MAS
-                    respuesta = f"✅ **{dim_val.title()} agregado al pedido!** 🎉\n\n" + \
-                               f"{self.pedido_manager.obtener_resumen_detallado()}\n\n" + \
-                               "¿Te gustaría agregar otro mueble? (responde 'sí' para agregar más o 'no' para finalizar)"
-                    self.ultima_respuesta = respuesta
-                    return respuesta
-
         # 7. MANEJO DE "¿QUIERES AGREGAR MÁS?"
         if self.pedido_manager.estado == EstadoPedido.AGREGANDO_MAS:
-            if any(palabra in input_clean for palabra in ["sí", "si", "s", "quiero", "agregar", "otro", "más", "mas", "otra"]):
+            if "agregar_mas" in analisis:
+                self._etapa = "agregar_mas"
                 self.pedido_manager.estado = EstadoPedido.ESPERANDO_TIPO
-                respuesta = "¡Perfecto! ¿Qué otro mueble te gustaría agregar?\n\n" + \
-                           "• Silla\n• Mesa\n• Sofá\n• Estantería\n• Escritorio"
+                respuesta = "¡Perfecto! ¿Qué otro mueble te gustaría agregar?\n\n" + catalogo.menus["tipos_mueble"]
                 self.ultima_respuesta = respuesta
                 return respuesta
-            elif any(palabra in input_clean for palabra in ["no", "n", "listo", "terminar", "finalizar", "eso es todo"]):
+            elif "terminar" in analisis:
+                self._etapa = "agregar_mas"
                 self.pedido_manager.estado = EstadoPedido.FINALIZANDO
                 respuesta = f"📦 **PEDIDO COMPLETO**\n\n{self.pedido_manager.obtener_resumen_detallado()}\n\n" + \
                            "¿Todo correcto? (responde 'sí' para confirmar o 'modificar' para hacer cambios)"
@@ -352,9 +1362,8 @@ class DesignBotLLM:
                 return respuesta
 
         # 8. CONFIRMACIÓN FINAL
-        if (any(palabra in input_clean for palabra in ["sí", "si", "confirmar", "correcto", "ok", "vale"]) 
-            and self.pedido_manager.estado == EstadoPedido.FINALIZANDO):
-            
+        if "afirmaciones" in analisis and self.pedido_manager.estado == EstadoPedido.FINALIZANDO:
+            self._etapa = "confirmacion"
             self.pedido_manager.estado = EstadoPedido.ESPERANDO_CONTACTO
             nombre_cliente = f", {self.pedido_manager.nombre_cliente}" if self.pedido_manager.nombre_cliente else ""
             respuesta = f"📧 **INFORMACIÓN DE CONTACTO**{nombre_cliente}:\n\n" + \
@@ -364,16 +1373,19 @@ class DesignBotLLM:
 
         # 9. FINALIZACIÓN
         if self.pedido_manager.estado == EstadoPedido.ESPERANDO_CONTACTO:
-            # Validar email básico
-            if "@" in user_input and "." in user_input:
+            self._etapa = "contacto"
+            # Se guarda solo la dirección normalizada, así `AlmacenPedidos.buscar(email=...)` la encuentra
+            email = extraer_email(user_input)
+            if email:
                 self.pedido_manager.estado = EstadoPedido.COMPLETADO
+                self.pedido_manager.email = email
                 total = self.pedido_manager.calcular_total_pedido()
                 nombre_cliente = f", {self.pedido_manager.nombre_cliente}" if self.pedido_manager.nombre_cliente else ""
                 respuesta = f"""🎉 **¡PEDIDO CONFIRMADO!** 🎉{nombre_cliente}
 
 {self.pedido_manager.obtener_resumen_detallado()}
 
-📧 **Email de contacto:** {user_input}
+📧 **Email de contacto:** {email}
 
 📅 **Proceso:**
 1. Confirmación por email en 24 horas
@@ -382,7 +1394,14 @@ class DesignBotLLM:
 4. Entrega programada
 
 ¡Gracias por tu pedido! 🛋️"""
-                # Reiniciar para nuevo pedido
+                # Conservar el pedido confirmado antes de reiniciar para uno nuevo
+                self.pedido_manager.fecha_confirmacion = datetime.now()
+                self.ultimo_pedido_confirmado = self.pedido_manager.exportar_pedido()
+                if self.almacen:
+                    self.almacen.guardar(self.ultimo_pedido_confirmado)
+                # Los correos salen en segundo plano: este turno nunca espera la entrega
+                if self.despacho:
+                    self.despacho.encolar(self.ultimo_pedido_confirmado)
                 self.pedido_manager.reiniciar_pedido()
                 self.ultima_respuesta = respuesta
                 return respuesta
@@ -392,14 +1411,16 @@ class DesignBotLLM:
                 return respuesta
 
         # 10. PROCESAR MODIFICACIONES AL PEDIDO
-        if self.pedido_manager.items and any(palabra in input_clean for palabra in ["modificar", "cambiar", "eliminar", "quitar", "quita", "borrar"]):
+        if self.pedido_manager.items and "acciones" in analisis:
             resultado_modificacion = self.procesar_modificacion_pedido(input_clean)
             if resultado_modificacion:
+                self._etapa = "modificaciones"
                 self.ultima_respuesta = resultado_modificacion
                 return resultado_modificacion
 
         # 11. CONSULTA DE RESUMEN
-        if any(palabra in input_clean for palabra in ["resumen", "pedido", "carrito", "qué tengo", "ver pedido"]):
+        if "resumen" in analisis:
+            self._etapa = "resumen"
             if self.pedido_manager.items:
                 respuesta = f"📋 **TU PEDIDO ACTUAL:**\n\n{self.pedido_manager.obtener_resumen_detallado()}\n\n" + \
                            "¿Quieres agregar algo más o finalizar?"
@@ -411,23 +1432,48 @@ class DesignBotLLM:
                 return respuesta
 
         # 12. CANCELAR
-        if any(palabra in input_clean for palabra in ["cancelar", "reiniciar", "empezar de nuevo"]):
+        if "cancelar" in analisis:
+            self._etapa = "cancelar"
             self.pedido_manager.reiniciar_pedido()
             respuesta = "🔄 **Pedido cancelado**. ¿Te gustaría comenzar un nuevo diseño?"
             self.ultima_respuesta = respuesta
             return respuesta
 
+        # 13. RESPALDO NLP
+        # Solo si las reglas no reconocieron nada: se reintenta una vez con los lemas
+        # ("de metales naturales" -> "de metal natural")
+        if usar_respaldo and not analisis:
+            marca = METRICAS.inicio()
+            resultado = self.respaldo.analizar(input_clean)
+            METRICAS.fin("respaldo_nlp", marca)
+            if resultado:
+                if not self.pedido_manager.nombre_cliente:
+                    personas = [texto for texto, etiqueta in resultado.entidades if etiqueta == "PER"]
+                    if personas:
+                        self.pedido_manager.nombre_cliente = personas[0].split()[0].title()
+                if resultado.lemas != input_clean and catalogo.matcher.analizar(resultado.lemas):
+                    METRICAS.contar("designbot_respaldo_total", resultado="reconocido")
+                    return self._procesar_mensaje(resultado.lemas, usar_respaldo=False)
+            METRICAS.contar("designbot_respaldo_total", resultado="sin_reconocer" if resultado else "no_disponible")
+
         # --- RESPUESTAS POR ESTADO ---
+        self._etapa = "sin_reconocer"
+        respuesta = self._respuesta_por_estado(catalogo)
+        self.ultima_respuesta = respuesta
+        return respuesta
+
+    def _respuesta_por_estado(self, catalogo: CatalogoCompilado) -> str:
+        """Vuelve a pedir el dato que corresponde al estado actual"""
         if self.pedido_manager.estado == EstadoPedido.INICIO:
             respuesta = "¡Hola! ¿Te gustaría diseñar un mueble personalizado? (responde 'sí' para comenzar)"
         elif self.pedido_manager.estado == EstadoPedido.ESPERANDO_TIPO:
-            respuesta = "Por favor, elige el tipo de mueble: Silla, Mesa, Sofá, Estantería o Escritorio"
+            respuesta = f"Por favor, elige el tipo de mueble: {catalogo.opciones['tipos_mueble']}"
         elif self.pedido_manager.estado == EstadoPedido.ESPERANDO_MATERIAL:
-            respuesta = "¿Qué material prefieres? (Madera noble, MDF, Metal, Vidrio, Bambú o Madera reciclada)"
+            respuesta = f"¿Qué material prefieres? ({catalogo.opciones['materiales']})"
         elif self.pedido_manager.estado == EstadoPedido.ESPERANDO_COLOR:
-            respuesta = "¿Qué color te gustaría? (Natural, Blanco, Negro, Madera oscura o Gris)"
+            respuesta = f"¿Qué color te gustaría? ({catalogo.opciones['colores']})"
         elif self.pedido_manager.estado == EstadoPedido.ESPERANDO_DIMENSION:
-            respuesta = "¿Qué dimensiones prefieres? (Pequeño, Estándar o Grande)"
+            respuesta = f"¿Qué dimensiones prefieres? ({catalogo.opciones['dimensiones']})"
         elif self.pedido_manager.estado == EstadoPedido.AGREGANDO_MAS:
             respuesta = f"{self.pedido_manager.obtener_resumen_detallado()}\n\n¿Quieres agregar otro mueble? (sí/no)"
         elif self.pedido_manager.estado == EstadoPedido.FINALIZANDO:
@@ -436,16 +1482,177 @@ class DesignBotLLM:
             respuesta = "Por favor, ingresa tu email para contactarte:"
         else:
             respuesta = "¿En qué más puedo ayudarte con tu pedido de muebles?"
-
-        self.ultima_respuesta = respuesta
         return respuesta
 
+# --- HISTORIAL DEL CHAT ---
+class ArchivoChat:
+    """Bloques archivados de los historiales de chat, en SQLite y fuera de `st.session_state`.
+
+    Cada hilo del servidor usa su propia conexión. Los bloques de sesiones
+    abandonadas que superan `ttl` segundos se borran al abrir el archivo y
+    luego, como mucho, cada `intervalo_purga` segundos al guardar: la instancia
+    vive lo que dura el proceso.
+    """
+
+    def __init__(self, ruta: str, ttl: float = 7 * 24 * 3600, intervalo_purga: float = 3600):
+        self.ruta = ruta
+        self.ttl = ttl
+        self.intervalo_purga = intervalo_purga
+        self._local = threading.local()
+        self._lock_purga = threading.Lock()
+        conexion = self._conexion()
+        conexion.execute("PRAGMA journal_mode=WAL")
+        with conexion:
+            conexion.execute("""CREATE TABLE IF NOT EXISTS bloques_chat (
+                sesion TEXT NOT NULL, numero INTEGER NOT NULL, creado REAL NOT NULL, datos BLOB NOT NULL,
+                PRIMARY KEY (sesion, numero))""")
+        self._purgar()
+
+    def _conexion(self) -> sqlite3.Connection:
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = self._local.conexion = sqlite3.connect(self.ruta, timeout=30)
+            conexion.execute("PRAGMA synchronous=NORMAL")
+        return conexion
+
+    def _purgar(self):
+        self._ultima_purga = time.time()
+        with self._conexion() as conexion:
+            conexion.execute("DELETE FROM bloques_chat WHERE creado < ?", (self._ultima_purga - self.ttl,))
+
+    def guardar(self, sesion: str, numero: int, bloque: List[Dict]):
+        datos = zlib.compress(json.dumps(bloque, ensure_ascii=False).encode("utf-8"))
+        with self._conexion() as conexion:
+            conexion.execute("INSERT OR REPLACE INTO bloques_chat VALUES (?, ?, ?, ?)", (sesion, numero, time.time(), datos))
+        # Sin bloquear: si otro hilo ya está purgando, este no espera
+        if time.time() - self._ultima_purga >= self.intervalo_purga and self._lock_purga.acquire(blocking=False):
+            try:
+                if time.time() - self._ultima_purga >= self.intervalo_purga:
+                    self._purgar()
+            finally:
+                self._lock_purga.release()
+
+    def leer(self, sesion: str, numero: int) -> List[Dict]:
+        fila = self._conexion().execute(
+            "SELECT datos FROM bloques_chat WHERE sesion = ? AND numero = ?", (sesion, numero)
+        ).fetchone()
+        return json.loads(zlib.decompress(fila[0])) if fila else []
+
+    def borrar(self, sesion: str):
+        with self._conexion() as conexion:
+            conexion.execute("DELETE FROM bloques_chat WHERE sesion = ?", (sesion,))
+
+@st.cache_resource
+def obtener_archivo_chat() -> ArchivoChat:
+    """Un único archivo de historiales por proceso"""
+    return ArchivoChat(Configuracion.RUTA_HISTORIAL_CHAT, Configuracion.TTL_HISTORIAL_CHAT,
+                       Configuracion.INTERVALO_PURGA_CHAT)
+
+class HistorialChat:
+    """Historial del chat con tamaño en memoria constante.
+
+    Los mensajes recientes se guardan tal cual en la sesión; los más antiguos
+    se archivan por bloques en `ArchivoChat` y solo se leen al paginar hacia atrás.
+    """
+    __slots__ = ('sesion', 'recientes', 'tamano_bloque', 'max_recientes', '_bloques', '_archivados')
+
+    def __init__(self, max_recientes: int = 60, tamano_bloque: int = 40):
+        self.sesion = uuid.uuid4().hex
+        self.recientes: List[Dict] = []
+        self.tamano_bloque = tamano_bloque
+        self.max_recientes = max_recientes
+        self._bloques = 0
+        self._archivados = 0
+
+    def __len__(self) -> int:
+        return self._archivados + len(self.recientes)
+
+    def agregar(self, mensaje: Dict):
+        self.recientes.append(mensaje)
+        if len(self.recientes) > self.max_recientes + self.tamano_bloque:
+            bloque = self.recientes[:self.tamano_bloque]
+            obtener_archivo_chat().guardar(self.sesion, self._bloques, bloque)
+            del self.recientes[:self.tamano_bloque]
+            self._bloques += 1
+            self._archivados += len(bloque)
+
+    def ultimos(self, cantidad: int) -> List[Dict]:
+        """Devuelve los últimos `cantidad` mensajes en orden cronológico"""
+        if cantidad <= len(self.recientes):
+            return self.recientes[len(self.recientes) - cantidad:]
+        mensajes = list(self.recientes)
+        for numero in range(self._bloques - 1, -1, -1):
+            if len(mensajes) >= cantidad:
+                break
+            mensajes[:0] = obtener_archivo_chat().leer(self.sesion, numero)
+        return mensajes[max(0, len(mensajes) - cantidad):]
+
+    def descartar(self):
+        """Borra los bloques archivados (al empezar una conversación nueva)"""
+        if self._bloques:
+            obtener_archivo_chat().borrar(self.sesion)
+
 # --- INTERFAZ STREAMLIT ---
+ETIQUETAS_ESTADO = {
+    EstadoPedido.INICIO: "⚪ Esperando inicio",
+    EstadoPedido.ESPERANDO_TIPO: "🟡 Eligiendo tipo",
+    EstadoPedido.ESPERANDO_MATERIAL: "🟡 Seleccionando material", 
+    EstadoPedido.ESPERANDO_COLOR: "🟡 Escogiendo color",
+    EstadoPedido.ESPERANDO_DIMENSION: "🟡 Definiendo dimensiones",
+    EstadoPedido.AGREGANDO_MAS: "🔵 Agregando más items",
+    EstadoPedido.FINALIZANDO: "🟢 Finalizando pedido",
+    EstadoPedido.ESPERANDO_CONTACTO: "📝 Esperando contacto",
+    EstadoPedido.COMPLETADO: "🎉 Pedido completado"
+}
+
+@st.cache_resource
+def obtener_almacen_pedidos() -> AlmacenPedidos:
+    """Un único almacén (y un único hilo escritor) por proceso"""
+    return AlmacenPedidos(Configuracion.RUTA_BD_PEDIDOS)
+
+def crear_despacho() -> DespachoConfirmaciones:
+    """Despacho de confirmaciones según la configuración; lo que no se pueda entregar queda en el spool"""
+    return DespachoConfirmaciones(
+        crear_destino(Configuracion.SMTP_CORREO, Configuracion.SPOOL_CORREO),
+        Configuracion.REMITENTE_CORREO, Configuracion.CORREO_TALLER,
+        destino_fallidos=DestinoSpool(os.path.join(Configuracion.SPOOL_CORREO, "fallidos"))
+    )
+
+@st.cache_resource
+def obtener_despacho() -> DespachoConfirmaciones:
+    """Un único despacho (y un único hilo de envío) por proceso"""
+    return crear_despacho()
+
+def precargar():
+    """Carga catálogo, modelo de intenciones y respaldo NLP (lo que necesitaría el primer mensaje)"""
+    inicio = time.perf_counter()
+    obtener_catalogo()
+    obtener_clasificador(Configuracion.RUTA_MODELO_INTENCIONES)
+    obtener_parser_respaldo(Configuracion.MODELO_NLP).precargar()
+    logger.info("Recursos precargados en %.2fs", time.perf_counter() - inicio)
+
+@st.cache_resource(show_spinner=False)
+def precargar_recursos() -> threading.Thread:
+    """Una vez por proceso, carga en segundo plano lo que el primer mensaje necesitaría.
+
+    El primer render no espera; cuando llega el primer mensaje, el modelo de
+    intenciones y el respaldo NLP normalmente ya están listos.
+    """
+    hilo = threading.Thread(target=precargar, name="precarga-designbot", daemon=True)
+    hilo.start()
+    return hilo
+
 def inicializar_session_state():
     if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = []
+        st.session_state.chat_history = HistorialChat()
+    if 'mensajes_visibles' not in st.session_state:
+        st.session_state.mensajes_visibles = Configuracion.VENTANA_CHAT
     if 'designbot' not in st.session_state:
-        st.session_state.designbot = DesignBotLLM()
+        st.session_state.designbot = DesignBotLLM(obtener_almacen_pedidos(), obtener_despacho())
+    if 'importaciones' not in st.session_state:
+        # Cambia la clave del selector de archivos para vaciarlo tras cada importación
+        st.session_state.importaciones = 0
+        st.session_state.ultima_importacion = None
 
 def crear_sidebar():
     with st.sidebar:
@@ -453,8 +1660,10 @@ def crear_sidebar():
         
         # Estadísticas rápidas
         pedido_manager = st.session_state.designbot.pedido_manager
+        # El total va primero: al recalcularse retira los items que ya no están en el catálogo
+        total = pedido_manager.calcular_total_pedido()
         st.metric("📦 Items en pedido", len(pedido_manager.items))
-        st.metric("💰 Total", f"${pedido_manager.calcular_total_pedido():.2f}")
+        st.metric("💰 Total", f"${total:.2f}")
         
         # Acciones rápidas
         st.markdown("---")
@@ -463,59 +1672,191 @@ def crear_sidebar():
         col1, col2 = st.columns(2)
         with col1:
             if st.button("🔄 Nuevo Pedido", use_container_width=True):
-                st.session_state.designbot = DesignBotLLM()
-                st.session_state.chat_history = []
+                st.session_state.designbot.reiniciar()
+                st.session_state.chat_history.descartar()
+                st.session_state.chat_history = HistorialChat()
+                st.session_state.mensajes_visibles = Configuracion.VENTANA_CHAT
+                st.session_state.ultima_importacion = None
                 st.rerun()
         
         with col2:
             if st.button("📋 Resumen", use_container_width=True) and pedido_manager.items:
                 st.info(pedido_manager.obtener_resumen_detallado())
 
-def mostrar_chat():
-    st.subheader("💬 DesignBot Assistant")
-    
-    # Contenedor de chat
-    chat_container = st.container(height=500)
+        if METRICAS.activo:
+            panel_metricas()
+
+def panel_metricas():
+    """Panel de administración con las métricas del proceso (solo si están activas)"""
+    import pandas as pd
+    with st.expander("📈 Métricas"):
+        turnos = METRICAS.resumen_latencias("designbot_turno_segundos")
+        total_turnos = sum(fila['cuenta'] for fila in turnos)
+        sin_reconocer = sum(fila['cuenta'] for fila in turnos if fila['etapa'] == "sin_reconocer")
+        respaldo = dict((e['resultado'], v) for e, v in METRICAS.contadores("designbot_respaldo_total"))
+        reruns = sum(v for _, v in METRICAS.contadores("designbot_reruns_total"))
+
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Turnos", total_turnos)
+        col2.metric("Sin reconocer", f"{sin_reconocer / total_turnos:.0%}" if total_turnos else "-")
+        col3.metric("Reruns", int(reruns))
+        if respaldo:
+            st.caption("Respaldo NLP: " + ", ".join(f"{k}: {int(v)}" for k, v in sorted(respaldo.items())))
+
+        if turnos:
+            st.markdown("**Latencia por etapa (ms)**")
+            st.dataframe(pd.DataFrame(turnos + METRICAS.resumen_latencias("designbot_etapa_segundos")),
+                         hide_index=True, use_container_width=True)
+        transiciones = METRICAS.contadores("designbot_transiciones_total")
+        if transiciones:
+            st.markdown("**Transiciones de estado**")
+            st.dataframe(pd.DataFrame([{**e, 'cuenta': int(v)} for e, v in transiciones]),
+                         hide_index=True, use_container_width=True)
+
+        st.download_button("⬇️ Exportar (Prometheus)", METRICAS.exportar_prometheus(),
+                           file_name="designbot_metricas.prom", mime="text/plain")
+
+def mostrar_chat(chat_container):
+    historial = st.session_state.chat_history
+    visibles = st.session_state.mensajes_visibles
     
     with chat_container:
-        for mensaje in st.session_state.chat_history:
+        # Solo se renderiza la ventana visible; los anteriores se cargan bajo demanda
+        if len(historial) > visibles:
+            if st.button(f"⬆️ Ver mensajes anteriores ({len(historial) - visibles})", key="cargar_anteriores"):
+                st.session_state.mensajes_visibles += Configuracion.PAGINA_CHAT
+                st.rerun()
+        
+        for mensaje in historial.ultimos(visibles):
             with st.chat_message(mensaje["role"]):
                 st.markdown(mensaje["content"])
                 if mensaje.get("timestamp"):
                     st.caption(mensaje["timestamp"])
 
 def panel_control_pedido():
+    import pandas as pd
     st.sidebar.markdown("---")
     st.sidebar.subheader("📊 Gestión de Pedido")
     
     pedido_manager = st.session_state.designbot.pedido_manager
+
+    with st.sidebar.expander("📥 Importar planilla"):
+        archivo = st.file_uploader(
+            "CSV o Excel con columnas tipo, material, color, dimensiones y cantidad",
+            type=["csv", "xlsx", "xls"], key=f"planilla_{st.session_state.importaciones}"
+        )
+        if archivo is not None and st.button("Importar", use_container_width=True):
+            try:
+                st.session_state.ultima_importacion = importar_planilla(archivo, pedido_manager)
+                st.session_state.importaciones += 1
+                st.rerun()
+            except ValueError as error:
+                st.error(str(error))
+
+        resultado = st.session_state.ultima_importacion
+        if resultado:
+            st.success(f"✅ {resultado.agregados} items importados (${resultado.total:,.2f})")
+            if len(resultado.errores):
+                st.warning(f"⚠️ {len(resultado.errores)} problemas; esas filas no se importaron")
+                st.dataframe(resultado.errores.head(500), hide_index=True, use_container_width=True)
+                st.download_button("⬇️ Descargar errores", resultado.errores.to_csv(index=False),
+                                   file_name="errores_importacion.csv", mime="text/csv")
     
     if pedido_manager.items:
-        # Editor de items en tiempo real
+        # Una sola tabla editable; los cambios se aplican juntos al enviar el formulario
         st.sidebar.markdown("**✏️ Editar Items:**")
-        for i, item in enumerate(pedido_manager.items):
-            with st.sidebar.expander(f"Item {i+1}: {item.tipo_mueble.title()}", expanded=False):
-                col1, col2 = st.columns(2)
-                with col1:
-                    nueva_cantidad = st.number_input(
-                        "Cantidad:", 
-                        min_value=1, 
-                        value=item.cantidad,
-                        key=f"cant_{i}"
-                    )
-                with col2:
-                    if st.button("🗑️", key=f"del_{i}"):
-                        pedido_manager.eliminar_item(i)
-                        st.rerun()
-                
-                if nueva_cantidad != item.cantidad:
-                    pedido_manager.modificar_cantidad_item(i, nueva_cantidad)
-                    st.rerun()
+        tabla = pd.DataFrame(pedido_manager.exportar_pedido()['items'])
+        tabla["eliminar"] = False
+        
+        with st.sidebar.form(f"editor_pedido_{pedido_manager.version}"):
+            editada = st.data_editor(
+                tabla,
+                column_order=["tipo_mueble", "material", "color", "dimensiones", "cantidad", "precio_total", "eliminar"],
+                column_config={
+                    "tipo_mueble": st.column_config.TextColumn("Mueble"),
+                    "material": st.column_config.TextColumn("Material"),
+                    "color": st.column_config.TextColumn("Color"),
+                    "dimensiones": st.column_config.TextColumn("Tamaño"),
+                    "cantidad": st.column_config.NumberColumn("Cantidad", min_value=1, step=1, required=True),
+                    "precio_total": st.column_config.NumberColumn("Total", format="$%.2f"),
+                    "eliminar": st.column_config.CheckboxColumn("🗑️")
+                },
+                disabled=["tipo_mueble", "material", "color", "dimensiones", "precio_total"],
+                hide_index=True,
+                num_rows="fixed",
+                use_container_width=True
+            )
+            aplicar = st.form_submit_button("💾 Aplicar cambios", use_container_width=True)
+        
+        if aplicar:
+            modificadas = editada["cantidad"] != tabla["cantidad"]
+            cantidades = {int(i): int(c) for i, c in editada.loc[modificadas, "cantidad"].items()}
+            eliminar = [int(i) for i in editada.index[editada["eliminar"]]]
+            if pedido_manager.aplicar_cambios(cantidades, eliminar):
+                st.rerun()
+
+# --- ANALÍTICA ---
+@st.cache_data(ttl=Configuracion.TTL_ANALITICA, show_spinner=False)
+def leer_agregados() -> "pd.DataFrame":
+    """Agregados de ventas y embudo; unas pocas filas aunque haya millones de pedidos"""
+    import pandas as pd
+    filas = obtener_almacen_pedidos().agregados()
+    return pd.DataFrame(filas, columns=["dimension", "clave", "cuenta", "unidades", "ingresos"])
+
+def _dimension(agregados: "pd.DataFrame", dimension: str) -> "pd.DataFrame":
+    tabla = agregados[agregados["dimension"] == dimension].drop(columns="dimension")
+    return tabla.assign(clave=tabla["clave"].str.replace("_", " ").str.title()).set_index("clave")
+
+def pagina_analitica():
+    """Ventas e indicadores del embudo para administración, leídos de los agregados del almacén"""
+    import pandas as pd
+    st.subheader("📊 Analítica de pedidos")
+    agregados = leer_agregados()
+    if agregados.empty:
+        st.info("Todavía no hay pedidos confirmados ni conversaciones registradas.")
+        return
+
+    por_dia = agregados[agregados["dimension"] == "dia"].set_index("clave").sort_index()
+    pedidos, ingresos = int(por_dia["cuenta"].sum()), float(por_dia["ingresos"].sum())
+    embudo = agregados[agregados["dimension"] == "embudo"].set_index("clave")["cuenta"]
+    embudo = embudo.reindex(ETAPAS_EMBUDO, fill_value=0)
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Pedidos", f"{pedidos:,}")
+    col2.metric("Ingresos", f"${ingresos:,.2f}")
+    col3.metric("Valor medio del pedido", f"${ingresos / pedidos:,.2f}" if pedidos else "-")
+    col4.metric("Conversión", f"{embudo.iloc[-1] / embudo.iloc[0]:.1%}" if embudo.iloc[0] else "-")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("**💰 Ingresos por tipo de mueble**")
+        st.bar_chart(_dimension(agregados, "tipo_mueble")["ingresos"].sort_values(ascending=False))
+    with col2:
+        st.markdown("**🪵 Materiales más pedidos (unidades)**")
+        st.bar_chart(_dimension(agregados, "material")["unidades"].sort_values(ascending=False))
+
+    if not por_dia.empty:
+        st.markdown("**📅 Ingresos por día**")
+        st.line_chart(por_dia["ingresos"])
+
+    if embudo.iloc[0]:
+        st.markdown("**🔻 Embudo de conversación**")
+        anterior = embudo.shift(1, fill_value=embudo.iloc[0]).replace(0, float("nan"))
+        st.dataframe(pd.DataFrame({
+            "etapa": [ETIQUETAS_ESTADO[e] for e in ETAPAS_EMBUDO],
+            "conversaciones": embudo.values,
+            "desde el inicio": (100 * embudo / embudo.iloc[0]).values,
+            "abandono": (100 * (1 - embudo / anterior)).fillna(0).values,
+        }), hide_index=True, use_container_width=True, column_config={
+            "desde el inicio": st.column_config.ProgressColumn(format="%.0f%%", min_value=0, max_value=100),
+            "abandono": st.column_config.NumberColumn(format="%.1f%%"),
+        })
+    st.caption(f"Datos agregados al confirmar cada pedido; se actualizan cada {Configuracion.TTL_ANALITICA} s.")
 
 def procesar_mensaje_usuario(user_input: str):
     """Procesa el mensaje del usuario y actualiza la interfaz"""
     # Agregar mensaje del usuario al historial
-    st.session_state.chat_history.append({
+    st.session_state.chat_history.agregar({
         "role": "user",
         "content": user_input,
         "timestamp": datetime.now().strftime("%H:%M:%S")
@@ -524,44 +1865,36 @@ def procesar_mensaje_usuario(user_input: str):
     # Procesar con DesignBot
     respuesta = st.session_state.designbot.procesar_mensaje(user_input)
     
+    # Un mensaje nuevo vuelve a la ventana reciente
+    st.session_state.mensajes_visibles = Configuracion.VENTANA_CHAT
+    
     # Agregar respuesta del bot
-    st.session_state.chat_history.append({
+    st.session_state.chat_history.agregar({
         "role": "assistant", 
         "content": respuesta,
         "timestamp": datetime.now().strftime("%H:%M:%S")
     })
-    
-    st.rerun()
 
-def main():
-    st.set_page_config(
-        page_title="DesignBot Pro - Muebles Personalizados",
-        page_icon="🛋️",
-        layout="wide",
-        initial_sidebar_state="expanded"
-    )
-    
-    # Inicialización
-    inicializar_session_state()
-    
-    # Header principal
-    st.title("🛋️ DesignBot Pro")
-    st.markdown("Sistema inteligente para pedidos de muebles personalizados")
-    st.markdown("---")
-    
+def pagina_chat():
     # Layout principal
     col1, col2 = st.columns([2, 1])
     
     with col1:
-        mostrar_chat()
+        st.subheader("💬 DesignBot Assistant")
+        
+        # Contenedor de chat; se llena después de procesar el mensaje
+        chat_container = st.container(height=500)
         
         # Input de usuario
         user_input = st.chat_input(
             "Escribe tu pedido aquí... (ej: '2 sillas pequeñas de madera noble')"
         )
         
+        # El mensaje se procesa antes de dibujar el chat y el panel: la respuesta
+        # sale en esta misma ejecución, sin un st.rerun() adicional
         if user_input:
             procesar_mensaje_usuario(user_input)
+        mostrar_chat(chat_container)
 
     with col2:
         crear_sidebar()
@@ -571,23 +1904,39 @@ def main():
         st.markdown("---")
         st.subheader("📊 Estado del Sistema")
         
-        estados = {
-            EstadoPedido.INICIO: "⚪ Esperando inicio",
-            EstadoPedido.ESPERANDO_TIPO: "🟡 Eligiendo tipo",
-            EstadoPedido.ESPERANDO_MATERIAL: "🟡 Seleccionando material", 
-            EstadoPedido.ESPERANDO_COLOR: "🟡 Escogiendo color",
-            EstadoPedido.ESPERANDO_DIMENSION: "🟡 Definiendo dimensiones",
-            EstadoPedido.AGREGANDO_MAS: "🔵 Agregando más items",
-            EstadoPedido.FINALIZANDO: "🟢 Finalizando pedido",
-            EstadoPedido.ESPERANDO_CONTACTO: "📝 Esperando contacto",
-            EstadoPedido.COMPLETADO: "🎉 Pedido completado"
-        }
-        
-        estado_actual = estados.get(
+        estado_actual = ETIQUETAS_ESTADO.get(
             st.session_state.designbot.pedido_manager.estado, 
             "⚪ Desconocido"
         )
         st.info(f"**Estado:** {estado_actual}")
 
+def main():
+    st.set_page_config(
+        page_title="DesignBot Pro - Muebles Personalizados",
+        page_icon="🛋️",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    METRICAS.contar("designbot_reruns_total")
+    if Configuracion.PRECARGA:
+        precargar_recursos()
+    
+    # Inicialización
+    inicializar_session_state()
+    
+    # Header principal
+    st.title("🛋️ DesignBot Pro")
+    st.markdown("Sistema inteligente para pedidos de muebles personalizados")
+    st.markdown("---")
+    
+    if Configuracion.ANALITICA_ACTIVA and \
+            st.sidebar.radio("Vista", ["💬 Chat", "📊 Analítica"], horizontal=True) == "📊 Analítica":
+        pagina_analitica()
+    else:
+        pagina_chat()
+
+    if Configuracion.RUTA_METRICAS:
+        METRICAS.volcar(Configuracion.RUTA_METRICAS, Configuracion.INTERVALO_METRICAS)
+
 if __name__ == "__main__":
     main()
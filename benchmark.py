@@ -0,0 +1,318 @@
+# benchmark.py
+"""Benchmarks reproducibles de los caminos críticos de la conversación.
+
+    python benchmark.py --guardar baseline.json          # medir y guardar baseline
+    python benchmark.py --comparar baseline.json         # falla si hay regresiones
+    python benchmark.py --arranque 5                     # además, 5 arranques en frío
+
+Antes de medir se verifican las correcciones de escritura (CASOS_CORRECCION y
+FLUJOS_CORRECCION); si alguna falla, la ejecución falla.
+
+La comparación usa la mediana de cada caso; una mediana más lenta que la
+del baseline por encima de --tolerancia (relativa) hace fallar la ejecución.
+
+Con --arranque, cada repetición lanza un intérprete nuevo con `-X importtime`
+y mide los imports, el primer render de la app y la latencia de las primeras
+respuestas, como en una réplica recién creada.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app import Configuracion, DesignBotLLM, EstadoPedido, ItemPedido, PedidoManager, obtener_catalogo
+
+# Mensajes que llevan al bot a cada estado, y el mensaje medido en ese estado
+PREFIJOS_ESTADO = {
+    EstadoPedido.INICIO: [],
+    EstadoPedido.ESPERANDO_TIPO: ["quiero diseñar un mueble"],
+    EstadoPedido.ESPERANDO_MATERIAL: ["2 sillas"],
+    EstadoPedido.ESPERANDO_COLOR: ["2 sillas", "madera noble"],
+    EstadoPedido.ESPERANDO_DIMENSION: ["2 sillas", "madera noble", "blanco"],
+    EstadoPedido.AGREGANDO_MAS: ["2 sillas", "madera noble", "blanco", "grande"],
+    EstadoPedido.FINALIZANDO: ["2 sillas", "madera noble", "blanco", "grande", "no"],
+    EstadoPedido.ESPERANDO_CONTACTO: ["2 sillas", "madera noble", "blanco", "grande", "no", "sí"],
+}
+
+MENSAJE_ESTADO = {
+    EstadoPedido.INICIO: "hola, me llamo ana y quiero diseñar un mueble",
+    EstadoPedido.ESPERANDO_TIPO: "quisiera una mesa para el comedor",
+    EstadoPedido.ESPERANDO_MATERIAL: "la prefiero de madera noble",
+    EstadoPedido.ESPERANDO_COLOR: "en color gris por favor",
+    EstadoPedido.ESPERANDO_DIMENSION: "tamaño estándar",
+    EstadoPedido.AGREGANDO_MAS: "no, eso es todo",
+    EstadoPedido.FINALIZANDO: "sí, confirmar",
+    EstadoPedido.ESPERANDO_CONTACTO: "ana@example.com",
+}
+
+FLUJO_COMPLETO = [
+    "hola, me llamo ana", "quiero diseñar un mueble", "2 sillas", "madera noble",
+    "blanco", "grande", "sí", "una mesa", "vidrio", "gris", "estándar",
+    "resumen", "no", "sí", "ana@example.com"
+]
+
+# Categoría que pide el bot, palabra escrita y valor al que debe corregirse (None: no se corrige)
+CASOS_CORRECCION = [
+    ("tipos_mueble", "siila", "SILLA"), ("tipos_mueble", "estnteria", "ESTANTERÍA"),
+    ("materiales", "bamboo", "BAMBÚ"), ("colores", "gri", "GRIS"), ("dimensiones", "grnde", "GRANDE"),
+    # Palabras corrientes y nombres cerca de valores de otras categorías
+    ("colores", "sofía", None), ("materiales", "sola", None), ("colores", "madre", None),
+    ("dimensiones", "silvia", None), ("materiales", "banco", None),
+]
+
+# Estado, mensajes y tipo del mueble en curso al terminar: una corrección solo se aplica si se confirma
+FLUJOS_CORRECCION = [
+    (EstadoPedido.ESPERANDO_TIPO, ["para sofía", "no"], None),
+    (EstadoPedido.ESPERANDO_TIPO, ["una siila", "sí"], "SILLA"),
+    (EstadoPedido.ESPERANDO_TIPO, ["una siila", "una mesa"], "MESA"),
+]
+
+# --- MEDICIÓN ---
+def medir(operacion: Callable[[], object], preparar: Optional[Callable[[], object]] = None,
+          repeticiones: int = 1000, calentamiento: int = 20) -> Dict[str, float]:
+    """Mide `operacion` de forma individual; `preparar` corre fuera del tiempo medido"""
+    muestras = []
+    for i in range(calentamiento + repeticiones):
+        if preparar:
+            preparar()
+        inicio = time.perf_counter_ns()
+        operacion()
+        duracion = time.perf_counter_ns() - inicio
+        if i >= calentamiento:
+            muestras.append(duracion / 1000)
+
+    muestras.sort()
+    percentil = lambda p: muestras[min(len(muestras) - 1, int(p * len(muestras)))]
+    media = statistics.fmean(muestras)
+    return {
+        'repeticiones': repeticiones,
+        'media_us': media,
+        'p50_us': percentil(0.50),
+        'p95_us': percentil(0.95),
+        'p99_us': percentil(0.99),
+        'ops_por_segundo': 1e6 / media if media else float('inf')
+    }
+
+def _bot_en_estado(estado: str) -> DesignBotLLM:
+    bot = DesignBotLLM()
+    for mensaje in PREFIJOS_ESTADO[estado]:
+        bot.procesar_mensaje(mensaje)
+    assert bot.pedido_manager.estado == estado, (estado, bot.pedido_manager.estado)
+    return bot
+
+def _pedido_con_items(cantidad_items: int) -> PedidoManager:
+    rnd = random.Random(cantidad_items)
+    catalogo = obtener_catalogo().catalogo
+    pedido = PedidoManager()
+    for _ in range(cantidad_items):
+        pedido.iniciar_nuevo_item(rnd.choice(list(catalogo["tipos_mueble"])), rnd.randint(1, 10))
+        pedido.actualizar_item_actual('material', rnd.choice(list(catalogo["materiales"])))
+        pedido.actualizar_item_actual('color', rnd.choice(list(catalogo["colores"])))
+        pedido.actualizar_item_actual('dimensiones', rnd.choice(list(catalogo["dimensiones"])))
+        pedido.agregar_item_actual_al_pedido()
+    return pedido
+
+# --- VERIFICACIÓN ---
+def verificar_correcciones() -> List[str]:
+    """Descripción de cada caso de corrección de escritura que no da lo esperado"""
+    fallos = []
+    matcher = obtener_catalogo().matcher
+    for categoria, palabra, esperado in CASOS_CORRECCION:
+        correccion = matcher.corregir(palabra, matcher.analizar(palabra), categoria, Configuracion.UMBRAL_DIFUSO)
+        obtenido = correccion.valor if correccion else None
+        if obtenido != esperado:
+            fallos.append(f"corregir[{categoria}, {palabra}]: {obtenido} (se esperaba {esperado})")
+    for estado, mensajes, esperado in FLUJOS_CORRECCION:
+        bot = _bot_en_estado(estado)
+        for mensaje in mensajes:
+            bot.procesar_mensaje(mensaje)
+        item = bot.pedido_manager.item_actual
+        obtenido = item.tipo_mueble if item else None
+        if obtenido != esperado or bot.pedido_manager.items:
+            fallos.append(f"{estado} {mensajes}: {obtenido} (se esperaba {esperado})")
+    return fallos
+
+# --- CASOS ---
+def ejecutar_casos(factor: float = 1.0) -> Dict[str, Dict[str, float]]:
+    repeticiones = lambda n: max(5, int(n * factor))
+    resultados = {}
+
+    for estado, mensaje in MENSAJE_ESTADO.items():
+        contexto = {}
+        preparar = lambda estado=estado: contexto.__setitem__('bot', _bot_en_estado(estado))
+        resultados[f"procesar_mensaje[{estado}]"] = medir(
+            lambda mensaje=mensaje: contexto['bot'].procesar_mensaje(mensaje),
+            preparar, repeticiones(500)
+        )
+
+    bot = DesignBotLLM()
+    for texto in ["quiero dos sillas", "3 mesas de vidrio", "una estantería grande", "dos mil quinientas sillas"]:
+        resultados[f"extraer_cantidad[{texto}]"] = medir(
+            lambda texto=texto: bot.extraer_cantidad(texto), repeticiones=repeticiones(5000)
+        )
+
+    item = ItemPedido("ESCRITORIO", "MADERA_RECICLADA", "MADERA_OSCURA", "GRANDE", 3)
+    resultados["calcular_precio_unitario"] = medir(item.calcular_precio_unitario, repeticiones=repeticiones(5000))
+
+    for cantidad_items, n in [(1, 2000), (100, 300), (10_000, 10)]:
+        pedido = _pedido_con_items(cantidad_items)
+        # Se invalida la caché para medir el renderizado completo
+        resultados[f"obtener_resumen_detallado[{cantidad_items}]"] = medir(
+            pedido.obtener_resumen_detallado,
+            lambda pedido=pedido: setattr(pedido, '_resumen_cache', None),
+            repeticiones(n), calentamiento=2
+        )
+
+    def flujo_completo():
+        bot = DesignBotLLM()
+        for mensaje in FLUJO_COMPLETO:
+            bot.procesar_mensaje(mensaje)
+    resultados["flujo_completo"] = medir(flujo_completo, repeticiones=repeticiones(300))
+
+    return resultados
+
+# --- ARRANQUE EN FRÍO ---
+# Corre en un proceso nuevo; imprime los tiempos (segundos) como JSON en stdout
+CODIGO_ARRANQUE = """
+import json, threading, time
+t = [time.perf_counter()]
+import streamlit
+t.append(time.perf_counter())
+import app
+t.append(time.perf_counter())
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("app.py", default_timeout=120)
+t.append(time.perf_counter())
+at.run()
+t.append(time.perf_counter())
+# Mientras el usuario lee el saludo, termina la precarga en segundo plano (si está activa)
+for hilo in threading.enumerate():
+    if hilo.name == "precarga-designbot":
+        hilo.join()
+t.append(time.perf_counter())
+at.chat_input[0].set_value("hola").run()
+t.append(time.perf_counter())
+at.chat_input[0].set_value(MENSAJE_SIN_RECONOCER).run()
+t.append(time.perf_counter())
+pasos = ["import streamlit", "import app", None, "primer render", "fin de la precarga", "primera respuesta",
+         "primer respaldo NLP"]
+print(json.dumps({p: t[i + 1] - t[i] for i, p in enumerate(pasos) if p}))
+"""
+# Ninguna regla lo reconoce: pasa por el clasificador y el respaldo NLP
+MENSAJE_SIN_RECONOCER = "algo bonito para la terraza"
+
+def _imports_lentos(importtime: str, cantidad: int = 8) -> List[Dict]:
+    """Imports de primer nivel con más tiempo acumulado, según la salida de -X importtime"""
+    modulos = []
+    for linea in importtime.splitlines():
+        # "import time:   propio |  acumulado | <sangría por nivel>módulo"
+        partes = linea.split("|")
+        if len(partes) != 3 or not partes[1].strip().isdigit():
+            continue
+        nombre = partes[2][1:]
+        if not nombre.startswith(" "):
+            modulos.append({'modulo': nombre, 'ms': int(partes[1]) / 1000})
+    return sorted(modulos, key=lambda m: -m['ms'])[:cantidad]
+
+def medir_arranque(repeticiones: int = 3) -> Tuple[Dict[str, Dict[str, float]], List[Dict]]:
+    """Mide `repeticiones` arranques en frío; devuelve los casos y los imports más lentos del último"""
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    entorno = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [directorio, os.environ.get("PYTHONPATH")])))
+    codigo = CODIGO_ARRANQUE.replace("MENSAJE_SIN_RECONOCER", repr(MENSAJE_SIN_RECONOCER))
+    muestras: Dict[str, List[float]] = {}
+    imports = []
+    for _ in range(repeticiones):
+        proceso = subprocess.run([sys.executable, "-X", "importtime", "-c", codigo], cwd=directorio, env=entorno,
+                                 capture_output=True, text=True, check=True)
+        for paso, segundos in json.loads(proceso.stdout.strip().splitlines()[-1]).items():
+            muestras.setdefault(f"arranque[{paso}]", []).append(segundos * 1e6)
+        imports = _imports_lentos(proceso.stderr)
+
+    resultados = {}
+    for caso, valores in muestras.items():
+        valores.sort()
+        media = statistics.fmean(valores)
+        resultados[caso] = {
+            'repeticiones': len(valores),
+            'media_us': media,
+            'p50_us': statistics.median(valores),
+            'p95_us': valores[-1],
+            'p99_us': valores[-1],
+            'ops_por_segundo': 1e6 / media if media else float('inf')
+        }
+    return resultados, imports
+
+# --- REPORTE Y COMPARACIÓN ---
+def imprimir_reporte(resultados: Dict[str, Dict[str, float]], salida=sys.stdout):
+    print(f"{'caso':<52}{'p50 µs':>10}{'p95 µs':>10}{'p99 µs':>10}{'ops/s':>12}", file=salida)
+    for caso, r in resultados.items():
+        print(f"{caso:<52}{r['p50_us']:>10.1f}{r['p95_us']:>10.1f}{r['p99_us']:>10.1f}{r['ops_por_segundo']:>12.0f}", file=salida)
+
+def comparar(resultados: Dict, baseline: Dict, tolerancia: float) -> List[str]:
+    """Devuelve los casos cuya mediana empeoró más de `tolerancia` frente al baseline"""
+    regresiones = []
+    for caso, base in baseline['resultados'].items():
+        actual = resultados.get(caso)
+        if actual is None:
+            continue
+        cambio = actual['p50_us'] / base['p50_us'] - 1 if base['p50_us'] else 0.0
+        if cambio > tolerancia:
+            regresiones.append(f"{caso}: p50 {base['p50_us']:.1f}µs → {actual['p50_us']:.1f}µs (+{cambio:.0%})")
+    return regresiones
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks de DesignBot")
+    parser.add_argument("--guardar", help="Guardar los resultados como baseline JSON")
+    parser.add_argument("--comparar", help="Baseline JSON contra el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="Empeoramiento relativo permitido de la mediana")
+    parser.add_argument("--factor", type=float, default=1.0, help="Escala el número de repeticiones")
+    parser.add_argument("--arranque", type=int, default=0, metavar="N", help="Medir también N arranques en frío")
+    args = parser.parse_args(argv)
+
+    fallos = verificar_correcciones()
+    if fallos:
+        print("❌ Correcciones de escritura incorrectas:", file=sys.stderr)
+        for fallo in fallos:
+            print(f"  {fallo}", file=sys.stderr)
+        return 1
+
+    resultados = ejecutar_casos(args.factor)
+    imports = []
+    if args.arranque:
+        arranque, imports = medir_arranque(args.arranque)
+        resultados.update(arranque)
+    imprimir_reporte(resultados)
+    if imports:
+        print("\nImports más lentos (ms acumulados, último arranque):")
+        for modulo in imports:
+            print(f"  {modulo['modulo']:<40}{modulo['ms']:>10.1f}")
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as f:
+            json.dump({
+                'python': platform.python_version(),
+                'plataforma': platform.platform(),
+                'fecha': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                'resultados': resultados
+            }, f, indent=2, ensure_ascii=False)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regresiones = comparar(resultados, baseline, args.tolerancia)
+        if regresiones:
+            print("\n❌ Regresiones detectadas:", file=sys.stderr)
+            for regresion in regresiones:
+                print(f"  {regresion}", file=sys.stderr)
+            return 1
+        print("\n✅ Sin regresiones frente al baseline", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
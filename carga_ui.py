@@ -0,0 +1,268 @@
+# carga_ui.py
+"""Prueba de carga de la interfaz de Streamlit con `streamlit.testing.v1.AppTest`.
+
+Simula muchos usuarios con guiones de conversación sobre `app.py` completo
+(`main`, `mostrar_chat`, `crear_sidebar`, `panel_control_pedido`) y mide el
+tiempo de cada ejecución del script, el tamaño del session_state de cada
+sesión y el crecimiento de memoria del proceso.
+
+    python carga_ui.py --usuarios 50 --items "1:0.5,3:0.3,10:0.15,40:0.05" --guardar base.json
+    python carga_ui.py --usuarios 50 --comparar base.json
+
+Las sesiones viven a la vez y sus turnos se intercalan en un solo hilo: todas
+comparten los recursos del proceso, como en el servidor, y la medición no
+depende del planificador de hilos. Los pedidos confirmados van a una base
+temporal salvo que se indique --bd.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import types
+from typing import Dict, List, Optional, Tuple
+
+from app import obtener_catalogo
+
+RUTA_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+# Tamaño del pedido (items) -> peso relativo
+DISTRIBUCION_ITEMS = "1:0.5,2:0.25,5:0.15,20:0.1"
+
+# Rangos de items en el carrito para separar el tiempo de los turnos
+RANGOS_ITEMS = ((0, 0), (1, 4), (5, 19), (20, None))
+
+# --- GUIONES ---
+def leer_distribucion(texto: str) -> Tuple[List[int], List[float]]:
+    """"1:0.5,5:0.3" -> ([1, 5], [0.5, 0.3])"""
+    tamanos, pesos = [], []
+    for parte in texto.split(","):
+        tamano, _, peso = parte.partition(":")
+        tamanos.append(int(tamano))
+        pesos.append(float(peso or 1))
+    if not tamanos or min(tamanos) < 1 or sum(pesos) <= 0:
+        raise ValueError(f"Distribución de items inválida: '{texto}'")
+    return tamanos, pesos
+
+def _frase(categoria: str, clave: str) -> str:
+    datos = obtener_catalogo().catalogo[categoria][clave]
+    return (datos.get("sinonimos") or [clave.lower().replace("_", " ")])[0]
+
+def generar_guion(cantidad_items: int, rnd: random.Random) -> List[str]:
+    """Mensajes de un usuario que arma un pedido de `cantidad_items` muebles y lo confirma.
+
+    Cada mueble se describe en un solo mensaje o paso a paso, al azar.
+    """
+    catalogo = obtener_catalogo().catalogo
+    elegir = lambda categoria: _frase(categoria, rnd.choice(list(catalogo[categoria])))
+    mensajes = [rnd.choice(["hola", "hola, me llamo ana", "buenas"]), "quiero diseñar un mueble"]
+    for i in range(cantidad_items):
+        if i:
+            mensajes.append(rnd.choice(["sí", "otro", "agregar más"]))
+        tipo = f"{rnd.randint(1, 5)} {elegir('tipos_mueble')}"
+        material, color, dimension = elegir("materiales"), elegir("colores"), elegir("dimensiones")
+        if rnd.random() < 0.5:
+            mensajes.append(f"{tipo} de {material} en {color} {dimension}")
+        else:
+            mensajes.extend([tipo, material, color, dimension])
+    mensajes.extend(["no", "sí", f"cliente{rnd.randint(1, 10**6)}@example.com"])
+    return mensajes
+
+# --- MEDICIÓN ---
+def memoria_rss() -> int:
+    """Memoria residente actual del proceso en bytes (pico si no hay /proc)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+_NO_RECORRER = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+def tamano_profundo(objeto, compartidos: frozenset = frozenset()) -> int:
+    """Bytes alcanzables desde `objeto`, sin contar clases, módulos ni los ids en `compartidos`"""
+    vistos = set(compartidos)
+    pendientes, total = [objeto], 0
+    while pendientes:
+        actual = pendientes.pop()
+        if id(actual) in vistos or isinstance(actual, _NO_RECORRER):
+            continue
+        vistos.add(id(actual))
+        total += sys.getsizeof(actual)
+        pendientes.extend(gc.get_referents(actual))
+    return total
+
+def tamano_sesion(app_test) -> Tuple[int, int]:
+    """(bytes del session_state, bytes de la instantánea comprimida del bot)"""
+    estado = app_test.session_state.filtered_state
+    bot = estado["designbot"]
+    # Recursos de proceso a los que apunta el bot: no son parte de la sesión
+    compartidos = frozenset(id(r) for r in (bot.respaldo, bot.clasificador, bot.almacen, bot.despacho) if r is not None)
+    return tamano_profundo(estado, compartidos), len(bot.serializar())
+
+def _rango(items: int) -> str:
+    for minimo, maximo in RANGOS_ITEMS:
+        if items >= minimo and (maximo is None or items <= maximo):
+            if maximo is None:
+                return f"{minimo}+"
+            return str(minimo) if minimo == maximo else f"{minimo}-{maximo}"
+    return "?"
+
+def _resumir(muestras_ms: List[float]) -> Dict[str, float]:
+    muestras_ms = sorted(muestras_ms)
+    percentil = lambda p: muestras_ms[min(len(muestras_ms) - 1, int(p * len(muestras_ms)))]
+    return {
+        'ejecuciones': len(muestras_ms),
+        'media_ms': statistics.fmean(muestras_ms),
+        'p50_ms': percentil(0.50),
+        'p95_ms': percentil(0.95),
+        'p99_ms': percentil(0.99),
+    }
+
+# --- CARGA ---
+def ejecutar_carga(usuarios: int, distribucion: str = DISTRIBUCION_ITEMS, semilla: int = 0,
+                   timeout: float = 30) -> Dict:
+    from streamlit.testing.v1 import AppTest
+
+    rnd = random.Random(semilla)
+    tamanos, pesos = leer_distribucion(distribucion)
+    guiones = [generar_guion(rnd.choices(tamanos, pesos)[0], rnd) for _ in range(usuarios)]
+
+    # Una sesión de calentamiento carga los recursos compartidos antes de medir la memoria
+    AppTest.from_file(RUTA_APP, default_timeout=timeout).run()
+    gc.collect()
+    rss_inicio = memoria_rss()
+
+    tiempos: Dict[str, List[float]] = {}
+    def ejecutar(caso: str, accion):
+        inicio = time.perf_counter()
+        resultado = accion()
+        tiempos.setdefault(caso, []).append((time.perf_counter() - inicio) * 1000)
+        if resultado.exception:
+            raise RuntimeError(f"{caso}: {resultado.exception[0].value}")
+        return resultado
+
+    sesiones = []
+    for _ in range(usuarios):
+        app_test = AppTest.from_file(RUTA_APP, default_timeout=timeout)
+        sesiones.append(ejecutar("render_inicial", app_test.run))
+    rss_sesiones = memoria_rss()
+
+    # Turnos intercalados: en cada ronda, cada usuario activo envía su siguiente mensaje
+    turno = 0
+    pedidos_confirmados = 0
+    while any(turno < len(guion) for guion in guiones):
+        for app_test, guion in zip(sesiones, guiones):
+            if turno >= len(guion):
+                continue
+            items = len(app_test.session_state["designbot"].pedido_manager.items)
+            ejecutar(f"turno[items {_rango(items)}]", app_test.chat_input[0].set_value(guion[turno]).run)
+        turno += 1
+
+    tamanos_sesion, instantaneas = [], []
+    for app_test in sesiones:
+        bot = app_test.session_state["designbot"]
+        pedidos_confirmados += bot.ultimo_pedido_confirmado is not None
+        estado, instantanea = tamano_sesion(app_test)
+        tamanos_sesion.append(estado)
+        instantaneas.append(instantanea)
+    gc.collect()
+    rss_fin = memoria_rss()
+
+    return {
+        'usuarios': usuarios,
+        'distribucion_items': distribucion,
+        'pedidos_confirmados': pedidos_confirmados,
+        'mensajes': sum(len(guion) for guion in guiones),
+        'reruns': {caso: _resumir(muestras) for caso, muestras in sorted(tiempos.items())},
+        'sesion': {
+            'estado_media_kb': statistics.fmean(tamanos_sesion) / 1024,
+            'estado_max_kb': max(tamanos_sesion) / 1024,
+            'instantanea_media_kb': statistics.fmean(instantaneas) / 1024,
+        },
+        'memoria': {
+            'rss_inicio_mb': rss_inicio / 2**20,
+            'rss_fin_mb': rss_fin / 2**20,
+            'apertura_por_sesion_kb': (rss_sesiones - rss_inicio) / usuarios / 1024,
+            'crecimiento_por_sesion_kb': (rss_fin - rss_inicio) / usuarios / 1024,
+        },
+    }
+
+# --- REPORTE Y COMPARACIÓN ---
+def imprimir_reporte(resultados: Dict, salida=sys.stdout):
+    print(f"{resultados['usuarios']} usuarios, {resultados['mensajes']} mensajes, "
+          f"{resultados['pedidos_confirmados']} pedidos confirmados (items: {resultados['distribucion_items']})\n", file=salida)
+    print(f"{'ejecución del script':<28}{'n':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}", file=salida)
+    for caso, r in resultados['reruns'].items():
+        print(f"{caso:<28}{r['ejecuciones']:>8}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}", file=salida)
+    print("", file=salida)
+    for seccion in ('sesion', 'memoria'):
+        for nombre, valor in resultados[seccion].items():
+            print(f"{seccion}.{nombre:<34}{valor:>12.1f}", file=salida)
+
+def comparar(resultados: Dict, baseline: Dict, tolerancia: float) -> List[str]:
+    """Casos cuya mediana, tamaño de sesión o crecimiento de memoria empeoró más de `tolerancia`"""
+    metricas = [(f"reruns.{caso}", r['p50_ms'], resultados['reruns'].get(caso, {}).get('p50_ms'), "ms")
+                for caso, r in baseline['resultados']['reruns'].items()]
+    for seccion, nombre in (('sesion', 'estado_media_kb'), ('memoria', 'crecimiento_por_sesion_kb')):
+        metricas.append((f"{seccion}.{nombre}", baseline['resultados'][seccion][nombre],
+                         resultados[seccion][nombre], "kb"))
+
+    regresiones = []
+    for nombre, base, actual, unidad in metricas:
+        if actual is None or base <= 0:
+            continue
+        cambio = actual / base - 1
+        if cambio > tolerancia:
+            regresiones.append(f"{nombre}: {base:.1f}{unidad} → {actual:.1f}{unidad} (+{cambio:.0%})")
+    return regresiones
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Prueba de carga de la interfaz de DesignBot")
+    parser.add_argument("--usuarios", type=int, default=20, help="Sesiones simuladas a la vez")
+    parser.add_argument("--items", default=DISTRIBUCION_ITEMS, help="Distribución de items por pedido, 'tamaño:peso,...'")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--bd", help="Base de pedidos a usar (por defecto, una temporal)")
+    parser.add_argument("--guardar", help="Guardar los resultados como baseline JSON")
+    parser.add_argument("--comparar", help="Baseline JSON contra el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="Empeoramiento relativo permitido")
+    args = parser.parse_args(argv)
+
+    # El script se vuelve a ejecutar en cada rerun y lee la configuración del entorno
+    temporal = tempfile.mkdtemp(prefix="carga_ui_")
+    os.environ["DESIGNBOT_BD_PEDIDOS"] = args.bd or os.path.join(temporal, "pedidos.db")
+    os.environ.setdefault("DESIGNBOT_SPOOL_CORREO", os.path.join(temporal, "correo_saliente"))
+    os.environ.setdefault("DESIGNBOT_HISTORIAL_CHAT", os.path.join(temporal, "historial_chat.db"))
+
+    resultados = ejecutar_carga(args.usuarios, args.items, args.semilla)
+    imprimir_reporte(resultados)
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as f:
+            json.dump({
+                'python': platform.python_version(),
+                'plataforma': platform.platform(),
+                'fecha': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                'resultados': resultados
+            }, f, indent=2, ensure_ascii=False)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regresiones = comparar(resultados, baseline, args.tolerancia)
+        if regresiones:
+            print("\n❌ Regresiones detectadas:", file=sys.stderr)
+            for regresion in regresiones:
+                print(f"  {regresion}", file=sys.stderr)
+            return 1
+        print("\n✅ Sin regresiones frente al baseline", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
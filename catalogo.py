@@ -0,0 +1,81 @@
+# catalogo.py
+"""Lectura y validación del catálogo de muebles desde un archivo JSON o CSV.
+
+JSON: {categoría: {CLAVE: {"nombre", "descripcion", "sinonimos": [...], <precio>}}}
+CSV: una fila por valor con las columnas categoria, clave, nombre, precio,
+descripcion y sinonimos (separados por "|").
+
+El campo de precio depende de la categoría (ver `CAMPO_PRECIO`).
+"""
+import csv
+import json
+import os
+from typing import Dict
+
+CAMPO_PRECIO = {
+    "tipos_mueble": "precio_base",
+    "materiales": "precio_extra",
+    "colores": "precio_extra",
+    "dimensiones": "factor",
+}
+COLUMNAS_CSV = ("categoria", "clave", "precio")
+
+def leer_catalogo(ruta: str) -> Dict[str, Dict[str, Dict]]:
+    """Lee y valida el catálogo; lanza ValueError si el contenido no es válido"""
+    if os.path.splitext(ruta)[1].lower() == ".csv":
+        catalogo = _leer_csv(ruta)
+    else:
+        with open(ruta, encoding="utf-8") as f:
+            catalogo = json.load(f)
+    _validar(catalogo, ruta)
+    return catalogo
+
+def _leer_csv(ruta: str) -> Dict[str, Dict[str, Dict]]:
+    catalogo: Dict[str, Dict[str, Dict]] = {categoria: {} for categoria in CAMPO_PRECIO}
+    with open(ruta, encoding="utf-8", newline="") as f:
+        lector = csv.DictReader(f)
+        faltantes = [c for c in COLUMNAS_CSV if c not in (lector.fieldnames or ())]
+        if faltantes:
+            raise ValueError(f"{ruta}: faltan las columnas {', '.join(faltantes)}")
+        for numero, fila in enumerate(lector, 2):
+            # En una fila corta, las columnas que faltan quedan en None
+            categoria = (fila.get("categoria") or "").strip()
+            if categoria not in CAMPO_PRECIO:
+                raise ValueError(f"{ruta}:{numero}: categoría desconocida '{categoria}'")
+            clave = (fila.get("clave") or "").strip()
+            if not clave:
+                raise ValueError(f"{ruta}:{numero}: falta la clave")
+            try:
+                precio = float(fila["precio"])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"{ruta}:{numero}: precio inválido")
+            catalogo[categoria][clave] = {
+                "nombre": (fila.get("nombre") or "").strip(),
+                CAMPO_PRECIO[categoria]: precio,
+                "descripcion": (fila.get("descripcion") or "").strip(),
+                "sinonimos": [s.strip().lower() for s in (fila.get("sinonimos") or "").split("|") if s.strip()],
+            }
+    return catalogo
+
+def _validar(catalogo: Dict, ruta: str):
+    if not isinstance(catalogo, dict):
+        raise ValueError(f"{ruta}: se esperaba un objeto por categoría")
+    # Un JSON válido con otra forma (una lista en vez de un objeto) también es un catálogo inválido
+    for categoria, campo in CAMPO_PRECIO.items():
+        valores = catalogo.get(categoria)
+        if not valores:
+            raise ValueError(f"{ruta}: falta la categoría '{categoria}' o está vacía")
+        if not isinstance(valores, dict):
+            raise ValueError(f"{ruta}: '{categoria}' debe ser un objeto {{CLAVE: datos}}")
+        for clave, datos in valores.items():
+            if not isinstance(datos, dict):
+                raise ValueError(f"{ruta}: '{categoria}.{clave}' debe ser un objeto")
+            precio = datos.get(campo)
+            if isinstance(precio, bool) or not isinstance(precio, (int, float)):
+                raise ValueError(f"{ruta}: '{categoria}.{clave}' necesita un '{campo}' numérico")
+            for texto in ("nombre", "descripcion"):
+                if not isinstance(datos.get(texto, ""), str):
+                    raise ValueError(f"{ruta}: '{categoria}.{clave}.{texto}' debe ser texto")
+            sinonimos = datos.get("sinonimos", [])
+            if not isinstance(sinonimos, list) or not all(isinstance(s, str) for s in sinonimos):
+                raise ValueError(f"{ruta}: '{categoria}.{clave}.sinonimos' debe ser una lista de textos")
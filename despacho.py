@@ -0,0 +1,279 @@
+# despacho.py
+"""Despacho en segundo plano de las confirmaciones de pedidos.
+
+Al confirmar un pedido el chat solo encola el payload de
+`PedidoManager.exportar_pedido()`. Un hilo arma el correo de confirmación
+para el cliente y la orden de trabajo para el taller, y los entrega en
+lotes a un destino intercambiable (un directorio spool o un servidor SMTP),
+con reintentos y espera exponencial si la entrega falla.
+
+Un destino es cualquier objeto con `entregar(mensajes)`; si falla a mitad de
+lote, debe lanzar `ErrorEntrega` indicando cuántos mensajes sí salieron y si
+el siguiente fue rechazado de forma permanente (un 5xx de SMTP): ese mensaje
+va directo a fallidos y el resto del lote sigue sin gastar reintentos, que
+quedan para los fallos transitorios (4xx, conexión).
+"""
+import hashlib
+import logging
+import os
+import queue
+import random
+import re
+import smtplib
+import threading
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+from typing import Dict, List, Optional
+
+from metricas import METRICAS
+
+logger = logging.getLogger(__name__)
+
+PATRON_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+
+def extraer_email(texto: Optional[str]) -> Optional[str]:
+    """Dirección normalizada (en minúsculas) dentro de un texto libre ("soy Ana, Ana@Correo.com")"""
+    encontrada = PATRON_EMAIL.search(texto or "")
+    return encontrada.group(0).lower() if encontrada else None
+
+class ErrorEntrega(Exception):
+    """Fallo al entregar un lote; los primeros `entregados` mensajes sí se entregaron.
+
+    Con `permanente`, el mensaje siguiente (`mensajes[entregados]`) fue rechazado
+    y reintentarlo no sirve; si no, el fallo es transitorio.
+    """
+
+    def __init__(self, mensaje: str, entregados: int = 0, permanente: bool = False):
+        super().__init__(mensaje)
+        self.entregados = entregados
+        self.permanente = permanente
+
+# --- DESTINOS ---
+class DestinoSpool:
+    """Guarda cada mensaje como un archivo .eml en `directorio` (para otro proceso de envío o pruebas)"""
+
+    def __init__(self, directorio: str):
+        self.directorio = directorio
+        os.makedirs(directorio, exist_ok=True)
+
+    def entregar(self, mensajes: List[EmailMessage]):
+        for entregados, mensaje in enumerate(mensajes):
+            nombre = mensaje["Message-ID"].strip("<>").replace("@", "_").replace("/", "_")
+            ruta = os.path.join(self.directorio, f"{nombre}.eml")
+            try:
+                # Escritura atómica: quien lea el spool nunca ve un archivo a medias
+                with open(f"{ruta}.tmp", "wb") as f:
+                    f.write(mensaje.as_bytes())
+                os.replace(f"{ruta}.tmp", ruta)
+            except OSError as error:
+                raise ErrorEntrega(str(error), entregados) from error
+
+class DestinoSMTP:
+    """Envía cada lote por una sola conexión SMTP (sirve también un servidor local como aiosmtpd)"""
+
+    def __init__(self, host: str, puerto: int = 25, usuario: Optional[str] = None, clave: Optional[str] = None,
+                 starttls: bool = False, timeout: float = 10):
+        self.host = host
+        self.puerto = puerto
+        self.usuario = usuario
+        self.clave = clave
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def entregar(self, mensajes: List[EmailMessage]):
+        entregados = 0
+        try:
+            with smtplib.SMTP(self.host, self.puerto, timeout=self.timeout) as smtp:
+                if self.starttls:
+                    smtp.starttls()
+                if self.usuario:
+                    smtp.login(self.usuario, self.clave or "")
+                for mensaje in mensajes:
+                    smtp.send_message(mensaje)
+                    entregados += 1
+        except (smtplib.SMTPException, OSError) as error:
+            raise ErrorEntrega(str(error), entregados, _rechazo_permanente(error)) from error
+
+def _rechazo_permanente(error: Exception) -> bool:
+    """True si el servidor rechazó el mensaje con un 5xx (destinatario inexistente, contenido, remitente)"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(codigo >= 500 for codigo, _ in error.recipients.values())
+    # Los 5xx de conexión o autenticación afectan a todo el lote, no a un mensaje
+    return isinstance(error, (smtplib.SMTPSenderRefused, smtplib.SMTPDataError)) and error.smtp_code >= 500
+
+def crear_destino(smtp: Optional[str], spool: str):
+    """DestinoSMTP si `smtp` es "host[:puerto]"; si no, DestinoSpool en `spool`"""
+    if not smtp:
+        return DestinoSpool(spool)
+    host, _, puerto = smtp.partition(":")
+    return DestinoSMTP(host, int(puerto or 25))
+
+# --- MENSAJES ---
+def referencia_pedido(pedido: Dict) -> str:
+    """Referencia estable del pedido: la misma para el cliente, el taller y los reintentos"""
+    huella = hashlib.sha1(f"{pedido.get('email')}|{pedido['fecha']}".encode("utf-8")).hexdigest()[:8].upper()
+    return f"DB-{pedido['fecha'][:10].replace('-', '')}-{huella}"
+
+def _texto(valor: str) -> str:
+    return str(valor).replace("_", " ").title()
+
+def _mensaje(remitente: str, destinatario: str, asunto: str, cuerpo: str, referencia: str) -> EmailMessage:
+    mensaje = EmailMessage()
+    mensaje["From"] = remitente
+    mensaje["To"] = destinatario
+    mensaje["Subject"] = asunto
+    mensaje["Date"] = formatdate(localtime=True)
+    mensaje["Message-ID"] = make_msgid(idstring=referencia, domain=remitente.rpartition("@")[2] or None)
+    mensaje["X-DesignBot-Pedido"] = referencia
+    mensaje.set_content(cuerpo)
+    return mensaje
+
+def renderizar(pedido: Dict, remitente: str, taller: Optional[str] = None) -> List[EmailMessage]:
+    """Confirmación para el cliente (si dejó email) y orden de trabajo para el taller"""
+    referencia = referencia_pedido(pedido)
+    mensajes = []
+    # Los pedidos guardados antes de normalizar el email pueden traer el mensaje completo
+    direccion = extraer_email(pedido.get('email'))
+    if direccion:
+        lineas = [
+            f"  {i}. {item['cantidad']} × {_texto(item['tipo_mueble'])} — {_texto(item['material'])}, "
+            f"{_texto(item['color'])}, {_texto(item['dimensiones'])}: "
+            f"${item['precio_unitario']:.2f} c/u → ${item['precio_total']:.2f}"
+            for i, item in enumerate(pedido['items'], 1)
+        ]
+        saludo = f"Hola {pedido['cliente']}," if pedido.get('cliente') else "Hola,"
+        cuerpo = "\n".join([
+            saludo, "", "¡Gracias por tu pedido en DesignBot! Estos son los detalles:", "",
+            *lineas, "", f"Total: ${pedido['total']:.2f}", f"Referencia: {referencia}", "",
+            "Próximos pasos: diseño técnico (2-3 días), fabricación (7-10 días) y entrega programada.",
+        ])
+        mensajes.append(_mensaje(remitente, direccion, f"Confirmación de tu pedido {referencia}", cuerpo, referencia))
+
+    if taller:
+        filas = [f"{'cant':>5}  {'tipo':<16}{'material':<20}{'color':<16}dimensiones"]
+        filas += [
+            f"{item['cantidad']:>5}  {item['tipo_mueble']:<16}{item['material']:<20}{item['color']:<16}{item['dimensiones']}"
+            for item in pedido['items']
+        ]
+        cuerpo = "\n".join([
+            f"Orden de trabajo {referencia}", f"Fecha del pedido: {pedido['fecha']}",
+            f"Cliente: {pedido.get('cliente') or '-'} <{pedido.get('email') or '-'}>", "",
+            *filas, "", f"Unidades: {sum(item['cantidad'] for item in pedido['items'])}",
+            f"Total del pedido: ${pedido['total']:.2f}",
+        ])
+        mensajes.append(_mensaje(remitente, taller, f"Orden de trabajo {referencia}", cuerpo, f"{referencia}-taller"))
+    return mensajes
+
+# --- DESPACHO ---
+class DespachoConfirmaciones:
+    """Cola acotada de pedidos confirmados y un hilo que los convierte en mensajes y los entrega.
+
+    Tras `max_intentos` fallidos, los mensajes pendientes van a `destino_fallidos`
+    (si hay) para reenviarlos a mano; el pedido en sí ya está en el almacén.
+    """
+
+    def __init__(self, destino, remitente: str, taller: Optional[str] = None, tamano_lote: int = 50,
+                 intervalo: float = 0.5, max_intentos: int = 5, espera_inicial: float = 1.0,
+                 espera_maxima: float = 60.0, max_pendientes: int = 10_000, destino_fallidos=None):
+        self.destino = destino
+        self.remitente = remitente
+        self.taller = taller
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.max_intentos = max_intentos
+        self.espera_inicial = espera_inicial
+        self.espera_maxima = espera_maxima
+        self.destino_fallidos = destino_fallidos
+        self._cola: "queue.Queue[Optional[Dict]]" = queue.Queue(max_pendientes)
+        self._cerrando = threading.Event()
+        self._hilo = threading.Thread(target=self._despachar_en_lotes, name="despacho-confirmaciones", daemon=True)
+        self._hilo.start()
+
+    def encolar(self, pedido: Dict) -> bool:
+        """Encola un pedido confirmado sin bloquear nunca; False si la cola está llena"""
+        try:
+            self._cola.put_nowait(pedido)
+            return True
+        except queue.Full:
+            logger.error("Cola de confirmaciones llena; no se despacha el pedido de %s", pedido.get('email'))
+            METRICAS.contar("designbot_despachos_total", resultado="descartado")
+            return False
+
+    def esperar(self):
+        """Bloquea hasta que todos los pedidos encolados se hayan entregado o descartado"""
+        self._cola.join()
+
+    def cerrar(self):
+        """Despacha lo pendiente y detiene el hilo; las esperas entre reintentos se interrumpen"""
+        if self._hilo.is_alive():
+            self._cerrando.set()
+            self._cola.put(None)
+            self._hilo.join()
+
+    def _despachar_en_lotes(self):
+        activo = True
+        while activo:
+            lote = [self._cola.get()]
+            try:
+                while len(lote) < self.tamano_lote:
+                    lote.append(self._cola.get(timeout=self.intervalo))
+            except queue.Empty:
+                pass
+
+            pedidos = [p for p in lote if p is not None]
+            activo = len(pedidos) == len(lote)
+            try:
+                mensajes = []
+                for pedido in pedidos:
+                    try:
+                        mensajes.extend(renderizar(pedido, self.remitente, self.taller))
+                    except (KeyError, TypeError, ValueError):
+                        logger.exception("Pedido confirmado con formato inválido; no se despacha")
+                if mensajes:
+                    self._entregar(mensajes)
+            finally:
+                for _ in lote:
+                    self._cola.task_done()
+
+    def _entregar(self, mensajes: List[EmailMessage]):
+        pendientes, espera, intento = mensajes, self.espera_inicial, 1
+        while pendientes:
+            try:
+                self.destino.entregar(pendientes)
+                METRICAS.contar("designbot_despachos_total", len(pendientes), resultado="entregado")
+                return
+            except Exception as error:
+                # Los ya entregados no se repiten en el siguiente intento
+                entregados = getattr(error, "entregados", 0)
+                METRICAS.contar("designbot_despachos_total", entregados, resultado="entregado")
+                if getattr(error, "permanente", False) and entregados < len(pendientes):
+                    # Solo ese mensaje va a fallidos; el resto sigue sin gastar un intento
+                    rechazado = pendientes[entregados]
+                    logger.error("El destino rechazó el mensaje para %s: %s", rechazado["To"], error)
+                    self._guardar_fallidos([rechazado])
+                    pendientes = pendientes[entregados + 1:]
+                    continue
+                pendientes = pendientes[entregados:]
+                if intento == self.max_intentos:
+                    break
+                # Espera exponencial con variación aleatoria, para no reintentar todos a la vez
+                pausa = espera * random.uniform(0.5, 1.0)
+                logger.warning("Fallo al entregar %d mensajes (%s); intento %d de %d en %.1fs",
+                               len(pendientes), error, intento + 1, self.max_intentos, pausa)
+                METRICAS.contar("designbot_despachos_total", len(pendientes), resultado="reintento")
+                if self._cerrando.wait(pausa):
+                    break
+                espera = min(espera * 2, self.espera_maxima)
+                intento += 1
+
+        if pendientes:
+            logger.error("No se pudieron entregar %d mensajes tras %d intentos", len(pendientes), intento)
+            self._guardar_fallidos(pendientes)
+
+    def _guardar_fallidos(self, mensajes: List[EmailMessage]):
+        METRICAS.contar("designbot_despachos_total", len(mensajes), resultado="fallido")
+        if self.destino_fallidos is not None:
+            try:
+                self.destino_fallidos.entregar(mensajes)
+            except Exception:
+                logger.exception("Tampoco se pudieron guardar en el destino de fallidos")
@@ -0,0 +1,122 @@
+# entrenar_intenciones.py
+"""Entrena fuera de línea el clasificador de intenciones de `intenciones.py`.
+
+Las frases de entrenamiento se generan a partir del catálogo vigente (claves y
+sinónimos) y de `Configuracion.PATRONES_ENTRADA`, combinadas con plantillas y relleno.
+
+    python entrenar_intenciones.py --salida modelo_intenciones --ejemplos 20000
+"""
+import argparse
+import random
+import sys
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app import Configuracion, obtener_catalogo
+from intenciones import VECTORIZADOR, ClasificadorIntenciones, crear_vectorizador
+
+NOMBRES = ["ana", "luis", "maría", "carlos", "sofía", "jorge", "lucía", "pedro", "elena", "diego"]
+RELLENO_INICIO = ["", "", "", "bueno ", "pues ", "oye ", "mmm ", "a ver, ", "entonces "]
+RELLENO_FIN = ["", "", "", " gracias", " porfa", "!", ".", " entonces"]
+
+# --- GENERACIÓN ---
+def _frases_mueble(rnd: random.Random) -> str:
+    compilado = obtener_catalogo()
+    catalogo, sinonimos = compilado.catalogo, compilado.sinonimos
+    tipo = rnd.choice(list(sinonimos["tipos_mueble"]) + [t.lower() for t in catalogo["tipos_mueble"]])
+    partes = [rnd.choice(["", "quiero ", "quisiera ", "necesito ", "me gustaría ", "dame "]) +
+              rnd.choice(["", "una ", "un ", "2 ", "3 ", "dos ", "cuatro ", "10 "]) + tipo]
+    for categoria, plantilla in (("materiales", "de {}"), ("colores", "en {}"), ("dimensiones", "{}")):
+        if rnd.random() < 0.5:
+            partes.append(plantilla.format(rnd.choice(list(sinonimos[categoria]))))
+    rnd.shuffle(partes[1:])
+    return " ".join(partes)
+
+def _frases_modificar(rnd: random.Random) -> str:
+    accion = rnd.choice(Configuracion.PATRONES_ENTRADA["acciones"])
+    tipo = rnd.choice(list(obtener_catalogo().sinonimos["tipos_mueble"]))
+    return rnd.choice([
+        f"{accion} {tipo}", f"{accion} la {tipo}", f"quiero {accion} el {tipo}",
+        f"{accion} la cantidad de {tipo} a {rnd.randint(1, 9)}", f"{accion} el item {rnd.randint(1, 5)}",
+        f"{accion} el pedido", f"{accion} algo del pedido"
+    ])
+
+def _plantillas(rnd: random.Random) -> List[Tuple[str, str]]:
+    patrones = Configuracion.PATRONES_ENTRADA
+    saludo = rnd.choice(patrones["saludos"])
+    return [
+        ("saludo", rnd.choice([saludo, f"{saludo} qué tal", f"{saludo}, cómo estás", f"{saludo} designbot"])),
+        ("presentacion", rnd.choice([
+            f"{saludo}, me llamo {rnd.choice(NOMBRES)}", f"{saludo} soy {rnd.choice(NOMBRES)}",
+            f"me llamo {rnd.choice(NOMBRES)}", f"mi nombre es {rnd.choice(NOMBRES)}", f"soy {rnd.choice(NOMBRES)}"
+        ])),
+        ("afirmacion", rnd.choice([
+            rnd.choice(patrones["afirmaciones"]), rnd.choice(patrones["agregar_mas"]),
+            f"{rnd.choice(['sí', 'si', 'ok', 'vale'])}, {rnd.choice(['quiero otro', 'agregar más', 'otro mueble', 'por favor', 'confirmar'])}",
+            f"quiero {rnd.choice(['diseñar', 'personalizar'])} un mueble", "quiero empezar", "sí, comenzar",
+            "agregar otro", "otra más", "sí, todo correcto", "correcto, confirmar"
+        ])),
+        ("negacion", rnd.choice([
+            rnd.choice(patrones["terminar"]), "no gracias", "no, eso es todo",
+            f"no {rnd.choice(['quiero', 'necesito', 'voy a'])} {rnd.choice(['agregar', 'otro', 'otra', 'más', 'agregar más', 'nada más'])}",
+            "no, ya está", "listo, terminar", "no, finalizar el pedido", "nada más", "no, así está bien"
+        ])),
+        ("cancelar", rnd.choice([
+            rnd.choice(patrones["cancelar"]), "quiero cancelar el pedido", "cancelar todo",
+            "no, mejor cancela", "empezar de nuevo por favor", "reiniciar el pedido", "olvídalo, cancelar"
+        ])),
+        ("modificar", _frases_modificar(rnd)),
+        ("resumen", rnd.choice([
+            rnd.choice(patrones["resumen"]), "qué tengo en el carrito", "muéstrame el pedido",
+            "ver el resumen", "cómo va mi pedido", "qué llevo hasta ahora", "ver pedido por favor"
+        ])),
+        ("mueble", _frases_mueble(rnd)),
+    ]
+
+def generar_ejemplos(cantidad: int, semilla: int = 0) -> Tuple[List[str], List[str]]:
+    """Frases sintéticas equilibradas por intención, reproducibles con `semilla`"""
+    rnd = random.Random(semilla)
+    textos, etiquetas = [], []
+    while len(textos) < cantidad:
+        for etiqueta, frase in _plantillas(rnd):
+            textos.append(rnd.choice(RELLENO_INICIO) + frase + rnd.choice(RELLENO_FIN))
+            etiquetas.append(etiqueta)
+    return textos[:cantidad], etiquetas[:cantidad]
+
+# --- ENTRENAMIENTO ---
+def entrenar(cantidad: int = 20_000, semilla: int = 0) -> Tuple[ClasificadorIntenciones, float]:
+    """Entrena el modelo lineal; devuelve el clasificador y la exactitud en validación"""
+    from sklearn.linear_model import SGDClassifier
+
+    textos, etiquetas = generar_ejemplos(cantidad, semilla)
+    corte = int(len(textos) * 0.9)
+    vectorizador = crear_vectorizador(**VECTORIZADOR)
+    X = vectorizador.transform(textos)
+    modelo = SGDClassifier(loss="log_loss", alpha=1e-5, max_iter=30, tol=1e-4, random_state=semilla)
+    modelo.fit(X[:corte], etiquetas[:corte])
+    exactitud = modelo.score(X[corte:], etiquetas[corte:])
+
+    clasificador = ClasificadorIntenciones(
+        modelo.classes_.tolist(), modelo.coef_.T.astype(np.float32), modelo.intercept_.astype(np.float32),
+        {**VECTORIZADOR, 'ngram_range': list(VECTORIZADOR['ngram_range'])}
+    )
+    return clasificador, exactitud
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Entrena el clasificador de intenciones de DesignBot")
+    parser.add_argument("--salida", default=Configuracion.RUTA_MODELO_INTENCIONES, help="Directorio del modelo")
+    parser.add_argument("--ejemplos", type=int, default=20_000, help="Frases sintéticas a generar")
+    parser.add_argument("--semilla", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    inicio = time.perf_counter()
+    clasificador, exactitud = entrenar(args.ejemplos, args.semilla)
+    clasificador.guardar(args.salida)
+    print(f"Modelo guardado en {args.salida} ({len(clasificador.clases)} intenciones, "
+          f"exactitud de validación {exactitud:.1%}, {time.perf_counter() - inicio:.1f}s)", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# intenciones.py
+"""Clasificador lineal de intenciones sobre n-gramas de caracteres con hashing.
+
+El modelo se entrena fuera de línea con `entrenar_intenciones.py` y se guarda
+como un directorio con los pesos en `.npy`; al cargarlo, los pesos se abren
+con memoria mapeada, así varios procesos comparten las mismas páginas y solo
+se leen las filas de los n-gramas que aparecen en cada texto.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Claves de `MatcherEntrada.analizar` que cada intención del modelo justifica
+CLAVES_POR_INTENCION: Dict[str, FrozenSet[str]] = {
+    "saludo": frozenset({"saludos"}),
+    "presentacion": frozenset({"saludos", "presentacion"}),
+    "afirmacion": frozenset({"afirmaciones", "inicio", "agregar_mas"}),
+    "negacion": frozenset({"negaciones", "terminar"}),
+    "cancelar": frozenset({"cancelar", "negaciones"}),
+    "modificar": frozenset({"acciones"}),
+    "resumen": frozenset({"resumen"}),
+    "mueble": frozenset({"inicio"}),
+}
+CLAVES_INTENCION = frozenset().union(*CLAVES_POR_INTENCION.values())
+
+# Parámetros del vectorizador; se guardan con el modelo para reconstruirlo igual
+VECTORIZADOR = {'analyzer': 'char_wb', 'ngram_range': (2, 4), 'n_features': 2 ** 16}
+
+def crear_vectorizador(analyzer: str, ngram_range, n_features: int):
+    from sklearn.feature_extraction.text import HashingVectorizer
+    return HashingVectorizer(analyzer=analyzer, ngram_range=tuple(ngram_range), n_features=n_features,
+                             alternate_sign=False, lowercase=True, dtype=np.float32)
+
+class ClasificadorIntenciones:
+    """`pesos` es (n_features, n_clases) para multiplicar directamente por la matriz dispersa"""
+
+    def __init__(self, clases: List[str], pesos: np.ndarray, sesgo: np.ndarray, vectorizador: Dict):
+        self.clases = np.array(clases)
+        self.pesos = pesos
+        self.sesgo = sesgo
+        self.vectorizador = vectorizador
+        self._hashing = crear_vectorizador(**vectorizador)
+
+    def guardar(self, directorio: str):
+        os.makedirs(directorio, exist_ok=True)
+        np.save(os.path.join(directorio, "pesos.npy"), np.ascontiguousarray(self.pesos, dtype=np.float32))
+        np.save(os.path.join(directorio, "sesgo.npy"), np.asarray(self.sesgo, dtype=np.float32))
+        with open(os.path.join(directorio, "modelo.json"), "w", encoding="utf-8") as f:
+            json.dump({'clases': self.clases.tolist(), 'vectorizador': self.vectorizador}, f, ensure_ascii=False)
+
+    @classmethod
+    def cargar(cls, directorio: str) -> "ClasificadorIntenciones":
+        with open(os.path.join(directorio, "modelo.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(
+            meta['clases'],
+            np.load(os.path.join(directorio, "pesos.npy"), mmap_mode="r"),
+            np.load(os.path.join(directorio, "sesgo.npy")),
+            meta['vectorizador']
+        )
+
+    def puntajes(self, textos: Iterable[str]) -> np.ndarray:
+        return self._hashing.transform(textos) @ self.pesos + self.sesgo
+
+    def predecir_lote(self, textos: Iterable[str]) -> List[str]:
+        """Intención más probable de cada texto, en una sola operación matricial"""
+        return self.clases[np.argmax(self.puntajes(textos), axis=1)].tolist()
+
+    def predecir(self, texto: str) -> str:
+        return self.predecir_lote([texto])[0]
+
+    def desambiguar(self, texto: str, analisis: Dict) -> Dict:
+        """Si el matcher detectó intenciones incompatibles, deja solo las del modelo.
+
+        Los valores del catálogo nunca se descartan; sin conflicto, `analisis`
+        se devuelve tal cual y el modelo no se evalúa.
+        """
+        detectadas = CLAVES_INTENCION.intersection(analisis)
+        if not detectadas or any(detectadas <= claves for claves in CLAVES_POR_INTENCION.values()):
+            return analisis
+        permitidas = CLAVES_POR_INTENCION.get(self.predecir(texto), frozenset())
+        if not detectadas & permitidas:
+            return analisis
+        return {clave: aciertos for clave, aciertos in analisis.items()
+                if clave not in detectadas or clave in permitidas}
+
+# --- INSTANCIA COMPARTIDA ---
+_CLASIFICADORES: Dict[str, Optional[ClasificadorIntenciones]] = {}
+_LOCK_CLASIFICADORES = threading.Lock()
+
+def obtener_clasificador(directorio: str) -> Optional[ClasificadorIntenciones]:
+    """Clasificador compartido por proceso; None si el modelo no está entrenado"""
+    with _LOCK_CLASIFICADORES:
+        if directorio not in _CLASIFICADORES:
+            try:
+                _CLASIFICADORES[directorio] = ClasificadorIntenciones.cargar(directorio) if directorio else None
+            except (OSError, ValueError, KeyError) as error:
+                logger.info("Clasificador de intenciones no disponible en '%s': %s", directorio, error)
+                _CLASIFICADORES[directorio] = None
+        return _CLASIFICADORES[directorio]
@@ -0,0 +1,145 @@
+# metricas.py
+"""Métricas del flujo de conversación en formato de texto de Prometheus.
+
+Contadores e histogramas en memoria, sin dependencias externas. Con
+`METRICAS.activo` en False todas las llamadas retornan de inmediato, así la
+instrumentación puede quedarse en el camino crítico.
+"""
+import bisect
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Límites superiores (segundos) de los buckets de latencia
+LIMITES_LATENCIA = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+DESCRIPCIONES = {
+    "designbot_turno_segundos": ("histogram", "Duración de procesar_mensaje según la etapa que respondió"),
+    "designbot_etapa_segundos": ("histogram", "Duración de las etapas internas de detección"),
+    "designbot_transiciones_total": ("counter", "Cambios de EstadoPedido entre un turno y el siguiente"),
+    "designbot_respaldo_total": ("counter", "Mensajes enviados al respaldo NLP, por resultado"),
+    "designbot_reruns_total": ("counter", "Ejecuciones del script de Streamlit"),
+    "designbot_despachos_total": ("counter", "Mensajes de confirmación despachados, por resultado"),
+}
+
+Etiquetas = Tuple[Tuple[str, str], ...]
+
+class Metricas:
+    def __init__(self, activo: bool = False, limites: Tuple[float, ...] = LIMITES_LATENCIA):
+        self.activo = activo
+        self.limites = limites
+        self._lock = threading.Lock()
+        self._contadores: Dict[Tuple[str, Etiquetas], float] = {}
+        # (nombre, etiquetas) -> [conteos por bucket (+Inf al final), suma, cuenta]
+        self._histogramas: Dict[Tuple[str, Etiquetas], list] = {}
+        self._ultimo_volcado = 0.0
+
+    # --- REGISTRO ---
+    def contar(self, nombre: str, valor: float = 1, **etiquetas: str):
+        if not self.activo:
+            return
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def observar(self, nombre: str, segundos: float, **etiquetas: str):
+        if not self.activo:
+            return
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        posicion = bisect.bisect_left(self.limites, segundos)
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = [[0] * (len(self.limites) + 1), 0.0, 0]
+            histograma[0][posicion] += 1
+            histograma[1] += segundos
+            histograma[2] += 1
+
+    def inicio(self) -> float:
+        """Marca de tiempo para `fin`; 0.0 si las métricas están desactivadas"""
+        return time.perf_counter() if self.activo else 0.0
+
+    def fin(self, etapa: str, inicio: float):
+        if self.activo:
+            self.observar("designbot_etapa_segundos", time.perf_counter() - inicio, etapa=etapa)
+
+    def reiniciar(self):
+        with self._lock:
+            self._contadores.clear()
+            self._histogramas.clear()
+
+    # --- EXPORTACIÓN ---
+    def exportar_prometheus(self) -> str:
+        with self._lock:
+            contadores = dict(self._contadores)
+            histogramas = {clave: [list(h[0]), h[1], h[2]] for clave, h in self._histogramas.items()}
+
+        lineas = []
+        for nombre, (tipo, descripcion) in DESCRIPCIONES.items():
+            lineas.append(f"# HELP {nombre} {descripcion}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            for (metrica, etiquetas), valor in sorted(contadores.items()):
+                if metrica == nombre:
+                    lineas.append(f"{nombre}{_formatear(etiquetas)} {valor:g}")
+            for (metrica, etiquetas), (conteos, suma, cuenta) in sorted(histogramas.items()):
+                if metrica != nombre:
+                    continue
+                acumulado = 0
+                for limite, conteo in zip(self.limites + (float("inf"),), conteos):
+                    acumulado += conteo
+                    le = "+Inf" if limite == float("inf") else f"{limite:g}"
+                    lineas.append(f"{nombre}_bucket{_formatear(etiquetas + (('le', le),))} {acumulado}")
+                lineas.append(f"{nombre}_sum{_formatear(etiquetas)} {suma:.9g}")
+                lineas.append(f"{nombre}_count{_formatear(etiquetas)} {cuenta}")
+        return "\n".join(lineas) + "\n"
+
+    def volcar(self, ruta: str, intervalo: float = 0.0):
+        """Escribe las métricas en `ruta` (p. ej. para el textfile collector de node_exporter).
+
+        Con `intervalo`, no vuelve a escribir hasta que pasen esos segundos.
+        """
+        if not self.activo or time.monotonic() - self._ultimo_volcado < intervalo:
+            return
+        self._ultimo_volcado = time.monotonic()
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            f.write(self.exportar_prometheus())
+        os.replace(temporal, ruta)
+
+    def resumen_latencias(self, nombre: str) -> List[Dict]:
+        """Filas {etiquetas, cuenta, media_ms, p50_ms, p95_ms} para el panel de administración.
+
+        Los percentiles se aproximan con el límite superior del bucket.
+        """
+        with self._lock:
+            histogramas = [(e, list(h[0]), h[1], h[2]) for (n, e), h in self._histogramas.items() if n == nombre]
+        filas = []
+        for etiquetas, conteos, suma, cuenta in sorted(histogramas):
+            fila = dict(etiquetas)
+            fila.update(cuenta=cuenta, media_ms=suma / cuenta * 1000,
+                        p50_ms=self._percentil(conteos, cuenta, 0.50), p95_ms=self._percentil(conteos, cuenta, 0.95))
+            filas.append(fila)
+        return filas
+
+    def contadores(self, nombre: str) -> List[Tuple[Dict[str, str], float]]:
+        with self._lock:
+            return [(dict(e), v) for (n, e), v in sorted(self._contadores.items()) if n == nombre]
+
+    def _percentil(self, conteos: List[int], cuenta: int, p: float) -> Optional[float]:
+        objetivo, acumulado = p * cuenta, 0
+        for limite, conteo in zip(self.limites, conteos):
+            acumulado += conteo
+            if acumulado >= objetivo:
+                return limite * 1000
+        return None
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _formatear(etiquetas: Etiquetas) -> str:
+    if not etiquetas:
+        return ""
+    return "{" + ",".join(f'{clave}="{_escapar(valor)}"' for clave, valor in etiquetas) + "}"
+
+METRICAS = Metricas()
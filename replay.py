@@ -0,0 +1,133 @@
+# replay.py
+"""Reproduce transcripciones de conversaciones contra DesignBotLLM sin Streamlit.
+
+Entrada: JSONL con una conversación por línea, como objeto
+{"id": ..., "mensajes": ["hola", ...]} o directamente como lista de mensajes.
+Salida: JSONL con las respuestas, latencias por turno y pedidos de cada conversación
+(y la intención de cada mensaje si hay un modelo de intenciones entrenado).
+
+    python replay.py conversaciones.jsonl -o resultados.jsonl --procesos 8
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+from multiprocessing import Pool
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from app import Configuracion, DesignBotLLM, obtener_catalogo
+from intenciones import obtener_clasificador
+from respaldo_nlp import obtener_parser_respaldo
+
+# --- REPRODUCCIÓN ---
+def reproducir_conversacion(mensajes: List[str], conversacion_id: Any = None) -> Dict:
+    """Procesa una conversación con un DesignBotLLM nuevo"""
+    bot = DesignBotLLM()
+    respuestas = []
+    latencias_ms = []
+    pedidos_confirmados = []
+
+    for mensaje in mensajes:
+        inicio = time.perf_counter()
+        respuestas.append(bot.procesar_mensaje(mensaje))
+        latencias_ms.append((time.perf_counter() - inicio) * 1000)
+        if bot.ultimo_pedido_confirmado is not None:
+            pedidos_confirmados.append(bot.ultimo_pedido_confirmado)
+            bot.ultimo_pedido_confirmado = None
+
+    return {
+        'id': conversacion_id,
+        'respuestas': respuestas,
+        'latencias_ms': latencias_ms,
+        'pedidos_confirmados': pedidos_confirmados,
+        'pedido_final': bot.pedido_manager.exportar_pedido()
+    }
+
+def _leer_conversaciones(entrada: TextIO) -> Iterator[Dict]:
+    for numero, linea in enumerate(entrada, 1):
+        linea = linea.strip()
+        if not linea:
+            continue
+        datos = json.loads(linea)
+        if isinstance(datos, list):
+            datos = {'id': numero, 'mensajes': datos}
+        datos.setdefault('id', numero)
+        yield datos
+
+def _precalentar_respaldo(lote: List[Dict]):
+    # Los mensajes que las reglas no reconocen pasan juntos por el pipeline NLP;
+    # luego cada turno los encuentra en la caché del respaldo
+    parser = obtener_parser_respaldo(Configuracion.MODELO_NLP)
+    if parser.disponible:
+        matcher = obtener_catalogo().matcher
+        sin_reconocer = [m for c in lote for m in c['mensajes'] if not matcher.analizar(m.lower().strip())]
+        if sin_reconocer:
+            parser.analizar_lote(sin_reconocer)
+
+def _procesar_lote(lote: List[Dict]) -> List[str]:
+    _precalentar_respaldo(lote)
+    resultados = [reproducir_conversacion(c['mensajes'], c['id']) for c in lote]
+
+    # Intención de cada mensaje del lote, predicha en una sola operación
+    clasificador = obtener_clasificador(Configuracion.RUTA_MODELO_INTENCIONES)
+    if clasificador:
+        intenciones = iter(clasificador.predecir_lote([m for c in lote for m in c['mensajes']]))
+        for conversacion, resultado in zip(lote, resultados):
+            resultado['intenciones'] = list(itertools.islice(intenciones, len(conversacion['mensajes'])))
+
+    # Cada proceso devuelve el lote ya serializado para reducir el coste de transferencia
+    return [json.dumps(resultado, ensure_ascii=False) for resultado in resultados]
+
+def _en_lotes(conversaciones: Iterable[Dict], tamano: int) -> Iterator[List[Dict]]:
+    iterador = iter(conversaciones)
+    while lote := list(itertools.islice(iterador, tamano)):
+        yield lote
+
+def reproducir_archivo(entrada: TextIO, salida: TextIO, procesos: Optional[int] = None,
+                       tamano_lote: int = 200) -> int:
+    """Reproduce todas las conversaciones de `entrada` y escribe los resultados en `salida`.
+
+    Las conversaciones se reparten por lotes en un pool de procesos; la salida
+    conserva el orden de entrada. Devuelve el número de conversaciones procesadas.
+    """
+    lotes = _en_lotes(_leer_conversaciones(entrada), tamano_lote)
+    total = 0
+
+    # Con un solo proceso se evita el coste de arrancar el pool
+    pool = Pool(procesos) if procesos != 1 else None
+    try:
+        resultados = pool.imap(_procesar_lote, lotes) if pool else map(_procesar_lote, lotes)
+        for lineas in resultados:
+            salida.write("\n".join(lineas) + "\n")
+            total += len(lineas)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return total
+
+# --- CLI ---
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Reproduce transcripciones JSONL contra DesignBot")
+    parser.add_argument("entrada", help="Archivo JSONL de conversaciones ('-' para stdin)")
+    parser.add_argument("-o", "--salida", default="-", help="Archivo JSONL de resultados ('-' para stdout)")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos del pool (por defecto, uno por CPU)")
+    parser.add_argument("--tamano-lote", type=int, default=200, help="Conversaciones por lote enviado a cada proceso")
+    args = parser.parse_args(argv)
+
+    entrada = sys.stdin if args.entrada == "-" else open(args.entrada, encoding="utf-8")
+    salida = sys.stdout if args.salida == "-" else open(args.salida, "w", encoding="utf-8")
+    try:
+        inicio = time.perf_counter()
+        total = reproducir_archivo(entrada, salida, args.procesos, args.tamano_lote)
+        duracion = time.perf_counter() - inicio
+        print(f"{total} conversaciones en {duracion:.2f}s", file=sys.stderr)
+    finally:
+        if entrada is not sys.stdin:
+            entrada.close()
+        if salida is not sys.stdout:
+            salida.close()
+
+if __name__ == "__main__":
+    main()
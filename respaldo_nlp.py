@@ -0,0 +1,120 @@
+# respaldo_nlp.py
+"""Análisis de respaldo con spaCy para los mensajes que las reglas no reconocen.
+
+El pipeline se carga de forma perezosa la primera vez que hace falta y se
+comparte en todo el proceso; solo se activan los componentes necesarios para
+lemas y entidades. Los resultados se guardan en una caché LRU acotada por
+texto normalizado, y `analizar_lote` permite procesar varios textos con una
+sola pasada de `nlp.pipe`.
+
+Un mismo parser se comparte entre hilos: la caché tiene su propio lock y las
+llamadas al pipeline se serializan, porque spaCy no garantiza que un `nlp`
+se pueda usar desde varios hilos a la vez.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Componentes que no aportan a lemas ni entidades
+COMPONENTES_EXCLUIDOS = ["parser", "senter"]
+
+class ResultadoNLP(NamedTuple):
+    lemas: str
+    entidades: Tuple[Tuple[str, str], ...]  # (texto, etiqueta)
+
+def normalizar(texto: str) -> str:
+    return " ".join(texto.lower().split())
+
+class ParserRespaldo:
+    """Pipeline de spaCy cargado bajo demanda con caché de resultados.
+
+    Si el modelo no está instalado, el respaldo queda desactivado y
+    `analizar` devuelve None sin volver a intentar la carga.
+    """
+
+    def __init__(self, modelo: str, max_cache: int = 10_000, tamano_lote: int = 64):
+        self.modelo = modelo
+        self.max_cache = max_cache
+        self.tamano_lote = tamano_lote
+        self._nlp = None
+        self._disponible = bool(modelo)
+        # _lock protege la carga y el uso del pipeline; _lock_cache, la caché LRU
+        self._lock = threading.Lock()
+        self._lock_cache = threading.Lock()
+        self._cache: "OrderedDict[str, ResultadoNLP]" = OrderedDict()
+
+    @property
+    def disponible(self) -> bool:
+        return self._disponible
+
+    def precargar(self):
+        """Carga el pipeline ya (p. ej. en un hilo al arrancar) en lugar de en el primer uso"""
+        if self._disponible:
+            self._cargar()
+
+    def _cargar(self):
+        with self._lock:
+            if self._nlp is None and self._disponible:
+                try:
+                    import spacy
+                    self._nlp = spacy.load(self.modelo, exclude=COMPONENTES_EXCLUIDOS)
+                except (ImportError, OSError) as error:
+                    logger.warning("Respaldo NLP desactivado, no se pudo cargar '%s': %s", self.modelo, error)
+                    self._disponible = False
+        return self._nlp
+
+    def analizar(self, texto: str) -> Optional[ResultadoNLP]:
+        return self.analizar_lote([texto])[0]
+
+    def analizar_lote(self, textos: Iterable[str]) -> List[Optional[ResultadoNLP]]:
+        """Analiza varios textos; los que no están en caché pasan juntos por `nlp.pipe`"""
+        claves = [normalizar(t) for t in textos]
+        if not self._disponible:
+            return [None] * len(claves)
+
+        resultados = {}
+        with self._lock_cache:
+            for clave in claves:
+                resultado = self._cache.get(clave)
+                if resultado is not None:
+                    self._cache.move_to_end(clave)
+                    resultados[clave] = resultado
+        faltantes = [c for c in dict.fromkeys(claves) if c not in resultados]
+        if faltantes:
+            nlp = self._cargar()
+            if nlp is None:
+                return [None] * len(claves)
+            with self._lock:
+                nuevos = [
+                    (clave, ResultadoNLP(
+                        " ".join(t.lemma_.lower() or t.lower_ for t in doc),
+                        tuple((e.text, e.label_) for e in doc.ents)
+                    ))
+                    for clave, doc in zip(faltantes, nlp.pipe(faltantes, batch_size=self.tamano_lote))
+                ]
+            with self._lock_cache:
+                for clave, resultado in nuevos:
+                    self._guardar(clave, resultado)
+            resultados.update(nuevos)
+        return [resultados.get(clave) for clave in claves]
+
+    def _guardar(self, clave: str, resultado: ResultadoNLP):
+        """Inserta en la caché LRU (con _lock_cache tomado)"""
+        self._cache[clave] = resultado
+        self._cache.move_to_end(clave)
+        while len(self._cache) > self.max_cache:
+            self._cache.popitem(last=False)
+
+# --- INSTANCIA COMPARTIDA ---
+_PARSERS = {}
+_LOCK_PARSERS = threading.Lock()
+
+def obtener_parser_respaldo(modelo: str) -> ParserRespaldo:
+    """Un único parser por modelo en todo el proceso (la carga sigue siendo perezosa)"""
+    with _LOCK_PARSERS:
+        if modelo not in _PARSERS:
+            _PARSERS[modelo] = ParserRespaldo(modelo)
+        return _PARSERS[modelo]
@@ -0,0 +1,228 @@
+# servidor.py
+"""Servicio HTTP/JSON asíncrono (solo biblioteca estándar) que expone DesignBotLLM.
+
+    python servidor.py --puerto 8080 --max-sesiones 20000 --ttl 1800 --directorio-sesiones sesiones/
+
+Endpoints:
+    POST /chat   {"sesion": "abc", "mensaje": "2 sillas"}  ->  {"sesion", "respuesta", "estado", "items", "total"}
+    GET  /salud  ->  {"estado": "ok", "sesiones": N}
+    GET  /metricas  ->  métricas en formato de texto de Prometheus (con DESIGNBOT_METRICAS=1)
+
+Si no se envía "sesion" se crea una nueva y su id vuelve en la respuesta.
+
+Los turnos del bot y los volcados de sesiones corren en un pool de hilos, así
+un turno lento (o un volcado a disco) no detiene al resto de los clientes; los
+turnos de una misma sesión se atienden de uno en uno.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import signal
+import uuid
+from typing import Dict, List, Tuple, Union
+
+from almacen import AlmacenPedidos
+from app import Configuracion, crear_despacho, precargar
+from metricas import METRICAS
+from sesiones import GestorSesiones
+
+logger = logging.getLogger(__name__)
+
+MAX_CUERPO = 64 * 1024
+MAX_CABECERAS = 100
+
+# --- HTTP ---
+class ErrorHTTP(Exception):
+    def __init__(self, estado: int, mensaje: str):
+        super().__init__(mensaje)
+        self.estado = estado
+
+MOTIVOS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           431: "Request Header Fields Too Large", 500: "Internal Server Error"}
+
+class ServidorChat:
+    def __init__(self, sesiones: GestorSesiones):
+        self.sesiones = sesiones
+        # sesion -> [lock, turnos que lo usan]; se borra cuando nadie lo espera
+        self._turnos: Dict[str, List] = {}
+
+    async def atender(self, metodo: str, ruta: str, cuerpo: bytes) -> Union[Dict, str]:
+        if ruta == "/salud":
+            return {'estado': 'ok', 'sesiones': len(self.sesiones)}
+        if ruta == "/metricas":
+            if not METRICAS.activo:
+                raise ErrorHTTP(404, "Métricas desactivadas")
+            return METRICAS.exportar_prometheus()
+        if ruta != "/chat":
+            raise ErrorHTTP(404, "Ruta no encontrada")
+        if metodo != "POST":
+            raise ErrorHTTP(405, "Usa POST")
+
+        try:
+            datos = json.loads(cuerpo or b"{}")
+            mensaje = datos["mensaje"]
+        except (ValueError, KeyError, TypeError):
+            raise ErrorHTTP(400, "Se esperaba un JSON con el campo 'mensaje'")
+        if not isinstance(mensaje, str):
+            raise ErrorHTTP(400, "'mensaje' debe ser texto")
+
+        sesion = str(datos.get("sesion") or uuid.uuid4().hex)
+        turno = self._turnos.setdefault(sesion, [asyncio.Lock(), 0])
+        turno[1] += 1
+        try:
+            async with turno[0]:
+                return await asyncio.get_running_loop().run_in_executor(None, self.procesar_turno, sesion, mensaje)
+        finally:
+            turno[1] -= 1
+            if not turno[1]:
+                del self._turnos[sesion]
+
+    def procesar_turno(self, sesion: str, mensaje: str) -> Dict:
+        bot = self.sesiones.obtener(sesion)
+        respuesta = bot.procesar_mensaje(mensaje)
+        pedido = bot.pedido_manager
+        return {
+            'sesion': sesion,
+            'respuesta': respuesta,
+            'estado': pedido.estado,
+            'items': len(pedido.items),
+            'total': pedido.calcular_total_pedido()
+        }
+
+    async def manejar_conexion(self, lector: asyncio.StreamReader, escritor: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    linea, cabeceras = await self._leer_cabeceras(lector)
+                except ErrorHTTP as error:
+                    # Tras una cabecera inválida no se sabe dónde empieza la siguiente petición
+                    estado, resultado = error.estado, {'error': str(error)}
+                    self._escribir(escritor, estado, resultado, False)
+                    await escritor.drain()
+                    break
+                if not linea:
+                    break
+                try:
+                    metodo, ruta, version = linea.decode("latin-1").split()
+                except ValueError:
+                    break
+
+                mantener = cabeceras.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                try:
+                    try:
+                        longitud = self._longitud_cuerpo(cabeceras)
+                    except ErrorHTTP:
+                        # Sin un cuerpo bien delimitado no se puede seguir leyendo la conexión
+                        mantener = False
+                        raise
+                    cuerpo = await lector.readexactly(longitud) if longitud else b""
+                    estado, resultado = 200, await self.atender(metodo, ruta.split("?")[0], cuerpo)
+                except ErrorHTTP as error:
+                    estado, resultado = error.estado, {'error': str(error)}
+                except Exception:
+                    logger.exception("Error procesando %s %s", metodo, ruta)
+                    estado, resultado = 500, {'error': "Error interno"}
+
+                self._escribir(escritor, estado, resultado, mantener)
+                await escritor.drain()
+                if not mantener:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            escritor.close()
+
+    @staticmethod
+    def _longitud_cuerpo(cabeceras: Dict[str, str]) -> int:
+        try:
+            longitud = int(cabeceras.get("content-length", 0))
+        except ValueError:
+            raise ErrorHTTP(400, "Content-Length inválido")
+        if longitud < 0:
+            raise ErrorHTTP(400, "Content-Length inválido")
+        if longitud > MAX_CUERPO:
+            raise ErrorHTTP(413, "Cuerpo demasiado grande")
+        return longitud
+
+    @staticmethod
+    async def _leer_cabeceras(lector: asyncio.StreamReader) -> Tuple[bytes, Dict[str, str]]:
+        """Línea de petición y cabeceras; ErrorHTTP 431 si alguna supera el límite del StreamReader"""
+        try:
+            linea = await lector.readline()
+            cabeceras: Dict[str, str] = {}
+            leidas = 0
+            if linea:
+                while (cabecera := await lector.readline()) not in (b"\r\n", b"\n", b""):
+                    leidas += 1
+                    if leidas > MAX_CABECERAS:
+                        raise ErrorHTTP(431, "Demasiadas cabeceras")
+                    nombre, _, valor = cabecera.decode("latin-1").partition(":")
+                    cabeceras[nombre.strip().lower()] = valor.strip()
+        except (ValueError, asyncio.LimitOverrunError):
+            # readline convierte el LimitOverrunError en ValueError cuando la línea no cabe en el búfer
+            raise ErrorHTTP(431, "Línea de petición o cabecera demasiado larga")
+        return linea, cabeceras
+
+    @staticmethod
+    def _escribir(escritor: asyncio.StreamWriter, estado: int, resultado: Union[Dict, str], mantener: bool):
+        if isinstance(resultado, str):
+            tipo, contenido = "text/plain; version=0.0.4", resultado.encode("utf-8")
+        else:
+            tipo, contenido = "application/json", json.dumps(resultado, ensure_ascii=False).encode("utf-8")
+        escritor.write(
+            f"HTTP/1.1 {estado} {MOTIVOS[estado]}\r\n"
+            f"Content-Type: {tipo}; charset=utf-8\r\n"
+            f"Content-Length: {len(contenido)}\r\n"
+            f"Connection: {'keep-alive' if mantener else 'close'}\r\n\r\n".encode("latin-1") + contenido
+        )
+
+async def servir(host: str, puerto: int, sesiones: GestorSesiones, intervalo_purga: float = 60):
+    servidor_chat = ServidorChat(sesiones)
+    servidor = await asyncio.start_server(servidor_chat.manejar_conexion, host, puerto, backlog=1024)
+    print(f"DesignBot escuchando en http://{host}:{puerto}")
+
+    async def purgar_periodicamente():
+        while True:
+            await asyncio.sleep(intervalo_purga)
+            # Los volcados a disco no pueden detener el bucle de eventos
+            await asyncio.get_running_loop().run_in_executor(None, sesiones.purgar_expiradas)
+            if Configuracion.RUTA_METRICAS:
+                METRICAS.volcar(Configuracion.RUTA_METRICAS)
+
+    purga = asyncio.create_task(purgar_periodicamente())
+    # SIGTERM cierra el servidor de forma ordenada para volcar las sesiones
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, servidor.close)
+    try:
+        async with servidor:
+            await servidor.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        purga.cancel()
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio HTTP de DesignBot")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8080)
+    parser.add_argument("--max-sesiones", type=int, default=10_000, help="Sesiones vivas como máximo (LRU)")
+    parser.add_argument("--ttl", type=float, default=1800, help="Segundos de inactividad antes de expulsar una sesión de memoria")
+    parser.add_argument("--directorio-sesiones", help="Directorio donde volcar las sesiones expulsadas (si no, se descartan)")
+    args = parser.parse_args()
+
+    # Catálogo, modelo de intenciones y spaCy se cargan antes de aceptar conexiones, no en el primer turno
+    precargar()
+    almacen = AlmacenPedidos(Configuracion.RUTA_BD_PEDIDOS)
+    despacho = crear_despacho()
+    sesiones = GestorSesiones(args.max_sesiones, args.ttl, almacen, args.directorio_sesiones, despacho=despacho)
+    try:
+        asyncio.run(servir(args.host, args.puerto, sesiones))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sesiones.volcar_todas()
+        almacen.cerrar()
+        despacho.cerrar()
+
+if __name__ == "__main__":
+    main()
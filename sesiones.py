@@ -0,0 +1,142 @@
+# sesiones.py
+"""Caché LRU de sesiones de DesignBotLLM con volcado a disco.
+
+Las sesiones inactivas o expulsadas por LRU se guardan con
+`DesignBotLLM.serializar()` en un directorio local y se restauran de forma
+perezosa con el siguiente mensaje, así la memoria residente queda acotada
+y las conversaciones sobreviven a reinicios del proceso.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from almacen import AlmacenPedidos
+from despacho import DespachoConfirmaciones
+from app import DesignBotLLM
+
+logger = logging.getLogger(__name__)
+
+class GestorSesiones:
+    """Bots vivos indexados por id de sesión, acotados por LRU y por inactividad (TTL).
+
+    Sin `directorio`, las sesiones expulsadas se descartan; con él, se vuelcan
+    a disco y los volcados más antiguos que `ttl_disco` se eliminan al purgar.
+
+    Se puede usar desde varios hilos (el servidor atiende los turnos en un pool);
+    el disco se lee y escribe fuera del lock. Quien llama debe evitar dos turnos
+    a la vez sobre la misma sesión.
+    """
+
+    def __init__(self, max_sesiones: int = 10_000, ttl: float = 1800, almacen: Optional[AlmacenPedidos] = None,
+                 directorio: Optional[str] = None, ttl_disco: float = 7 * 24 * 3600,
+                 despacho: Optional[DespachoConfirmaciones] = None):
+        self.max_sesiones = max_sesiones
+        self.ttl = ttl
+        self.almacen = almacen
+        self.despacho = despacho
+        self.directorio = directorio
+        self.ttl_disco = ttl_disco
+        # sesion -> (bot, último acceso); el orden es de menos a más reciente
+        self._sesiones: "OrderedDict[str, Tuple[DesignBotLLM, float]]" = OrderedDict()
+        # Sesiones expulsadas cuyo volcado aún se está escribiendo: si vuelven, se toman de aquí
+        self._volcando: Dict[str, DesignBotLLM] = {}
+        self._lock = threading.Lock()
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._sesiones)
+
+    def obtener(self, sesion: str) -> DesignBotLLM:
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._sesiones.pop(sesion, None)
+            bot = self._volcando.get(sesion)
+        if entrada is not None:
+            if ahora - entrada[1] > self.ttl and not self.directorio:
+                bot = DesignBotLLM(self.almacen, self.despacho)
+            else:
+                bot = entrada[0]
+        elif bot is None:
+            bot = self._restaurar(sesion) or DesignBotLLM(self.almacen, self.despacho)
+
+        with self._lock:
+            self._sesiones[sesion] = (bot, ahora)
+            expulsadas = self._sacar(lambda: len(self._sesiones) > self.max_sesiones)
+        self._volcar(expulsadas)
+        return bot
+
+    def purgar_expiradas(self):
+        """Expulsa las sesiones inactivas más de `ttl` y borra volcados viejos"""
+        limite = time.monotonic() - self.ttl
+        with self._lock:
+            expulsadas = self._sacar(lambda: self._sesiones and next(iter(self._sesiones.values()))[1] <= limite)
+        self._volcar(expulsadas)
+
+        if self.directorio:
+            limite_disco = time.time() - self.ttl_disco
+            with os.scandir(self.directorio) as entradas:
+                for entrada in entradas:
+                    if entrada.name.endswith(".ses") and entrada.stat().st_mtime < limite_disco:
+                        os.remove(entrada.path)
+
+    def volcar_todas(self):
+        """Guarda en disco todas las sesiones vivas (p. ej. antes de apagar el proceso)"""
+        with self._lock:
+            expulsadas = self._sacar(lambda: self._sesiones)
+        self._volcar(expulsadas)
+
+    def _sacar(self, condicion) -> List[Tuple[str, DesignBotLLM]]:
+        """Saca las sesiones menos recientes mientras se cumpla `condicion` (con el lock tomado)"""
+        expulsadas = []
+        while condicion():
+            sesion, (bot, _) = self._sesiones.popitem(last=False)
+            expulsadas.append((sesion, bot))
+            if self.directorio:
+                self._volcando[sesion] = bot
+        return expulsadas
+
+    def _volcar(self, expulsadas: List[Tuple[str, DesignBotLLM]]):
+        for sesion, bot in expulsadas:
+            try:
+                self._expulsar(sesion, bot)
+            finally:
+                with self._lock:
+                    if self._volcando.get(sesion) is bot:
+                        del self._volcando[sesion]
+
+    # --- DISCO ---
+    def _ruta(self, sesion: str) -> str:
+        # El id de sesión viene del cliente: se usa su hash como nombre de archivo
+        return os.path.join(self.directorio, hashlib.sha1(sesion.encode("utf-8")).hexdigest() + ".ses")
+
+    def _expulsar(self, sesion: str, bot: DesignBotLLM):
+        if not self.directorio:
+            return
+        ruta = self._ruta(sesion)
+        temporal = f"{ruta}.{threading.get_ident()}.tmp"
+        with open(temporal, "wb") as f:
+            f.write(bot.serializar())
+        os.replace(temporal, ruta)
+
+    def _restaurar(self, sesion: str) -> Optional[DesignBotLLM]:
+        if not self.directorio:
+            return None
+        ruta = self._ruta(sesion)
+        try:
+            with open(ruta, "rb") as f:
+                datos = f.read()
+        except FileNotFoundError:
+            return None
+        os.remove(ruta)
+        try:
+            return DesignBotLLM.deserializar(datos, self.almacen, self.despacho)
+        except (ValueError, KeyError, TypeError, zlib.error):
+            # Un volcado ilegible no debe tumbar el turno: la conversación empieza de nuevo
+            logger.exception("No se pudo restaurar la sesión %s; se descarta su volcado", sesion)
+            return None